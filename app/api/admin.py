@@ -8,6 +8,10 @@ from app.services.instruction_service import InstructionService
 from app.services.eval_service import EvalService
 from app.services.instruction_import_service import InstructionImportService
 from app.services.rag_engine import RAGEngine
+from app.services.intent_classifier import intent_classifier
+from app.services.message_writer import message_writer
+from app.services.response_cache import response_cache
+from app.core.single_flight import single_flight
 from app.models.base import Document, User, DocumentChunk, RAGTestRecord
 from app.api.deps import get_current_user
 from typing import List, Dict, Any, Optional
@@ -121,6 +125,51 @@ async def run_batch_eval(
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.post("/admin/intent-classifier/retrain")
+async def retrain_intent_classifier(
+    current_user: User = Depends(get_current_user)
+):
+    """Retrains the local intent classifier from benchmark cases and routed history; returns its calibration."""
+    try:
+        return await intent_classifier.retrain()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/admin/intent-classifier/stats")
+async def get_intent_classifier_stats(
+    current_user: User = Depends(get_current_user)
+):
+    return intent_classifier.stats()
+
+@router.get("/admin/message-writer/stats")
+async def get_message_writer_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """Queue depth and flush latency of the write-behind message persistence."""
+    return message_writer.stats()
+
+@router.get("/admin/response-cache/stats")
+async def get_response_cache_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """Hit rate and best-score distribution of the semantic response cache, for tuning its threshold."""
+    return response_cache.stats()
+
+@router.delete("/admin/response-cache")
+async def clear_response_cache(
+    current_user: User = Depends(get_current_user)
+):
+    """Drops every cached chat/search answer on all workers."""
+    await response_cache.clear()
+    return {"status": "cleared"}
+
+@router.get("/admin/single-flight/stats")
+async def get_single_flight_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """How many router/executor/embedding/search calls were answered by an identical in-flight call."""
+    return single_flight.stats()
+
 from app.models.rag_config import RAGConfig, RAGConfigUpdate, RAGConfigResponse
 
 @router.get("/admin/rag/config", response_model=RAGConfigResponse)
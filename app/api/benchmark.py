@@ -11,6 +11,7 @@ import io
 from app.api.deps import get_db, get_current_user
 from app.services.benchmark_service import BenchmarkService
 from app.services.instruction_matcher import matcher_service
+from app.services.semantic_instruction_index import semantic_index
 from app.models.base import User
 
 router = APIRouter()
@@ -83,7 +84,6 @@ async def apply_version(
     service = BenchmarkService(db)
     try:
         await service.set_active_version(repo_id, version)
-        await matcher_service.reload(db)
         return {"status": "success", "active_version": version}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -101,6 +101,29 @@ async def delete_version(
     count = await service.delete_version(repo_id, version)
     return {"status": "success", "deleted_count": count}
 
+@router.post("/matcher/reload")
+async def reload_matcher(
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Full rebuild of the in-memory instruction matcher on every worker (repair path; edits apply deltas).
+    """
+    await matcher_service.reload(broadcast=True)
+    return {
+        "status": "success",
+        "templates": len(matcher_service.matcher.templates),
+        "pruning": matcher_service.last_prune_report
+    }
+
+@router.get("/semantic/stats")
+async def semantic_index_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Hit-rate, latency and best-score distribution of the semantic instruction fallback.
+    """
+    return semantic_index.stats()
+
 @router.get("/versions/{repo_id}/active")
 async def get_active_version(
     repo_id: uuid.UUID,
@@ -119,7 +142,6 @@ async def create_case(
 ):
     service = BenchmarkService(db)
     result = await service.create_case(case.question, case.answer, case.intent, case.repository_id)
-    await matcher_service.reload(db)
     return result
 
 @router.put("/{case_id}", response_model=BenchmarkCaseResponse)
@@ -133,7 +155,6 @@ async def update_case(
     updated = await service.update_case(case_id, case.question, case.answer, case.intent)
     if not updated:
         raise HTTPException(status_code=404, detail="Case not found")
-    await matcher_service.reload(db)
     return updated
 
 @router.delete("/{case_id}")
@@ -146,7 +167,6 @@ async def delete_case(
     deleted = await service.delete_case(case_id)
     if not deleted:
         raise HTTPException(status_code=404, detail="Case not found")
-    await matcher_service.reload(db)
     return {"status": "success"}
 
 @router.post("/import")
@@ -163,7 +183,6 @@ async def import_excel(
     service = BenchmarkService(db)
     try:
         result = await service.import_excel(content, repository_id)
-        await matcher_service.reload(db)
         return result
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -213,7 +232,6 @@ async def generate_cases(
             model_name=request.model_name,
             count_per_instr=request.count_per_instr
         )
-        await matcher_service.reload(db)
         return {"count": count, "message": f"Successfully generated {count} instruction pairs."}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
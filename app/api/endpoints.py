@@ -5,16 +5,49 @@ from pydantic import BaseModel
 from typing import Optional, List, Dict, Any, Union
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.services.dialogue_manager import DialogueManager
+from app.services.instruction_matcher import matcher_service
 from app.db.session import get_db, AsyncSessionLocal
 from app.api.deps import get_current_user
 from app.models.base import User
 from app.core.route_logging import LoggingContextRoute
+from app.core.config import settings
 import json
 import asyncio
+import logging
+import uuid
+from contextlib import aclosing
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(route_class=LoggingContextRoute)
 dm = DialogueManager()
 
+_STREAM_END = object()
+
+
+async def _pump_stream(queue: asyncio.Queue, session_id: Optional[str], query: str, user_id: str, trace_id: Optional[str]):
+    """Runs stream_process_request on its own database session, forwarding chunks (or the error) to the queue."""
+    try:
+        async with AsyncSessionLocal() as session:
+            async with aclosing(dm.stream_process_request(session_id, query, user_id, session, trace_id=trace_id)) as stream:
+                async for chunk in stream:
+                    queue.put_nowait(chunk)
+    except Exception as e:
+        queue.put_nowait(e)
+    finally:
+        queue.put_nowait(_STREAM_END)
+
+
+async def _cancel_on_disconnect(raw_request: Request, task: asyncio.Task):
+    """Polls for the ASGI http.disconnect message and cancels the pipeline task when it arrives."""
+    while not task.done():
+        if await raw_request.is_disconnected():
+            logger.info("Client disconnected, cancelling the response stream")
+            task.cancel()
+            return
+        await asyncio.sleep(settings.STREAM_DISCONNECT_POLL_SECONDS)
+
+
 class ChatRequest(BaseModel):
     session_id: Optional[str] = None # Optional, if None create new
     query: str
@@ -24,6 +57,10 @@ class ChatResponse(BaseModel):
     code: int
     data: Dict[str, Any]
 
+class BatchMatchRequest(BaseModel):
+    repository_id: Optional[str] = None # None: global templates only
+    queries: List[str]
+
 @router.post("/chat/completions", response_model=Union[ChatResponse, Any])
 async def chat(
     request: ChatRequest, 
@@ -36,41 +73,31 @@ async def chat(
         
         if request.stream:
             async def generate():
-                # Use a new session for streaming to avoid premature closure
+                # The pipeline runs in its own task so a disconnect can cancel it wherever it waits
+                # (router, search, embedding, LLM stream), not only when a write to the client fails
+                queue: asyncio.Queue = asyncio.Queue()
+                producer = asyncio.create_task(_pump_stream(
+                    queue, request.session_id, request.query, str(current_user.id), trace_id
+                ))
+                watcher = asyncio.create_task(_cancel_on_disconnect(raw_request, producer))
                 try:
-                    async with AsyncSessionLocal() as session:
-                        async for chunk in dm.stream_process_request(
-                            request.session_id,
-                            request.query,
-                            str(current_user.id),
-                            session,
-                            trace_id=trace_id
-                        ):
-                            if isinstance(chunk, dict):
-                                # Metadata/Actions chunk
-                                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
-                            else:
-                                # Content chunk
-                                yield f"data: {json.dumps({'content': chunk}, ensure_ascii=False)}\n\n"
-                        yield "data: [DONE]\n\n"
-                except BaseException as e:
-                    # Check for cancellation/exit to avoid yielding during cleanup
-                    if isinstance(e, (GeneratorExit, asyncio.CancelledError)):
-                        # Stream cancelled by client or server shutdown
-                        return
-
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.error(f"Stream generation error: {e}", exc_info=True)
-                    
-                    try:
-                        # Send error as content to be displayed to user
-                        error_msg = f"\n\n[System Error] {str(e)}"
-                        yield f"data: {json.dumps({'content': error_msg}, ensure_ascii=False)}\n\n"
-                        yield "data: [DONE]\n\n"
-                    except BaseException:
-                        # If yielding fails (e.g. connection closed), just exit
-                        pass
+                    while (chunk := await queue.get()) is not _STREAM_END:
+                        if isinstance(chunk, Exception):
+                            logger.error(f"Stream generation error: {chunk}", exc_info=chunk)
+                            # Send error as content to be displayed to user
+                            error_msg = f"\n\n[System Error] {str(chunk)}"
+                            yield f"data: {json.dumps({'content': error_msg}, ensure_ascii=False)}\n\n"
+                        elif isinstance(chunk, dict):
+                            # Metadata/Actions chunk
+                            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                        else:
+                            # Content chunk
+                            yield f"data: {json.dumps({'content': chunk}, ensure_ascii=False)}\n\n"
+                    yield "data: [DONE]\n\n"
+                finally:
+                    # Also reached when the server notices the disconnect first (failed write, shutdown)
+                    watcher.cancel()
+                    producer.cancel()
             
             return StreamingResponse(generate(), media_type="text/event-stream")
         else:
@@ -85,3 +112,38 @@ async def chat(
             return {"code": 0, "data": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/instruction/match:batch")
+async def match_instructions_batch(
+    request: BatchMatchRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Resolves many utterances (offline command logs, repository pre-validation) through the
+    instruction matcher and the Redis instruction cache in one request. No LLM fallback.
+    """
+    if len(request.queries) > settings.INSTRUCTION_MATCH_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {settings.INSTRUCTION_MATCH_BATCH_MAX} queries per request")
+
+    repository_id = None
+    if request.repository_id:
+        try:
+            repository_id = uuid.UUID(request.repository_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid UUID")
+
+    results = await matcher_service.match_many(request.queries, repository_id)
+    hits = {"memory": 0, "redis": 0}
+    for entry in results:
+        if entry["hit_source"]:
+            hits[entry["hit_source"]] += 1
+    return {
+        "code": 0,
+        "data": {
+            "total": len(results),
+            "hits": hits,
+            "misses": len(results) - hits["memory"] - hits["redis"],
+            "results": results
+        }
+    }
@@ -162,8 +162,8 @@ async def batch_global_feedback(
             
             await db.commit()
             
-            # Trigger matcher reload (in case System Pairs were deleted)
-            await matcher_service.reload(db)
+            # Drop matcher templates (in case System Pairs were deleted)
+            await matcher_service.remove_cases(request.message_ids)
         except Exception as e:
             print(f"Error during batch delete: {e}")
             raise HTTPException(status_code=500, detail=str(e))
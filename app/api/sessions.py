@@ -4,6 +4,7 @@ from sqlalchemy.future import select
 from sqlalchemy import update, delete, or_
 from app.db.session import get_db
 from app.api.deps import get_current_user
+from app.services.session_cache import session_cache
 from app.models.base import User, Session as ChatSession
 from app.core.route_logging import LoggingContextRoute
 from pydantic import BaseModel
@@ -88,6 +89,7 @@ async def rename_session(
     
     session.name = request.name
     await db.commit()
+    await session_cache.invalidate(session_id)
     return {"status": "success", "name": session.name}
 
 @router.put("/sessions/{session_id}/config")
@@ -119,6 +121,7 @@ async def update_session_config(
     session.context = current_context
     
     await db.commit()
+    await session_cache.invalidate(session_id)
     return {"status": "success", "config": config}
 
 @router.get("/sessions/{session_id}/config")
@@ -173,6 +176,7 @@ async def delete_session(
     
     await db.delete(session)
     await db.commit()
+    await session_cache.invalidate(session_id)
     return {"status": "success"}
 
 @router.get("/sessions/{session_id}/history")
@@ -135,6 +135,87 @@ class Settings(BaseSettings):
     # Long-term memory (User Profile)
     LONG_TERM_MEMORY_ENABLE_PROFILE: bool = True  # Enable user profile tracking
 
+    # Session state cache (language / llm_config for the chat hot path; in-process LRU + Redis)
+    SESSION_CACHE_ENABLE: bool = True
+    SESSION_CACHE_TTL_SECONDS: int = 3600
+    SESSION_CACHE_LOCAL_TTL_SECONDS: int = 300  # Bounds staleness if an invalidation event is lost
+    SESSION_CACHE_MAX_ENTRIES: int = 10000
+
+    # Message write-behind (conversation messages are persisted by a background writer)
+    MESSAGE_WRITE_BEHIND_ENABLE: bool = True
+    MESSAGE_WRITE_QUEUE_MAX: int = 10000  # Bounded queue; submitters wait when it is full
+    MESSAGE_WRITE_BATCH_SIZE: int = 200  # Rows per multi-row INSERT
+    MESSAGE_WRITE_FLUSH_INTERVAL_MS: int = 50  # Max time a batch waits to fill up
+    MESSAGE_EMBED_BATCH_SIZE: int = 64
+
+    # Streaming responses
+    STREAM_DISCONNECT_POLL_SECONDS: float = 0.25  # How often a streaming request checks for a client disconnect
+
+    # Prompt token budgets (system prompt, retrieved context, history and memory per LLM call)
+    CONTEXT_DEFAULT_BUDGET_TOKENS: int = 8192  # Prompt + response, for models not in CONTEXT_MODEL_BUDGETS
+    CONTEXT_MODEL_BUDGETS: Dict[str, int] = {}  # Model name prefix -> tokens, e.g. {"gpt-4o": 16384}
+    CONTEXT_RESPONSE_RESERVE_TOKENS: int = 1024  # Kept free for the answer
+    CONTEXT_SHARE_RETRIEVED: float = 0.5  # Shares of what the system prompt and query leave;
+    CONTEXT_SHARE_HISTORY: float = 0.3  # unused share goes to retrieved, then history, then memory
+    CONTEXT_SHARE_MEMORY: float = 0.2
+    CONTEXT_MIN_TRUNCATED_TOKENS: int = 32  # An item that would be cut shorter than this is dropped instead
+
+    # Prompts (app/config/prompts.json)
+    PROMPTS_RELOAD_INTERVAL_SECONDS: float = 2.0  # How often to check the file for edits; 0 disables hot-reload
+
+    # Instruction matcher
+    INSTRUCTION_MATCHER_SNAPSHOT_PATH: Optional[str] = "data/instruction_matcher.snapshot"  # Empty to disable the cold-start snapshot
+    INSTRUCTION_SLOT_MAX_CHARS: int = 32  # Max length of a free-text slot (longer values seen in the pair itself still fit)
+    INSTRUCTION_TEMPLATE_MAX_COST: int = 5000000  # Backtracking budget per template (~1 ms worst case); costlier text slots stay literal
+    INSTRUCTION_MATCH_SLOW_MS: float = 20.0  # A template this slow on repeated matches is quarantined
+    INSTRUCTION_MATCH_BATCH_MAX: int = 10000  # Max utterances per /instruction/match:batch request
+    INSTRUCTION_PRESELECT_ENABLE: bool = True  # Send the executor LLM only the instructions relevant to the query
+    INSTRUCTION_PRESELECT_TOP_K: int = 15  # Repositories this small always get the full catalogue
+    INSTRUCTION_PRESELECT_MIN_SCORE: float = 0.3  # Below this best score the full catalogue is sent
+    INSTRUCTION_PRESELECT_EMBEDDINGS: bool = True  # Blend embedding similarity into the keyword score
+    INSTRUCTION_PRESELECT_EMBEDDING_WEIGHT: float = 0.6
+
+    # Semantic instruction fallback (embedding nearest neighbour over liked/system pairs)
+    SEMANTIC_INSTRUCTION_ENABLE: bool = False  # Embeds the whole pair library, so opt-in
+    SEMANTIC_INSTRUCTION_THRESHOLD: float = 0.92  # Min cosine similarity to reuse a pair's answer
+    SEMANTIC_INSTRUCTION_EMBED_BATCH: int = 128
+
+    # Local intent classifier (answers confident routing decisions without the router LLM)
+    INTENT_CLASSIFIER_ENABLE: bool = True  # Has no effect until a model is trained via /admin/intent-classifier/retrain
+    INTENT_CLASSIFIER_PATH: Optional[str] = "data/intent_classifier.npz"
+    INTENT_CLASSIFIER_TARGET_PRECISION: float = 0.97  # Held-out precision the confidence threshold is tuned for
+    INTENT_CLASSIFIER_MIN_SAMPLES: int = 200
+    INTENT_CLASSIFIER_MAX_MESSAGES: int = 50000  # Most recent routed answers used for training
+    INTENT_CLASSIFIER_FEATURES: int = 131072  # Hashed char n-gram buckets (power of two)
+
+    # Router decision cache (in-process LRU + Redis)
+    INTENT_CACHE_ENABLE: bool = True
+    INTENT_CACHE_TTL_SECONDS: int = 86400
+    INTENT_CACHE_MAX_ENTRIES: int = 10000  # In-process LRU size per worker
+
+    # Semantic response cache (chat/search answers reused for near-identical first-turn questions)
+    RESPONSE_CACHE_ENABLE: bool = False  # Adds a query embedding call to chat/search requests, so opt-in
+    RESPONSE_CACHE_THRESHOLD: float = 0.95  # Min cosine similarity to reuse an answer
+    RESPONSE_CACHE_CHAT_TTL_SECONDS: int = 604800  # Chat answers age slowly
+    RESPONSE_CACHE_SEARCH_TTL_SECONDS: int = 1800  # Search answers quote live web results
+    RESPONSE_CACHE_MAX_ENTRIES: int = 20000  # In-process index size per worker
+    RESPONSE_CACHE_REPLAY_CHUNK_CHARS: int = 16  # Cached answers are streamed back in chunks of this size
+
+    # Single-flight: identical concurrent router/executor/embedding/search calls share one upstream call
+    SINGLE_FLIGHT_ENABLE: bool = True
+
+    # Tracing (per-stage spans in the response metadata, exported as OTLP/JSON)
+    TRACING_ENABLE: bool = True
+    TRACING_EXPORT_PATH: Optional[str] = None  # e.g. logs/traces.otlp.jsonl: one ExportTraceServiceRequest per line
+    TRACING_EXPORT_MAX_BYTES: int = 100 * 1024 * 1024  # The file is rotated to <path>.1 (replacing it) past this size
+    TRACING_OTLP_ENDPOINT: Optional[str] = None  # e.g. http://localhost:4318/v1/traces
+    TRACING_EXPORT_INTERVAL_SECONDS: float = 5.0
+    TRACING_EXPORT_QUEUE_MAX: int = 10000  # Traces waiting for export; the oldest are dropped beyond this
+
+    # Cross-worker cache invalidation (Redis pub/sub)
+    INVALIDATION_BUS_ENABLE: bool = True  # Propagate matcher/cache changes to other workers
+    INVALIDATION_CHANNEL: str = "audio_ai:invalidation"
+
     @field_validator("*", mode="before")
     def empty_str_to_none(cls, v: Any) -> Any:
         if isinstance(v, str) and v.strip() == "":
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.redis import RedisClient
+
+logger = logging.getLogger(__name__)
+
+# INCR + PUBLISH in one atomic step, so messages of a scope are published in version order
+_PUBLISH_SCRIPT = """
+local v = redis.call('INCR', KEYS[1])
+redis.call('PUBLISH', ARGV[1], v .. '|' .. ARGV[2])
+return v
+"""
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+Resync = Callable[[], Awaitable[None]]
+
+
+class InvalidationBus:
+    """
+    Cross-worker invalidation channel over Redis pub/sub.
+
+    Every event belongs to a (topic, scope) pair, e.g. ("matcher", <repository_id>), and carries a
+    monotonically increasing per-scope version. Workers apply events from other workers through the
+    registered handlers; a version gap (missed message) or a reconnect triggers the topic's resync
+    callback instead, so a worker never silently keeps stale state.
+    """
+
+    def __init__(self):
+        self.channel = settings.INVALIDATION_CHANNEL
+        self.worker_id = uuid.uuid4().hex
+        self._handlers: Dict[str, List[Tuple[Handler, Optional[Resync]]]] = {}
+        self._versions: Dict[Tuple[str, str], int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Event] = None
+
+    def register(self, topic: str, handler: Handler, resync: Optional[Resync] = None):
+        """Registers an async handler for remote events of a topic and an optional full-resync callback."""
+        self._handlers.setdefault(topic, []).append((handler, resync))
+
+    async def publish(self, topic: str, scope: Any, payload: Dict[str, Any]) -> Optional[int]:
+        """Publishes an event to the other workers. Returns its version, or None if not published."""
+        if not settings.INVALIDATION_BUS_ENABLE:
+            return None
+        scope = self._scope(scope)
+        body = json.dumps(
+            {"topic": topic, "scope": scope, "origin": self.worker_id, "payload": payload},
+            ensure_ascii=False,
+            default=str
+        )
+        try:
+            redis = RedisClient.get_instance()
+            version = await redis.eval(_PUBLISH_SCRIPT, 1, f"invalidation_version:{topic}:{scope}", self.channel, body)
+            return int(version)
+        except Exception as e:
+            logger.error(f"Failed to publish invalidation {topic}/{scope}: {e}")
+            return None
+
+    async def start(self):
+        if not settings.INVALIDATION_BUS_ENABLE or self._task is not None:
+            return
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self._listen())
+        # Subscribe before the caller builds its caches so no event falls in between
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=5.0)
+        except asyncio.TimeoutError:
+            logger.warning("Invalidation bus not subscribed yet, continuing startup.")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    @staticmethod
+    def _scope(scope: Any) -> str:
+        return "global" if scope is None else str(scope)
+
+    async def _listen(self):
+        backoff = 1.0
+        connected_before = False
+        while True:
+            pubsub = None
+            try:
+                pubsub = RedisClient.get_instance().pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(self.channel)
+                if connected_before:
+                    # Events published while we were disconnected are lost
+                    await self._resync_all()
+                connected_before = True
+                backoff = 1.0
+                self._ready.set()
+
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        await self._dispatch(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Invalidation bus connection lost: {e}. Retrying in {backoff:.0f}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+
+    async def _dispatch(self, raw: str):
+        try:
+            version_str, _, body = raw.partition("|")
+            version = int(version_str)
+            event = json.loads(body)
+        except Exception as e:
+            logger.warning(f"Ignoring malformed invalidation message: {e}")
+            return
+
+        topic = event.get("topic")
+        key = (topic, event.get("scope"))
+        last = self._versions.get(key)
+        if last is not None and version <= last:
+            return  # Duplicate or stale
+        self._versions[key] = version
+        gap = last is not None and version > last + 1
+
+        if event.get("origin") == self.worker_id and not gap:
+            return  # Already applied locally
+
+        for handler, resync in self._handlers.get(topic, []):
+            try:
+                if gap and resync is not None:
+                    logger.warning(f"Invalidation version gap on {key} ({last} -> {version}), resyncing.")
+                    await resync()
+                else:
+                    await handler(event.get("payload") or {})
+            except Exception as e:
+                logger.error(f"Invalidation handler for {topic} failed: {e}")
+
+    async def _resync_all(self):
+        for topic, entries in self._handlers.items():
+            for _, resync in entries:
+                if resync is None:
+                    continue
+                try:
+                    await resync()
+                except Exception as e:
+                    logger.error(f"Invalidation resync for {topic} failed: {e}")
+
+
+invalidation_bus = InvalidationBus()
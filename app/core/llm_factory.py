@@ -289,6 +289,27 @@ class LLMFactory:
             logger.error(f"Failed to create LLM for provider {provider}: {e}")
             raise
 
+    @staticmethod
+    def fingerprint(llm: Any) -> dict:
+        """
+        The resolved configuration of an LLM instance (provider class, model, endpoint, temperature),
+        read from the instance itself so it reflects session overrides and USE_GLOBAL_ENDPOINTS.
+        Calls with equal fingerprints and equal messages produce interchangeable answers.
+        """
+        def first(*names):
+            for name in names:
+                value = getattr(llm, name, None)
+                if value:
+                    return str(value)
+            return None
+
+        return {
+            "provider": type(llm).__name__,
+            "model": first("model_name", "model", "deployment_name"),
+            "base_url": first("openai_api_base", "azure_endpoint", "base_url", "endpoint", "spark_api_url"),
+            "temperature": getattr(llm, "temperature", None),
+        }
+
     @staticmethod
     def get_llm_for_scenario(scenario: str, config: Optional[dict] = None):
         """
@@ -0,0 +1,85 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+from app.core.config import settings
+from app.core.tracing import span
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls (router, executor, embedding, search). The first caller of
+    a key runs the call in its own task; callers arriving while it is in flight await that task
+    instead of calling again. Results are shared, so callers must not mutate them. A caller going
+    away (client disconnect) does not cancel the call while others still wait for it.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        """Digest of the parts that determine the call's result."""
+        raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def run(self, kind: str, key: str, call: Callable[[], Awaitable[T]]) -> T:
+        if not settings.SINGLE_FLIGHT_ENABLE:
+            return await call()
+        stats = self._stats.setdefault(kind, {"calls": 0, "coalesced": 0})
+        stats["calls"] += 1
+        flight_key = f"{kind}:{key}"
+        flight = self._flights.get(flight_key)
+        if flight is not None and (flight.task.done() or flight.task.cancelling()):
+            # Finished or abandoned: its done-callback has not run yet, but it must not be joined
+            flight = None
+        coalesced = flight is not None
+        if coalesced:
+            stats["coalesced"] += 1
+        else:
+            flight = _Flight(asyncio.ensure_future(call()))
+            self._flights[flight_key] = flight
+            flight.task.add_done_callback(lambda _: self._finished(flight_key, flight))
+
+        flight.waiters += 1
+        try:
+            with span("single_flight.wait", kind=kind) if coalesced else contextlib.nullcontext():
+                return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                # Unregister first, so a caller arriving before the done-callback starts a new call
+                self._finished(flight_key, flight)
+                flight.task.cancel()
+
+    def _finished(self, flight_key: str, flight: _Flight):
+        if self._flights.get(flight_key) is flight:
+            del self._flights[flight_key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Calls and coalesced calls (answered by another caller's in-flight call) per kind."""
+        return {
+            "enabled": settings.SINGLE_FLIGHT_ENABLE,
+            "in_flight": len(self._flights),
+            "coalesced": sum(s["coalesced"] for s in self._stats.values()),
+            "kinds": {kind: dict(s) for kind, s in self._stats.items()}
+        }
+
+
+single_flight = SingleFlight()
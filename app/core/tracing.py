@@ -0,0 +1,258 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """One timed stage. Use as a context manager; nesting follows the asyncio context (tasks inherit it)."""
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error", "_parent")
+
+    def __init__(self, trace: "Trace", name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns: Optional[int] = None
+        self._parent = parent
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def __enter__(self) -> "Span":
+        _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.perf_counter_ns()
+        if exc_type is not None:
+            self.error = "cancelled" if issubclass(exc_type, asyncio.CancelledError) else f"{exc_type.__name__}: {exc}"
+        # Set the parent back rather than resetting a token: a span may close in another context
+        # (async generators, tasks), where a token reset would raise
+        _current_span.set(self._parent)
+        return False
+
+
+class _NoopSpan:
+    """Returned when there is no active trace, so instrumented code costs one ContextVar read."""
+    __slots__ = ()
+
+    def set(self, key: str, value: Any):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class Trace:
+    """All spans of one request. finish() closes it, queues it for export and returns the span tree."""
+
+    def __init__(self, name: str, trace_id: Optional[str], attributes: Dict[str, Any]):
+        try:
+            self.trace_id = uuid.UUID(str(trace_id)).hex
+        except ValueError:
+            self.trace_id = uuid.uuid4().hex
+        self.wall_start_ns = time.time_ns()
+        self.spans: List[Span] = []
+        self.closed = False
+        self.root = Span(self, name, None, attributes)
+        self.spans.append(self.root)
+        _current_trace.set(self)
+        _current_span.set(self.root)
+
+    def _unix_ns(self, perf_ns: int) -> int:
+        return self.wall_start_ns + (perf_ns - self.root.start_ns)
+
+    def finish(self) -> Dict[str, Any]:
+        if not self.closed:
+            self.closed = True
+            self.root.end_ns = time.perf_counter_ns()
+            if _current_trace.get() is self:
+                _current_trace.set(None)
+                _current_span.set(None)
+            span_exporter.enqueue(self)
+        return self.tree()
+
+    def tree(self) -> Dict[str, Any]:
+        """Nested {name, start_ms, ms, children} timings; spans still open at finish are marked unfinished."""
+        nodes: Dict[str, Dict[str, Any]] = {}
+        children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+        base = self.root.start_ns
+        end = self.root.end_ns or time.perf_counter_ns()
+        for s in self.spans:
+            node = {
+                "name": s.name,
+                "start_ms": round((s.start_ns - base) / 1e6, 2),
+                "ms": round(((s.end_ns or end) - s.start_ns) / 1e6, 2)
+            }
+            if s.attributes:
+                node["attributes"] = s.attributes
+            if s.end_ns is None:
+                node["unfinished"] = True
+            if s.error:
+                node["error"] = s.error
+            nodes[s.span_id] = node
+            children.setdefault(s.parent_id, []).append(node)
+        for span_id, node in nodes.items():
+            if span_id in children:
+                node["children"] = children[span_id]
+        return nodes[self.root.span_id]
+
+
+def start_trace(name: str, trace_id: Optional[str] = None, **attributes) -> Optional[Trace]:
+    """Starts the request's trace in the current context. Returns None when tracing is disabled."""
+    if not settings.TRACING_ENABLE:
+        return None
+    return Trace(name, trace_id, attributes)
+
+
+def span(name: str, **attributes):
+    """A child span of the current span, or a no-op outside a trace."""
+    trace = _current_trace.get()
+    if trace is None or trace.closed:
+        return _NOOP
+    s = Span(trace, name, _current_span.get(), attributes)
+    trace.spans.append(s)
+    return s
+
+
+def traced(name: str):
+    """Decorator wrapping an async function in a span."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class SpanExporter:
+    """
+    Batches finished traces into OTLP/JSON ExportTraceServiceRequest documents, appended as one line
+    per batch to TRACING_EXPORT_PATH (rotated past TRACING_EXPORT_MAX_BYTES) and/or POSTed to an
+    OTLP/HTTP collector (TRACING_OTLP_ENDPOINT). Both are opt-in.
+    The queue is bounded; the oldest traces are dropped when the exporter falls behind.
+    """
+
+    def __init__(self):
+        self._queue: deque = deque(maxlen=settings.TRACING_EXPORT_QUEUE_MAX)
+        self._task: Optional[asyncio.Task] = None
+        self.exported = 0
+        self.dropped = 0
+
+    def enqueue(self, trace: Trace):
+        if not (settings.TRACING_EXPORT_PATH or settings.TRACING_OTLP_ENDPOINT):
+            return
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append(trace)
+
+    def _document(self, traces: List[Trace]) -> Dict[str, Any]:
+        spans = []
+        for trace in traces:
+            end = trace.root.end_ns
+            for s in trace.spans:
+                otlp = {
+                    "traceId": trace.trace_id,
+                    "spanId": s.span_id,
+                    "name": s.name,
+                    "kind": 1,  # SPAN_KIND_INTERNAL
+                    "startTimeUnixNano": str(trace._unix_ns(s.start_ns)),
+                    "endTimeUnixNano": str(trace._unix_ns(s.end_ns or end)),
+                    "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+                    "status": {"code": 2, "message": s.error} if s.error else {"code": 1}
+                }
+                if s.parent_id:
+                    otlp["parentSpanId"] = s.parent_id
+                spans.append(otlp)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": settings.PROJECT_NAME}}]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}]
+        }]}
+
+    def _append(self, line: str):
+        directory = os.path.dirname(settings.TRACING_EXPORT_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        try:
+            if os.path.getsize(settings.TRACING_EXPORT_PATH) >= settings.TRACING_EXPORT_MAX_BYTES:
+                # Keep one previous file, so disk use stays under twice the limit
+                os.replace(settings.TRACING_EXPORT_PATH, settings.TRACING_EXPORT_PATH + ".1")
+        except FileNotFoundError:
+            pass
+        with open(settings.TRACING_EXPORT_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    async def flush(self):
+        if not self._queue:
+            return
+        traces = [self._queue.popleft() for _ in range(len(self._queue))]
+        document = self._document(traces)
+        try:
+            if settings.TRACING_EXPORT_PATH:
+                await asyncio.to_thread(self._append, json.dumps(document, ensure_ascii=False, default=str))
+            if settings.TRACING_OTLP_ENDPOINT:
+                async with httpx.AsyncClient(timeout=5.0) as client:
+                    response = await client.post(settings.TRACING_OTLP_ENDPOINT, json=json.loads(json.dumps(document, default=str)))
+                    response.raise_for_status()
+            self.exported += len(traces)
+        except Exception as e:
+            logger.warning(f"Failed to export {len(traces)} traces: {e}")
+
+    async def start(self):
+        if self._task is not None or not settings.TRACING_ENABLE:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.TRACING_EXPORT_INTERVAL_SECONDS)
+            await self.flush()
+
+
+span_exporter = SpanExporter()
@@ -1,3 +1,4 @@
+import asyncio
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from app.api.endpoints import router as api_router
@@ -11,19 +12,57 @@ from app.api.benchmark import router as benchmark_router
 from app.core.config import settings
 from app.core.redis import RedisClient
 from fastapi.middleware.cors import CORSMiddleware
+from app.core.invalidation import invalidation_bus
 from app.services.instruction_matcher import matcher_service
-from app.db.session import AsyncSessionLocal
+from app.services.semantic_instruction_index import semantic_index
+from app.services.prompt_registry import prompt_registry
+from app.services.intent_classifier import intent_classifier
+from app.services.message_writer import message_writer
+from app.services.response_cache import response_cache
+from app.services.context_assembler import context_assembler
+from app.core.tracing import span_exporter
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     try:
-        async with AsyncSessionLocal() as db:
-            await matcher_service.reload(db)
+        # Subscribe first so changes made by other workers during the build are not missed
+        await invalidation_bus.start()
+    except Exception as e:
+        print(f"Failed to start invalidation bus: {e}")
+    try:
+        await matcher_service.reload(warm=True)
     except Exception as e:
         print(f"Failed to load instruction matcher: {e}")
+    try:
+        await semantic_index.load_liked()
+    except Exception as e:
+        print(f"Failed to load liked pairs into semantic index: {e}")
+    try:
+        await intent_classifier.load()
+    except Exception as e:
+        print(f"Failed to load intent classifier: {e}")
+    try:
+        await response_cache.load()
+    except Exception as e:
+        print(f"Failed to load response cache: {e}")
+    try:
+        # tiktoken reads (or downloads) its BPE files synchronously: keep that off the event loop
+        await asyncio.to_thread(context_assembler.warm_up)
+    except Exception as e:
+        print(f"Failed to load tokenizer encodings: {e}")
+    await message_writer.start()
+    await span_exporter.start()
+    # Picks up prompts.json edits without a restart
+    await prompt_registry.start()
     yield
     # Shutdown
+    await prompt_registry.stop()
+    # Persist queued messages before the database and Redis go away
+    await message_writer.stop()
+    await span_exporter.stop()
+    await invalidation_bus.stop()
+    await semantic_index.stop()
     await RedisClient.close()
 
 app = FastAPI(title=settings.PROJECT_NAME, lifespan=lifespan)
@@ -86,13 +86,13 @@ class BenchmarkService:
         await self.db.commit()
         await self.db.refresh(case)
         
-        # Trigger matcher reload
+        # Apply matcher delta
         try:
             from app.services.instruction_matcher import matcher_service
-            await matcher_service.reload(self.db)
+            await matcher_service.add_case(case)
         except Exception as e:
             # Log error but don't fail the request
-            print(f"Failed to reload matcher after create_case: {e}")
+            print(f"Failed to update matcher after create_case: {e}")
 
         return case
 
@@ -113,12 +113,15 @@ class BenchmarkService:
         await self.db.commit()
         await self.db.refresh(case)
 
-        # Trigger matcher reload
+        # Apply matcher delta
         try:
             from app.services.instruction_matcher import matcher_service
-            await matcher_service.reload(self.db)
+            active_version = None
+            if case.source == 'system' and case.repository_id:
+                active_version = await self.get_active_version(case.repository_id)
+            await matcher_service.replace_case(case, active_version)
         except Exception as e:
-            print(f"Failed to reload matcher after update_case: {e}")
+            print(f"Failed to update matcher after update_case: {e}")
 
         return case
 
@@ -128,15 +131,16 @@ class BenchmarkService:
         case = result.scalar_one_or_none()
         if not case:
             return False
+        case_id = case.id
         await self.db.delete(case)
         await self.db.commit()
 
-        # Trigger matcher reload
+        # Apply matcher delta
         try:
             from app.services.instruction_matcher import matcher_service
-            await matcher_service.reload(self.db)
+            await matcher_service.remove_case(case_id)
         except Exception as e:
-            print(f"Failed to reload matcher after delete_case: {e}")
+            print(f"Failed to update matcher after delete_case: {e}")
 
         return True
 
@@ -150,10 +154,12 @@ class BenchmarkService:
             BenchmarkCase.repository_id == repository_id,
             BenchmarkCase.version == version,
             BenchmarkCase.source == 'system'
-        )
+        ).returning(BenchmarkCase.id)
         result = await self.db.execute(stmt)
-        deleted_count = result.rowcount
+        deleted_ids = result.scalars().all()
+        deleted_count = len(deleted_ids)
         await self.db.commit()
+        new_active_version = None
 
         # 2. Check if active version was deleted and handle fallback
         repo_stmt = select(InstructionRepository).where(InstructionRepository.id == repository_id)
@@ -173,13 +179,16 @@ class BenchmarkService:
             repo.active_system_version = max_ver if max_ver is not None else 0
             await self.db.commit()
             await self.db.refresh(repo)
+            new_active_version = repo.active_system_version
 
-        # 3. Trigger matcher reload
+        # 3. Apply matcher delta: drop the deleted cases, load the fallback version if it changed
         try:
             from app.services.instruction_matcher import matcher_service
-            await matcher_service.reload(self.db)
+            await matcher_service.remove_cases(deleted_ids)
+            if new_active_version:
+                await matcher_service.switch_version(self.db, repository_id, None, new_active_version)
         except Exception as e:
-            print(f"Failed to reload matcher after delete_version: {e}")
+            print(f"Failed to update matcher after delete_version: {e}")
 
         return deleted_count
 
@@ -194,6 +203,7 @@ class BenchmarkService:
             raise ValueError(f"Missing required columns: {required_cols}")
 
         count = 0
+        created = []
         for _, row in df.iterrows():
             question = str(row['question']).strip()
             answer = str(row['answer']).strip()
@@ -208,9 +218,19 @@ class BenchmarkService:
                     source='manual'
                 )
                 self.db.add(case)
+                created.append(case)
                 count += 1
         
         await self.db.commit()
+
+        # Apply matcher delta
+        try:
+            from app.services.instruction_matcher import matcher_service
+            for case in created:
+                await matcher_service.add_case(case)
+        except Exception as e:
+            print(f"Failed to update matcher after import_excel: {e}")
+
         return {"count": count}
 
     async def export_excel(self, repository_id: Optional[uuid.UUID] = None) -> bytes:
@@ -271,10 +291,18 @@ class BenchmarkService:
         res = await self.db.execute(stmt_update)
         repo = res.scalar_one_or_none()
         if repo:
+            old_version = repo.active_system_version
             repo.active_system_version = version
             await self.db.commit()
             await self.db.refresh(repo)
 
+            # Apply matcher delta; the version is already committed, so a failure must not fail the request
+            try:
+                from app.services.instruction_matcher import matcher_service
+                await matcher_service.switch_version(self.db, repository_id, old_version, version)
+            except Exception as e:
+                print(f"Failed to update matcher after set_active_version: {e}")
+
     async def generate_system_pairs(
         self, 
         repo_id: uuid.UUID, 
@@ -428,8 +456,16 @@ Output JSON list: [ {{"question": "...", "answer": {{"name": "{instr_name}", "pa
 
         # 6. Commit new data
         if total_generated > 0:
+            old_version = repo.active_system_version
             repo.active_system_version = new_version
             await self.db.commit()
+
+            # Apply matcher delta before old versions are cleaned up (their ids are needed)
+            try:
+                from app.services.instruction_matcher import matcher_service
+                await matcher_service.switch_version(self.db, repo_id, old_version, new_version)
+            except Exception as e:
+                print(f"Failed to update matcher after generate_system_pairs: {e}")
             
             # 7. Cleanup old versions (Keep top 5)
             # Find versions to delete
@@ -452,41 +488,3 @@ Output JSON list: [ {{"question": "...", "answer": {{"name": "{instr_name}", "pa
                 await self.db.commit()
 
         return total_generated
-
-    async def delete_version(self, repository_id: uuid.UUID, version: int) -> int:
-        # Delete cases
-        stmt = delete(BenchmarkCase).where(
-            BenchmarkCase.repository_id == repository_id,
-            BenchmarkCase.version == version,
-            BenchmarkCase.source == 'system'
-        )
-        result = await self.db.execute(stmt)
-        deleted_count = result.rowcount
-        await self.db.commit()
-
-        # Check if active version was deleted
-        repo_stmt = select(InstructionRepository).where(InstructionRepository.id == repository_id)
-        repo_res = await self.db.execute(repo_stmt)
-        repo = repo_res.scalar_one_or_none()
-        
-        if repo and repo.active_system_version == version:
-            # Fallback to max version remaining
-            ver_stmt = select(func.max(BenchmarkCase.version)).where(
-                BenchmarkCase.repository_id == repository_id,
-                BenchmarkCase.source == 'system'
-            )
-            ver_res = await self.db.execute(ver_stmt)
-            max_ver = ver_res.scalar()
-            
-            repo.active_system_version = max_ver if max_ver is not None else 0
-            await self.db.commit()
-            await self.db.refresh(repo)
-
-        # Trigger matcher reload
-        try:
-            from app.services.instruction_matcher import matcher_service
-            await matcher_service.reload(self.db)
-        except Exception as e:
-            print(f"Failed to reload matcher after delete_version: {e}")
-
-        return deleted_count
@@ -0,0 +1,264 @@
+import json
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+import tiktoken
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+TOKENS_PER_MESSAGE = 4  # Chat-format framing (role, separators) around every message
+TRUNCATION_MARK = "…"
+
+# Budget sections in priority order: leftover budget goes to the earlier ones first
+SECTIONS = ("retrieved", "history", "memory")
+
+_CJK = "　-鿿가-힯＀-￯"
+_APPROX_PIECES = re.compile(f"[{_CJK}]|[^{_CJK}]{{1,4}}")
+
+
+class _ApproxEncoding:
+    """Used when the tiktoken BPE files can't be loaded (offline): one token per CJK character or 4 other characters."""
+    name = "approx"
+
+    def encode(self, text: str, **kwargs) -> List[str]:
+        return _APPROX_PIECES.findall(text)
+
+    def decode(self, tokens: List[str]) -> str:
+        return "".join(tokens)
+
+
+class Tokenizer:
+    """Token counting and truncation with one model's encoding."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=())) if text else 0
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Keeps the first max_tokens tokens (including the truncation mark)."""
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max(max_tokens - 1, 0)]) + TRUNCATION_MARK
+
+
+class ContextItem:
+    """
+    One retrieved unit (a RAG chunk, a search result). Plain text is truncated at its tail; a JSON
+    item (`data` set) keeps its other fields and has only `field` truncated, so it stays valid JSON.
+    """
+    __slots__ = ("text", "data", "field")
+
+    def __init__(self, text: str, data: Optional[Dict[str, Any]] = None, field: Optional[str] = None):
+        self.text = text
+        self.data = data
+        self.field = field
+
+    @classmethod
+    def json(cls, data: Dict[str, Any], field: str = "content") -> "ContextItem":
+        return cls(json.dumps(data, ensure_ascii=False), data, field)
+
+    def shrink(self, tokenizer: Tokenizer, max_tokens: int) -> Optional[str]:
+        if self.data is None:
+            return tokenizer.truncate(self.text, max_tokens)
+        value = str(self.data.get(self.field) or "")
+        # JSON escaping can add tokens, so re-measure and tighten a couple of times
+        limit = max_tokens - tokenizer.count(json.dumps({**self.data, self.field: ""}, ensure_ascii=False))
+        for _ in range(3):
+            if limit <= 0:
+                return None
+            text = json.dumps({**self.data, self.field: tokenizer.truncate(value, limit)}, ensure_ascii=False)
+            excess = tokenizer.count(text) - max_tokens
+            if excess <= 0:
+                return text
+            limit -= excess
+        return None
+
+
+class AssembledContext:
+    def __init__(self, system_prompt: str, history: List[Dict[str, Any]], report: Dict[str, Any]):
+        self.system_prompt = system_prompt
+        self.history = history
+        self.report = report
+
+
+class ContextAssembler:
+    """
+    Fits an LLM prompt into the model's token budget (CONTEXT_MODEL_BUDGETS, else CONTEXT_DEFAULT_BUDGET_TOKENS,
+    minus CONTEXT_RESPONSE_RESERVE_TOKENS for the answer).
+
+    The system template and the query are always sent. The rest of the budget is shared between
+    retrieved context, short-term history and mid-term memory (CONTEXT_SHARE_*); whatever a section
+    does not need goes to the others in that priority order. Within a section, retrieved items are
+    kept in rank order, history newest first and memory in relevance order; the first item that does
+    not fit is truncated (if at least CONTEXT_MIN_TRUNCATED_TOKENS of it would remain) and the rest dropped.
+    """
+
+    def __init__(self):
+        self._tokenizers: Dict[str, Tokenizer] = {}
+        self._encodings: Dict[str, Any] = {}
+
+    def warm_up(self):
+        """
+        Loads the encodings of the configured models (and the cl100k fallback) ahead of traffic.
+        Loading reads or downloads BPE files, so call it off the event loop (asyncio.to_thread).
+        """
+        models = {
+            settings.DEFAULT_LLM_MODEL, settings.DEFAULT_LLM_MODEL_en, settings.INTENT_LLM_MODEL,
+            settings.INSTRUCTION_LLM_MODEL, settings.RAG_LLM_MODEL, settings.CHAT_LLM_MODEL, settings.SEARCH_LLM_MODEL
+        }
+        self._encoding("cl100k_base")
+        for model in filter(None, models):
+            self.tokenizer(model)
+
+    def _encoding(self, name: str):
+        # Normally filled by warm_up(); a model first seen at request time loads its encoding here
+        if name not in self._encodings:
+            try:
+                self._encodings[name] = tiktoken.get_encoding(name)
+            except Exception as e:
+                logger.warning(f"tiktoken encoding {name} unavailable, approximating token counts: {e}")
+                self._encodings[name] = _ApproxEncoding()
+        return self._encodings[name]
+
+    def tokenizer(self, model: Optional[str]) -> Tokenizer:
+        model = model or ""
+        tokenizer = self._tokenizers.get(model)
+        if tokenizer is None:
+            try:
+                name = tiktoken.encoding_name_for_model(model)
+            except KeyError:
+                # Non-OpenAI models: cl100k is a fair approximation for budgeting
+                name = "cl100k_base"
+            tokenizer = self._tokenizers[model] = Tokenizer(self._encoding(name))
+        return tokenizer
+
+    def budget(self, model: Optional[str]) -> int:
+        """Prompt tokens allowed for the model: the longest matching CONTEXT_MODEL_BUDGETS prefix, minus the response reserve."""
+        total = settings.CONTEXT_DEFAULT_BUDGET_TOKENS
+        matched = ""
+        for prefix, tokens in (settings.CONTEXT_MODEL_BUDGETS or {}).items():
+            if (model or "").startswith(prefix) and len(prefix) > len(matched):
+                matched, total = prefix, tokens
+        return max(total - settings.CONTEXT_RESPONSE_RESERVE_TOKENS, 0)
+
+    def _fill(self, tokenizer: Tokenizer, texts: List[str], costs: List[int], allowance: int,
+              shrink: Callable[[int, int], Optional[str]]) -> List[str]:
+        """Takes texts in order while they fit; the first that does not is shrunk to the remainder, if worth it."""
+        kept = []
+        for i, (text, cost) in enumerate(zip(texts, costs)):
+            if cost <= allowance:
+                kept.append(text)
+                allowance -= cost
+                continue
+            if allowance >= settings.CONTEXT_MIN_TRUNCATED_TOKENS:
+                shrunk = shrink(i, allowance)
+                if shrunk:
+                    kept.append(shrunk)
+            break
+        return kept
+
+    def assemble(self, model: Optional[str], render_system: Callable[[str], str], query: str,
+                 history: List[Dict[str, Any]], memory: List[Dict[str, Any]],
+                 retrieved: Optional[List[ContextItem]] = None,
+                 render_retrieved: Callable[[List[str]], str] = "\n".join) -> AssembledContext:
+        """
+        Builds the system prompt (mid-term memory block + template rendered with the kept retrieved
+        context) and the history to send. render_system gets the rendered retrieved context.
+        """
+        tokenizer = self.tokenizer(model)
+        budget = self.budget(model)
+        retrieved = retrieved or []
+
+        system_tokens = tokenizer.count(render_system(""))
+        query_tokens = tokenizer.count(query) + TOKENS_PER_MESSAGE
+        available = budget - system_tokens - TOKENS_PER_MESSAGE - query_tokens
+
+        # +1 for the separator render_retrieved puts between items
+        retrieved_costs = [tokenizer.count(item.text) + 1 for item in retrieved]
+        history_costs = [tokenizer.count(h["content"]) + TOKENS_PER_MESSAGE for h in history]
+        memory_lines = [f"[{m['role'].capitalize()}]: {m['content']}" for m in memory]
+        memory_costs = [tokenizer.count(line) + 1 for line in memory_lines]
+        needs = {
+            "retrieved": sum(retrieved_costs) + (tokenizer.count(render_retrieved([])) if retrieved else 0),
+            "history": sum(history_costs),
+            "memory": sum(memory_costs) + (tokenizer.count(_memory_block([])) if memory else 0),
+        }
+        shares = {
+            "retrieved": settings.CONTEXT_SHARE_RETRIEVED,
+            "history": settings.CONTEXT_SHARE_HISTORY,
+            "memory": settings.CONTEXT_SHARE_MEMORY,
+        }
+        available = max(available, 0)
+        allot = {s: min(needs[s], int(available * shares[s])) for s in SECTIONS}
+        leftover = available - sum(allot.values())
+        for s in SECTIONS:
+            extra = min(leftover, needs[s] - allot[s])
+            allot[s] += extra
+            leftover -= extra
+
+        # Retrieved context, best ranked first
+        kept_retrieved = []
+        if retrieved:
+            kept_retrieved = self._fill(
+                tokenizer, [item.text for item in retrieved], retrieved_costs,
+                allot["retrieved"] - tokenizer.count(render_retrieved([])),
+                lambda i, limit: retrieved[i].shrink(tokenizer, limit)
+            )
+        context_str = render_retrieved(kept_retrieved) if kept_retrieved else ""
+
+        # Short-term history, newest first, sent in chronological order
+        newest_first = list(reversed(history))
+        kept_contents = self._fill(
+            tokenizer, [h["content"] for h in newest_first], [c for c in reversed(history_costs)], allot["history"],
+            lambda i, limit: tokenizer.truncate(newest_first[i]["content"], limit - TOKENS_PER_MESSAGE)
+        )
+        kept_history = [
+            h if content is h["content"] else {**h, "content": content}
+            for h, content in zip(newest_first, kept_contents)
+        ][::-1]
+
+        # Mid-term memory, most relevant first
+        kept_memory = []
+        if memory:
+            kept_memory = self._fill(
+                tokenizer, memory_lines, memory_costs, allot["memory"] - tokenizer.count(_memory_block([])),
+                lambda i, limit: tokenizer.truncate(memory_lines[i], limit - 1)
+            )
+        memory_str = _memory_block(kept_memory) if kept_memory else ""
+
+        system_prompt = memory_str + render_system(context_str)
+        history_tokens = sum(tokenizer.count(h["content"]) + TOKENS_PER_MESSAGE for h in kept_history)
+        report = {
+            "model": model,
+            "encoding": tokenizer.encoding.name,
+            "budget": budget,
+            "system": system_tokens,
+            "query": query_tokens,
+            "retrieved": tokenizer.count(context_str),
+            "memory": tokenizer.count(memory_str),
+            "history": history_tokens,
+            "total": tokenizer.count(system_prompt) + TOKENS_PER_MESSAGE + history_tokens + query_tokens,
+            "dropped": {
+                "retrieved": len(retrieved) - len(kept_retrieved),
+                "history": len(history) - len(kept_history),
+                "memory": len(memory) - len(kept_memory),
+            },
+        }
+        if available == 0 and budget < system_tokens + query_tokens:
+            logger.warning(f"System prompt and query alone exceed the {budget}-token budget of {model}")
+        return AssembledContext(system_prompt, kept_history, report)
+
+
+def _memory_block(lines: List[str]) -> str:
+    """The mid-term memory preamble, formatted as the dialogue manager always has."""
+    body = "".join(f"{line}\n" for line in lines)
+    return f"Relevant Past Conversation:\n{body}\nEnd of Relevant Past Conversation.\n\n"
+
+
+context_assembler = ContextAssembler()
@@ -1,99 +1,55 @@
 from typing import Dict, Any, List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from app.services.instruction_service import InstructionService
 from app.services.memory_manager import MemoryManager
 from app.services.rag_engine import RAGEngine
 from app.services.search_service import search_service
 from app.services.feedback_service import FeedbackService
 from app.services.instruction_matcher import matcher_service
+from app.services.semantic_instruction_index import semantic_index
+from app.services.prompt_registry import prompt_registry
+from app.services.intent_classifier import intent_classifier, ROUTER_NAME as INTENT_CLASSIFIER_ROUTER
+from app.services.intent_cache import intent_cache
+from app.services.session_cache import session_cache
+from app.services.instruction_catalog import instruction_catalog
+from app.services.context_assembler import context_assembler, ContextItem
+from app.services.response_cache import response_cache
 from app.core.llm_factory import LLMFactory
+from app.db.session import AsyncSessionLocal
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 from app.core.config import settings
+from app.core.tracing import span, start_trace, traced
+from app.core.single_flight import single_flight
 import json
 from app.core.logger import logger
 import uuid
 import time
 import asyncio
-import os
-from pathlib import Path
+from contextlib import aclosing
 
 
 # logger = logging.getLogger(__name__) # Removed in favor of app.core.logger
 
 class DialogueManager:
     def __init__(self):
-        self._load_prompts()
-
-    def _load_prompts(self):
-        """Load prompts from app/config/prompts.json"""
-        try:
-            config_path = Path("app/config/prompts.json")
-            if not config_path.exists():
-                logger.warning(f"Prompts config not found at {config_path}, using hardcoded defaults.")
-                self.prompts_config = {}
-                return
-
-            with open(config_path, "r", encoding="utf-8") as f:
-                self.prompts_config = json.load(f)
-            logger.info("Prompts configuration loaded successfully.")
-        except Exception as e:
-            logger.error(f"Failed to load prompts config: {e}")
-            self.prompts_config = {}
+        prompt_registry.ensure_loaded()
+        # Detached saves of cancelled responses (referenced until done)
+        self._background_tasks = set()
 
     def _get_system_prompt(self, provider: str, model: str, intent: str, language: str = None, **kwargs) -> str:
         """
         Get the appropriate system prompt based on provider, model, and intent.
         
-        Resolution order:
-        1. Check overrides for specific provider+model+intent
-        2. Use explicit language argument if provided
-        3. Determine language (default to 'en' if not specified for provider)
-        4. Get template from 'templates' section
-        5. Format with kwargs
+        Resolution order (see PromptRegistry.render):
+        1. Overrides for the specific provider+model+intent+language
+        2. Explicit language argument, else the provider's default language, else 'en'
+        3. Template from the 'templates' section (falling back to English)
+        4. Hardcoded fallbacks if prompts.json has nothing
         """
-        # Default config if file load failed
-        if not self.prompts_config:
-            # Fallback to simple English defaults if config is completely missing
-            return self._get_fallback_prompt(intent, **kwargs)
-
-        provider = provider.lower() if provider else "openai"
-        model = model.lower() if model else "default"
-        
-        # Determine language: explicit argument > provider default > 'en'
-        lang = language
-        if not lang:
-            lang = self.prompts_config.get("settings", {}).get("provider_language_defaults", {}).get(provider, "en")
-
-        # 1. Check overrides
-        overrides = self.prompts_config.get("overrides", [])
-        for override in overrides:
-            if (override.get("provider") == provider and
-                    override.get("model") == model and
-                    override.get("intent") == intent):
-
-                # Found override
-                template = override.get("templates", {}).get(lang)
-                if template:
-                    return template.format(**kwargs)
-
-        # 3. Get template
-        templates = self.prompts_config.get("templates", {}).get(intent, {})
-        template = templates.get(lang)
-
-        if not template:
-            # Fallback to English if specific lang not found
-            template = templates.get("en")
-
-        if not template:
+        prompt = prompt_registry.render(provider, model, intent, language, **kwargs)
+        if prompt is None:
             return self._get_fallback_prompt(intent, **kwargs)
-
-        # 4. Format
-        try:
-            return template.format(**kwargs)
-        except KeyError as e:
-            logger.error(f"Missing key for prompt formatting: {e}")
-            return template  # Return unformatted if keys missing, better than crash
+        return prompt
 
     def _get_fallback_prompt(self, intent: str, **kwargs) -> str:
         """Hardcoded fallbacks in case config is missing"""
@@ -142,36 +98,172 @@ class DialogueManager:
         }
 
     async def _stream_llm_response(self, llm, messages):
-        """Helper to stream response with error handling"""
+        """Helper to stream response with error handling. The upstream stream is closed on cancellation too."""
         try:
-            async for chunk in llm.astream(messages):
-                yield chunk.content
+            async with aclosing(llm.astream(messages)) as stream:
+                async for chunk in stream:
+                    yield chunk.content
         except Exception as e:
             logger.error(f"LLM streaming error: {e}")
             yield f"\n\n[System Error: Failed to generate response. {str(e)}]"
 
     async def _stream_with_ttft(self, generator, metadata, start_time):
         first_token = True
-        async for chunk in generator:
-            if first_token:
-                now = time.time()
-                metadata["latency"]["ttft_ms"] = int((now - start_time) * 1000)
-                first_token = False
-            yield chunk
+        with span("llm.stream") as stream_span:
+            async with aclosing(generator):
+                async for chunk in generator:
+                    if first_token:
+                        now = time.time()
+                        metadata["latency"]["ttft_ms"] = int((now - start_time) * 1000)
+                        stream_span.set("ttft_ms", metadata["latency"]["ttft_ms"])
+                        first_token = False
+                    yield chunk
 
         # Final metadata update
         metadata["latency"]["total_ms"] = int((time.time() - start_time) * 1000)
 
+    @traced("session.load")
+    async def _load_session(self, db: AsyncSession, session_id: str, query: str, user_id: str,
+                            is_new_session: bool, trace_id: str) -> tuple[Dict[str, Any], str]:
+        """Creates or loads the session row (auto-renaming "New Chat"). Returns (llm_config, language)."""
+        from app.models.base import Session
+
+        session_obj = None
+        if not is_new_session:
+            cached = await session_cache.get(session_id)
+            if cached is not None:
+                return cached["llm_config"], cached["language"]
+        # Read before the database: an invalidation during the load makes the set() below a no-op
+        generation = await session_cache.generation(session_id)
+        if not is_new_session:
+            result = await db.execute(select(Session).filter(Session.id == session_id))
+            session_obj = result.scalar_one_or_none()
+            is_new_session = not session_obj
+
+        # Create session if new
+        if is_new_session:
+            # Auto-name from first 20 chars of query
+            session_name = query[:20] + "..." if len(query) > 20 else query
+            new_session = Session(id=session_id, user_id=user_id, name=session_name)
+            db.add(new_session)
+            await db.commit()
+            await session_cache.set(session_id, {}, "zh", generation)
+            return {}, "zh"
+
+        # Load Session Config & Auto-rename if needed
+        session_config = {}
+        session_language = "zh" # Default to Chinese
+        try:
+            # Load language
+            if session_obj.language:
+                session_language = session_obj.language
+
+            # Auto-rename if name is default "New Chat"
+            if session_obj.name == "New Chat":
+                 session_name = query[:20] + "..." if len(query) > 20 else query
+                 session_obj.name = session_name
+                 db.add(session_obj)
+                 await db.commit()
+                 logger.info(f"[{trace_id}] Auto-renamed session {session_id} to '{session_name}'")
+
+            if session_obj.context:
+                session_config = session_obj.context.get("llm_config", {})
+                if session_config:
+                    logger.info(f"[{trace_id}] Loaded session config: {session_config}")
+            await session_cache.set(session_id, session_config, session_language, generation)
+        except Exception as e:
+            logger.error(f"[{trace_id}] Failed to load session config or rename: {e}")
+        return session_config, session_language
+
+    @staticmethod
+    def _instruction_repo_id(session_config: Dict[str, Any], trace_id: str) -> Optional[uuid.UUID]:
+        repo_id_str = session_config.get("INSTRUCTION_REPO_ID")
+        if not repo_id_str:
+            return None
+        try:
+            return uuid.UUID(repo_id_str)
+        except (ValueError, TypeError, AttributeError):
+            logger.warning(f"[{trace_id}] Invalid INSTRUCTION_REPO_ID: {repo_id_str}")
+            return None
+
+    @traced("instruction.fastpath")
+    async def _lookup_instruction_fast(self, query: str, repo_id: uuid.UUID, db: AsyncSession,
+                                       trace_id: str) -> Optional[Dict[str, Any]]:
+        """
+        The instruction tiers that need no LLM: the in-memory matcher, then the Redis instruction cache.
+        Returns {"hit_source", "executor", "content", "actions"} on a hit (hit counts bumped), else None.
+        """
+        feedback_service = FeedbackService(db)
+
+        # 1. Check Instruction Matcher (Generalization & Exact Match)
+        # Pass repo_id to ensure we only match templates for this repository (or globals)
+        with span("matcher.match"):
+            matched_instruction = matcher_service.match(query, repository_id=repo_id)
+        if matched_instruction:
+            logger.info(f"[{trace_id}] Matched instruction template: {matched_instruction['template_pattern']}")
+
+            # Increment hit count for the original query (System Pair)
+            try:
+                original_query = matched_instruction.get("original_query")
+                if original_query:
+                    await feedback_service.increment_hit_count(original_query)
+            except Exception as e:
+                logger.error(f"[{trace_id}] Failed to increment hit count for matcher: {e}")
+
+            result_json = matched_instruction['result']
+            return {
+                "hit_source": "memory",
+                "executor": "instruction_matcher",
+                "content": json.dumps(result_json, ensure_ascii=False),
+                "actions": [{"type": "execute_instruction", "payload": result_json}]
+            }
+
+        # 2. Check Redis Cache (Legacy / Exact caching)
+        # Pass repo_id to ensure we only check cache for this repository
+        with span("redis.instruction_cache"):
+            cached_response = await feedback_service.get_cached_instruction_response(query, repository_id=repo_id)
+        if cached_response:
+            logger.info(f"[{trace_id}] Using cached instruction response")
+
+            # Increment hit count for the exact query (User History / Cached)
+            try:
+                await feedback_service.increment_hit_count(query)
+            except Exception as e:
+                logger.error(f"[{trace_id}] Failed to increment hit count for cache: {e}")
+
+            actions = []
+            try:
+                cmd_data = json.loads(cached_response)
+                actions = [{"type": "execute_instruction", "payload": cmd_data}]
+            except json.JSONDecodeError:
+                pass
+            return {"hit_source": "redis", "executor": "redis_cache", "content": cached_response, "actions": actions}
+        return None
+
+    @traced("memory.mid_term")
+    async def _load_mid_term_memory(self, session_id: str, query: str, trace_id: str) -> List[Dict]:
+        if not (settings.MEMORY_ENABLE and settings.MID_TERM_MEMORY_ENABLE_EMBEDDING):
+            return []
+        try:
+            async with AsyncSessionLocal() as stage_db:
+                return await MemoryManager(stage_db).get_relevant_mid_term_memory(session_id, query)
+        except Exception as e:
+            logger.error(f"[{trace_id}] Failed to load mid-term memory: {e}")
+            return []
+
+    @traced("memory.save_user")
+    async def _save_user_message(self, session_id: str, query: str, user_id: str) -> str:
+        async with AsyncSessionLocal() as stage_db:
+            return await MemoryManager(stage_db).save_message(session_id, "user", query, user_id)
+
     async def stream_process_request(self, session_id: str, query: str, user_id: str, db: AsyncSession,
                                      trace_id: Optional[str] = None):
-        # Force reload prompts to ensure latest configuration is used
-        self._load_prompts()
-
         start_time = time.time()
         if not trace_id:
             trace_id = str(uuid.uuid4())
 
         logger.info(f"[{trace_id}] Starting stream_process_request for session {session_id}")
+        trace = start_trace("dialogue.request", trace_id)
 
         # Ensure session_id is valid UUID or create new
         is_new_session = False
@@ -181,57 +273,76 @@ class DialogueManager:
         else:
             try:
                 uuid.UUID(session_id)
-                # Check if session exists in DB
-                from app.models.base import Session
-                result = await db.execute(select(Session).filter(Session.id == session_id))
-                if not result.scalar_one_or_none():
-                    is_new_session = True
             except (ValueError, TypeError):
                 session_id = str(uuid.uuid4())
                 is_new_session = True
 
-        # Create session if new
-        if is_new_session:
-            from app.models.base import Session
-            # Auto-name from first 20 chars of query
-            session_name = query[:20] + "..." if len(query) > 20 else query
-            new_session = Session(id=session_id, user_id=user_id, name=session_name)
-            db.add(new_session)
-            await db.commit()
-
-        # Load Session Config & Auto-rename if needed
-        session_config = {}
-        session_language = "zh" # Default to Chinese
-        try:
-            from app.models.base import Session
-            result = await db.execute(select(Session).filter(Session.id == session_id))
-            session_obj = result.scalar_one_or_none()
-            
-            if session_obj:
-                # Load language
-                if session_obj.language:
-                    session_language = session_obj.language
-                    
-                # Auto-rename if name is default "New Chat"
-                if session_obj.name == "New Chat":
-                     session_name = query[:20] + "..." if len(query) > 20 else query
-                     session_obj.name = session_name
-                     db.add(session_obj)
-                     await db.commit()
-                     logger.info(f"[{trace_id}] Auto-renamed session {session_id} to '{session_name}'")
-
-                if session_obj.context:
-                    session_config = session_obj.context.get("llm_config", {})
-                    if session_config:
-                        logger.info(f"[{trace_id}] Loaded session config: {session_config}")
-        except Exception as e:
-            logger.error(f"[{trace_id}] Failed to load session config or rename: {e}")
-
+        # Preamble as a dependency graph, independent stages run concurrently on their own connections:
+        #   session row (request db) ─┬─> save user message (own db; the session row must exist)
+        #   short-term history ───────┴─> fast path (matcher, Redis) ── miss ─┬─> intent routing (LLM)
+        #                                                                     └─> mid-term retrieval (own db)
+        # Everything is joined before dispatch; a fast-path hit answers right away without any LLM call.
         memory = MemoryManager(db)
         rag = RAGEngine(db)
-
-        # Save User Message FIRST to get its ID
-        user_msg_id = await memory.save_message(session_id, "user", query, user_id)
+        session_task = asyncio.create_task(self._load_session(db, session_id, query, user_id, is_new_session, trace_id))
+        history_task = asyncio.create_task(memory.get_short_term_memory(session_id))
+        tasks = [session_task, history_task]
+        query_vector_task = None
+        try:
+            session_config, session_language = await session_task
+            history = await history_task
+
+            save_task = asyncio.create_task(self._save_user_message(session_id, query, user_id))
+            tasks.append(save_task)
+
+            # 2. Intent Routing
+            intent_provider = session_config.get("INTENT_LLM_PROVIDER") or settings.INTENT_LLM_PROVIDER or \
+                              session_config.get("INSTRUCTION_LLM_PROVIDER") or settings.INSTRUCTION_LLM_PROVIDER or \
+                              settings.DEFAULT_LLM_PROVIDER
+            intent_model = session_config.get("INTENT_LLM_MODEL") or settings.INTENT_LLM_MODEL or \
+                           session_config.get("INSTRUCTION_LLM_MODEL") or settings.INSTRUCTION_LLM_MODEL or \
+                           settings.DEFAULT_LLM_MODEL
+
+            # Fast path first: the matcher and the Redis instruction cache answer most device commands
+            # in well under a millisecond, so a hit never starts (and pays for) a router call
+            repo_id = self._instruction_repo_id(session_config, trace_id)
+            fast_hit = await self._lookup_instruction_fast(query, repo_id, db, trace_id) if repo_id else None
+            if fast_hit:
+                # No LLM needed: answer before the save completes
+                tasks.remove(save_task)
+                user_msg_id, raw_mid_term, intent, intent_latency = None, [], "instruction", 0
+            else:
+                logger.info(f"[{trace_id}] Starting Intent Routing for query: {query}")
+                route_task = asyncio.create_task(self._route_intent(
+                    None, query, history, trace_id=trace_id, session_config=session_config, language=session_language
+                ))
+                tasks.append(route_task)
+                if response_cache.enabled and not history:
+                    # First turns may be answered from the response cache: embed while routing runs.
+                    # Not a preamble stage, so it outlives the join and is cancelled after dispatch
+                    query_vector_task = asyncio.create_task(response_cache.embed(query))
+                # Off the critical path (the router call takes longer), and skipped for fast-path hits
+                mid_term_task = asyncio.create_task(self._load_mid_term_memory(session_id, query, trace_id))
+                tasks.append(mid_term_task)
+                user_msg_id, raw_mid_term, (intent, intent_latency, intent_model, intent_cache_hit) = await asyncio.gather(save_task, mid_term_task, route_task)
+        except asyncio.CancelledError:
+            # Client gone before dispatch: nothing was answered, so nothing is persisted
+            if query_vector_task is not None:
+                query_vector_task.cancel()
+            if trace is not None:
+                trace.root.set("cancelled", True)
+                trace.finish()
+            raise
+        finally:
+            # Client gone or a stage failed: don't leave the others running
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        # The user message is saved after the history read; keep it in the history as before
+        if settings.MEMORY_ENABLE and settings.SHORT_TERM_MEMORY_ENABLE:
+            history = (history + [{"role": "user", "content": query, "metadata": None}])[-settings.SHORT_TERM_MEMORY_MAX_SIZE:]
+        logger.info(f"[{trace_id}] Loaded {len(history)} history messages for session {session_id}")
 
         # Metadata container
         metadata = {
@@ -240,66 +351,33 @@ class DialogueManager:
             "route": "unknown",
             "models_used": {},
             "latency": {
-                "start_time": start_time
+                "start_time": start_time,
+                "preamble_ms": int((time.time() - start_time) * 1000)
             },
             "search_results": [],
             "rag_references": []
         }
 
-        # 1. Get Context (Scoped to user via session ownership check in MemoryManager)
-        history = await memory.get_short_term_memory(session_id)
-        logger.info(f"[{trace_id}] Loaded {len(history)} history messages for session {session_id}")
-
-        # 1.1 Get Relevant Mid-term Memory
-        mid_term_memory = []
-        if settings.MEMORY_ENABLE and settings.MID_TERM_MEMORY_ENABLE_EMBEDDING:
-            try:
-                # Exclude messages that are likely in short-term history by checking content equality
-                # This is a basic deduplication strategy
-                raw_mid_term = await memory.get_relevant_mid_term_memory(session_id, query)
-                
-                # Deduplication: Filter out messages present in short-term history
-                history_contents = {h['content'] for h in history}
-                mid_term_memory = [
-                    m for m in raw_mid_term 
-                    if m['content'] not in history_contents
-                ]
-                
-                logger.info(f"[{trace_id}] Loaded {len(mid_term_memory)} relevant mid-term messages")
-            except Exception as e:
-                logger.error(f"[{trace_id}] Failed to load mid-term memory: {e}")
-
-        # Format memory context string
-        memory_context_str = ""
+        # 1.1 Relevant Mid-term Memory, minus messages already in the short-term history
+        history_contents = {h['content'] for h in history}
+        mid_term_memory = [m for m in raw_mid_term if m['content'] not in history_contents]
         if mid_term_memory:
-            memory_context_str = "Relevant Past Conversation:\n"
-            for msg in mid_term_memory:
-                # Format: [Role] Content
-                memory_context_str += f"[{msg['role'].capitalize()}]: {msg['content']}\n"
-            memory_context_str += "\nEnd of Relevant Past Conversation.\n\n"
-            
+            logger.info(f"[{trace_id}] Loaded {len(mid_term_memory)} relevant mid-term messages")
             metadata["mid_term_memory_used"] = len(mid_term_memory)
+        # Answers that depend on earlier turns are neither served from nor added to the response cache
+        cacheable = query_vector_task is not None and not mid_term_memory
 
-        # 2. Intent Routing
-        # Use a dummy LLM here because _route_intent will instantiate its own based on config
-        # But we still pass something to satisfy the signature if needed, though we just updated _route_intent to ignore it
-        # However, for metadata logging we want to know what was used.
-        
-        intent_provider = session_config.get("INTENT_LLM_PROVIDER") or settings.INTENT_LLM_PROVIDER or \
-                          session_config.get("INSTRUCTION_LLM_PROVIDER") or settings.INSTRUCTION_LLM_PROVIDER or \
-                          settings.DEFAULT_LLM_PROVIDER
-        intent_model = session_config.get("INTENT_LLM_MODEL") or settings.INTENT_LLM_MODEL or \
-                       session_config.get("INSTRUCTION_LLM_MODEL") or settings.INSTRUCTION_LLM_MODEL or \
-                       settings.DEFAULT_LLM_MODEL
-        
-        metadata["models_used"]["router"] = intent_model
-
-        logger.info(f"[{trace_id}] Starting Intent Routing for query: {query}")
-        intent, intent_latency = await self._route_intent(None, query, history, trace_id=trace_id, session_config=session_config, language=session_language)
-        metadata["route"] = intent
-        metadata["latency"]["intent_ms"] = intent_latency
+        if fast_hit:
+            metadata["route"] = "instruction_fastpath"
+            logger.info(f"[{trace_id}] Session {session_id} answered by the instruction fast path ({fast_hit['hit_source']})")
+        else:
+            metadata["models_used"]["router"] = intent_model
+            metadata["route"] = intent
+            metadata["latency"]["intent_ms"] = intent_latency
+            if intent_cache_hit:
+                metadata["latency"]["intent_cache"] = intent_cache_hit
 
-        logger.info(f"[{trace_id}] Session {session_id} routed to intent: {intent} in {intent_latency}ms")
+            logger.info(f"[{trace_id}] Session {session_id} routed to intent: {intent} in {intent_latency}ms")
 
         # Override intent if RAG is disabled in session config
         if intent == "rag":
@@ -321,328 +399,320 @@ class DialogueManager:
 
         response_content = ""
         actions = []
+        assistant_saved = False
 
-        # 3. Dispatch based on Intent
-        while True:
-            if intent == "instruction":
-                logger.info(f"[{trace_id}] Processing INSTRUCTION intent")
+        try:
 
-                # Check for mandatory Instruction Repository configuration
-                repo_id_str = session_config.get("INSTRUCTION_REPO_ID")
-                repo_id = None
-                if repo_id_str:
-                    try:
-                        repo_id = uuid.UUID(repo_id_str)
-                    except ValueError:
-                        logger.warning(f"[{trace_id}] Invalid INSTRUCTION_REPO_ID: {repo_id_str}")
-
-                if not repo_id:
-                    logger.warning(f"[{trace_id}] Missing or invalid INSTRUCTION_REPO_ID in session config")
-                    msg = "当前会话未配置指令库，无法执行指令。请在会话设置中选择一个指令库。"
-                    response_content += msg
-                    yield msg
-                    break
+            # 3. Dispatch based on Intent
+            while True:
+                if intent == "instruction":
+                    logger.info(f"[{trace_id}] Processing INSTRUCTION intent")
+
+                    # Check for mandatory Instruction Repository configuration
+                    if not repo_id:
+                        logger.warning(f"[{trace_id}] Missing or invalid INSTRUCTION_REPO_ID in session config")
+                        msg = "当前会话未配置指令库，无法执行指令。请在会话设置中选择一个指令库。"
+                        response_content += msg
+                        yield msg
+                        break
 
-                # 1. Check Instruction Matcher (Generalization & Exact Match)
-                # Pass repo_id to ensure we only match templates for this repository (or globals)
-                matched_instruction = matcher_service.match(query, repository_id=repo_id)
-                if matched_instruction:
-                    logger.info(f"[{trace_id}] Matched instruction template: {matched_instruction['template_pattern']}")
-                    
-                    metadata["hit_source"] = "memory"
+                    # 1-2. Instruction Matcher, then Redis Cache: consulted by the fast path in the preamble
+                    if fast_hit:
+                        metadata["hit_source"] = fast_hit["hit_source"]
+                        response_content += fast_hit["content"]
+                        yield fast_hit["content"]
 
-                    # Increment hit count for the original query (System Pair)
-                    try:
-                        feedback_service = FeedbackService(db)
-                        original_query = matched_instruction.get("original_query")
-                        if original_query:
-                            await feedback_service.increment_hit_count(original_query)
-                    except Exception as e:
-                        logger.error(f"[{trace_id}] Failed to increment hit count for matcher: {e}")
+                        actions = fast_hit["actions"]
+                        metadata["models_used"]["executor"] = fast_hit["executor"]
+                        break
 
-                    result_json = matched_instruction['result']
-                    chunk = json.dumps(result_json, ensure_ascii=False)
-                    response_content += chunk
-                    yield chunk
-                    
-                    actions = [{"type": "execute_instruction", "payload": result_json}]
-                    metadata["models_used"]["executor"] = "instruction_matcher"
-                    break
+                    feedback_service = FeedbackService(db)
 
-                # 2. Check Redis Cache (Legacy / Exact caching)
-                # Pass repo_id to ensure we only check cache for this repository
-                feedback_service = FeedbackService(db)
-                cached_response = await feedback_service.get_cached_instruction_response(query, repository_id=repo_id)
-                if cached_response:
-                    logger.info(f"[{trace_id}] Using cached instruction response")
-                    
-                    metadata["hit_source"] = "redis"
+                    # 3. Semantic fallback: nearest liked/system pair above the similarity threshold
+                    with span("instruction.semantic"):
+                        semantic_hit = await semantic_index.search(query, repository_id=repo_id)
+                    if semantic_hit:
+                        logger.info(f"[{trace_id}] Semantic instruction hit ({semantic_hit['score']:.3f}): {semantic_hit['original_query']}")
 
-                    # Increment hit count for the exact query (User History / Cached)
-                    try:
-                        await feedback_service.increment_hit_count(query)
-                    except Exception as e:
-                        logger.error(f"[{trace_id}] Failed to increment hit count for cache: {e}")
+                        metadata["hit_source"] = "semantic"
 
-                    response_content = cached_response
-                    yield response_content
-                    
-                    try:
-                        cmd_data = json.loads(cached_response)
-                        actions = [{"type": "execute_instruction", "payload": cmd_data}]
-                    except json.JSONDecodeError:
-                        pass
-                        
-                    metadata["models_used"]["executor"] = "redis_cache"
-                    break
+                        try:
+                            await feedback_service.increment_hit_count(semantic_hit["original_query"])
+                        except Exception as e:
+                            logger.error(f"[{trace_id}] Failed to increment hit count for semantic hit: {e}")
 
-                llm = LLMFactory.get_llm_for_scenario("instruction", config=session_config)
-                metadata["models_used"]["executor"] = session_config.get("INSTRUCTION_LLM_MODEL") or settings.INSTRUCTION_LLM_MODEL or settings.DEFAULT_LLM_MODEL
-                metadata["hit_source"] = "llm"
+                        response_content = semantic_hit["response"]
+                        yield response_content
 
-                # Use InstructionService to get available instructions
-                instruction_service = InstructionService(db)
-                try:
-                    # Assuming user_id is a valid UUID string, but handle potential errors if it's not
-                    try:
-                        user_uuid = uuid.UUID(user_id)
-                    except ValueError:
-                        # Fallback for system user or invalid ID, though authentication should prevent this
-                        logger.warning(f"[{trace_id}] Invalid user_id {user_id}, using empty instruction list")
-                        user_uuid = None
-
-                    instructions = []
-                    if user_uuid and repo_id:
-                        instructions = await instruction_service.get_all_instructions(user_uuid, repository_id=repo_id)
-
-                    # Format instructions for the prompt
-                    instructions_list = [
-                        {
-                            "name": inst.name,
-                            "description": inst.description,
-                            "parameters": inst.parameters
-                        } for inst in instructions
-                    ]
-                    instructions_str = json.dumps(instructions_list, ensure_ascii=False, indent=2)
-
-                    # Get system prompt for executor
-                    system_prompt = self._get_system_prompt(
-                        provider=session_config.get("INSTRUCTION_LLM_PROVIDER") or settings.INSTRUCTION_LLM_PROVIDER or settings.DEFAULT_LLM_PROVIDER,
-                        model=session_config.get("INSTRUCTION_LLM_MODEL") or settings.INSTRUCTION_LLM_MODEL or settings.DEFAULT_LLM_MODEL,
-                        intent="instruction_executor",
-                        language=session_language,
-                        instructions_list=instructions_str,
-                        query=query
-                    )
-
-                    # Inject Mid-term Memory Context
-                    if memory_context_str:
-                        system_prompt = memory_context_str + system_prompt
-
-                    logger.info(f"[{trace_id}] Instruction Executor Prompt Length: {len(system_prompt)}")
-
-                    messages = [
-                        SystemMessage(content=system_prompt)
-                    ]
-                    # Add history for context-aware instruction execution
-                    messages.extend(self._format_history(history))
-                    # Add query again as HumanMessage to reinforce the request
-                    messages.append(HumanMessage(content=query))
-
-                    # Execute LLM to get JSON response
-                    # We use ainvoke because we expect a JSON structure
-                    response = await llm.ainvoke(messages)
-                    content = response.content
-                    logger.info(f"[{trace_id}] Instruction Executor Raw Response: {content}")
-
-                    # Parse JSON
-                    # Clean content if it has markdown code blocks
-                    if "```json" in content:
-                        content = content.split("```json")[1].split("```")[0].strip()
-                    elif "```" in content:
-                        content = content.split("```")[1].strip()
+                        try:
+                            cmd_data = json.loads(response_content)
+                            actions = [{"type": "execute_instruction", "payload": cmd_data}]
+                        except json.JSONDecodeError:
+                            pass
 
-                    try:
-                        cmd_data = json.loads(content)
-                        cmd_name = cmd_data.get("name")
+                        metadata["models_used"]["executor"] = "semantic_index"
+                        break
 
-                        if cmd_name:
-                            # Success: Return the command name and params as requested by user
-                            # Format: {"name": "...", "parameters": {...}} JSON string
+                    llm = LLMFactory.get_llm_for_scenario("instruction", config=session_config)
+                    metadata["models_used"]["executor"] = session_config.get("INSTRUCTION_LLM_MODEL") or settings.INSTRUCTION_LLM_MODEL or settings.DEFAULT_LLM_MODEL
+                    metadata["hit_source"] = "llm"
 
-                            chunk = json.dumps(cmd_data, ensure_ascii=False)
-                            response_content += chunk
-                            yield chunk
+                    try:
+                        # Assuming user_id is a valid UUID string, but handle potential errors if it's not
+                        try:
+                            user_uuid = uuid.UUID(user_id)
+                        except ValueError:
+                            # Fallback for system user or invalid ID, though authentication should prevent this
+                            logger.warning(f"[{trace_id}] Invalid user_id {user_id}, using empty instruction list")
+                            user_uuid = None
+
+                        # Compact catalogue, serialized once per repository version; large repositories
+                        # send only the instructions most relevant to the query
+                        instructions_str = "[]"
+                        if user_uuid and repo_id:
+                            instructions_str, preselect = await instruction_catalog.select(db, user_uuid, repo_id, query)
+                            metadata["instruction_preselect"] = preselect
+
+                        # Executor prompt with mid-term memory and history for context-aware execution,
+                        # within the model's token budget (the catalogue itself is never cut)
+                        messages = self._build_messages(
+                            metadata, query, history, mid_term_memory,
+                            provider=session_config.get("INSTRUCTION_LLM_PROVIDER") or settings.INSTRUCTION_LLM_PROVIDER or settings.DEFAULT_LLM_PROVIDER,
+                            model=session_config.get("INSTRUCTION_LLM_MODEL") or settings.INSTRUCTION_LLM_MODEL or settings.DEFAULT_LLM_MODEL,
+                            intent="instruction_executor",
+                            language=session_language,
+                            instructions_list=instructions_str,
+                            query=query
+                        )
+                        system_prompt = messages[0].content
 
-                            actions = [{"type": "execute_instruction", "payload": cmd_data}]
-                        else:
-                            # No match found
-                            chunk = f"未找到匹配的指令: {query}"
+                        logger.info(f"[{trace_id}] Instruction Executor Prompt Length: {len(system_prompt)}")
+
+                        # Execute LLM to get JSON response
+                        # We use ainvoke because we expect a JSON structure
+                        # Devices sending the same command at once (same prompt, history and resolved LLM config) share one call
+                        executor_key = single_flight.key(
+                            LLMFactory.fingerprint(llm),
+                            [(m.type, m.content) for m in messages]
+                        )
+                        with span("executor.llm", prompt_chars=len(system_prompt)):
+                            response = await single_flight.run("executor", executor_key, lambda: llm.ainvoke(messages))
+                        content = response.content
+                        logger.info(f"[{trace_id}] Instruction Executor Raw Response: {content}")
+
+                        # Parse JSON
+                        # Clean content if it has markdown code blocks
+                        if "```json" in content:
+                            content = content.split("```json")[1].split("```")[0].strip()
+                        elif "```" in content:
+                            content = content.split("```")[1].strip()
+
+                        try:
+                            cmd_data = json.loads(content)
+                            cmd_name = cmd_data.get("name")
+
+                            if cmd_name:
+                                # Success: Return the command name and params as requested by user
+                                # Format: {"name": "...", "parameters": {...}} JSON string
+
+                                chunk = json.dumps(cmd_data, ensure_ascii=False)
+                                response_content += chunk
+                                yield chunk
+
+                                actions = [{"type": "execute_instruction", "payload": cmd_data}]
+                            else:
+                                # No match found
+                                chunk = f"未找到匹配的指令: {query}"
+                                response_content += chunk
+                                yield chunk
+
+                        except json.JSONDecodeError:
+                            logger.error(f"[{trace_id}] Failed to parse instruction response: {content}")
+                            chunk = f"指令解析失败: {content}"
                             response_content += chunk
                             yield chunk
 
-                    except json.JSONDecodeError:
-                        logger.error(f"[{trace_id}] Failed to parse instruction response: {content}")
-                        chunk = f"指令解析失败: {content}"
+                    except Exception as e:
+                        logger.error(f"[{trace_id}] Error executing instruction: {e}", exc_info=True)
+                        chunk = f"执行指令时出错: {str(e)}"
                         response_content += chunk
                         yield chunk
-
-                except Exception as e:
-                    logger.error(f"[{trace_id}] Error executing instruction: {e}", exc_info=True)
-                    chunk = f"执行指令时出错: {str(e)}"
-                    response_content += chunk
-                    yield chunk
                 
-                break
-
-            if intent == "rag":
-                try:
-                    logger.info(f"[{trace_id}] Processing RAG intent")
-                    llm = LLMFactory.get_llm_for_scenario("rag", config=session_config)
-                    metadata["models_used"]["executor"] = session_config.get("RAG_LLM_MODEL") or settings.RAG_LLM_MODEL or settings.DEFAULT_LLM_MODEL
-
-                    # Pass user_id to RAG engine for isolated retrieval
-                    rag_context = await rag.search(query, user_id=uuid.UUID(user_id))
-                    metadata["rag_references"] = rag_context
-                    logger.info(f"[{trace_id}] RAG Search found {len(rag_context)} documents")
-
-                    if not rag_context:
-                        logger.info(f"[{trace_id}] RAG search returned empty, falling back to SEARCH")
-                        intent = "search"  # Fallback logic
-                        metadata["route"] = "rag_fallback_search"
-                        continue # Fallthrough to SEARCH block
-                    else:
-                        # Streaming RAG Response
-                        context_str = json.dumps(rag_context, ensure_ascii=False)
-                        system_prompt = self._get_system_prompt(
-                            provider=session_config.get("RAG_LLM_PROVIDER") or settings.RAG_LLM_PROVIDER or settings.DEFAULT_LLM_PROVIDER,
-                            model=session_config.get("RAG_LLM_MODEL") or settings.RAG_LLM_MODEL or settings.DEFAULT_LLM_MODEL,
-                            intent="rag",
-                            language=session_language,
-                            context_str=context_str
-                        )
-
-                        # Inject Mid-term Memory Context
-                        if memory_context_str:
-                            system_prompt = memory_context_str + system_prompt
-
-                        logger.info(f"[{trace_id}] RAG System Prompt: {system_prompt[:3000]}...")
+                    break
 
-                        messages = [
-                            SystemMessage(content=system_prompt)
-                        ]
-                        messages.extend(self._format_history(history))
-                        messages.append(HumanMessage(content=query))
+                if intent == "rag":
+                    try:
+                        logger.info(f"[{trace_id}] Processing RAG intent")
+                        llm = LLMFactory.get_llm_for_scenario("rag", config=session_config)
+                        metadata["models_used"]["executor"] = session_config.get("RAG_LLM_MODEL") or settings.RAG_LLM_MODEL or settings.DEFAULT_LLM_MODEL
+
+                        # Pass user_id to RAG engine for isolated retrieval
+                        rag_context = await rag.search(query, user_id=uuid.UUID(user_id))
+                        metadata["rag_references"] = rag_context
+                        logger.info(f"[{trace_id}] RAG Search found {len(rag_context)} documents")
+
+                        if not rag_context:
+                            logger.info(f"[{trace_id}] RAG search returned empty, falling back to SEARCH")
+                            intent = "search"  # Fallback logic
+                            metadata["route"] = "rag_fallback_search"
+                            continue # Fallthrough to SEARCH block
+                        else:
+                            # Streaming RAG Response; chunks are kept best first and rendered as the JSON list they always were
+                            messages = self._build_messages(
+                                metadata, query, history, mid_term_memory,
+                                retrieved=[ContextItem.json(chunk) for chunk in rag_context],
+                                render_retrieved=lambda items: "[" + ", ".join(items) + "]",
+                                provider=session_config.get("RAG_LLM_PROVIDER") or settings.RAG_LLM_PROVIDER or settings.DEFAULT_LLM_PROVIDER,
+                                model=session_config.get("RAG_LLM_MODEL") or settings.RAG_LLM_MODEL or settings.DEFAULT_LLM_MODEL,
+                                intent="rag",
+                                language=session_language
+                            )
+
+                            logger.info(f"[{trace_id}] RAG System Prompt: {messages[0].content[:3000]}...")
+
+                            self._log_llm_messages(trace_id, "RAG LLM Input Messages:", messages)
+                            logger.info(f"[{trace_id}] Sending {len(messages)} messages to LLM")
+
+                            async with aclosing(self._stream_with_ttft(self._stream_llm_response(llm, messages), metadata, start_time)) as stream:
+                                async for content_chunk in stream:
+                                    response_content += content_chunk
+                                    yield content_chunk
+                        
+                            break
+                    except Exception as e:
+                        logger.error(f"[{trace_id}] RAG Error: {e}, falling back to SEARCH", exc_info=True)
+                        intent = "search"
+                        metadata["route"] = "rag_error_fallback_search"
+                        continue
 
-                        self._log_llm_messages(trace_id, "RAG LLM Input Messages:", messages)
-                        logger.info(f"[{trace_id}] Sending {len(messages)} messages to LLM")
+                if intent == "search":
+                    try:
+                        logger.info(f"[{trace_id}] Processing SEARCH intent")
+                        llm = LLMFactory.get_llm_for_scenario("search", config=session_config)
+                        search_provider = session_config.get("SEARCH_LLM_PROVIDER") or settings.SEARCH_LLM_PROVIDER or settings.DEFAULT_LLM_PROVIDER
+                        search_model = session_config.get("SEARCH_LLM_MODEL") or settings.SEARCH_LLM_MODEL or settings.DEFAULT_LLM_MODEL
+                        metadata["models_used"]["executor"] = search_model
+
+                        cache_scope = response_cache.scope("search", session_language, search_provider, search_model, prompt_registry.digest)
+                        cached = await self._lookup_response_cache(query_vector_task, cache_scope, query, metadata) if cacheable else None
+                        if cached:
+                            logger.info(f"[{trace_id}] Search answered from the response cache ({cached['score']:.3f}): {cached['query']}")
+                            metadata["search_results"] = cached["search_results"]
+                            async with aclosing(self._stream_with_ttft(response_cache.replay(cached["answer"]), metadata, start_time)) as stream:
+                                async for content_chunk in stream:
+                                    response_content += content_chunk
+                                    yield content_chunk
+                            break
+
+                        logger.info(f"[{trace_id}] Executing search for: {query}")
+                        with span("web.search"):
+                            search_results = await search_service.search(query)
+                        metadata["search_results"] = search_results
+                        logger.info(f"[{trace_id}] Search returned {len(search_results)} results")
+                    
+                        # Format search results
+                        messages = self._build_messages(
+                            metadata, query, history, mid_term_memory,
+                            retrieved=[ContextItem(f"{i+1}. {res['title']}: {res.get('body', '')}") for i, res in enumerate(search_results)],
+                            render_retrieved=lambda items: "".join(f"{item}\n" for item in items),
+                            provider=search_provider,
+                            model=search_model,
+                            intent="search",
+                            language=session_language
+                        )
+                    
+                        async with aclosing(self._stream_with_ttft(self._stream_llm_response(llm, messages), metadata, start_time)) as stream:
+                            async for content_chunk in stream:
+                                response_content += content_chunk
+                                yield content_chunk
 
-                        async for content_chunk in self._stream_with_ttft(self._stream_llm_response(llm, messages), metadata,
-                                                                        start_time):
+                        if cacheable and search_results:
+                            await self._store_response(query_vector_task, cache_scope, "search", query, response_content, search_results)
+                        break
+                    except Exception as e:
+                        logger.error(f"[{trace_id}] Search Error: {e}, falling back to CHAT", exc_info=True)
+                        intent = "chat"
+                        metadata["route"] = "search_error_fallback_chat"
+                        continue
+
+                # Default to CHAT if intent is 'chat' or unknown or fallthrough
+                logger.info(f"[{trace_id}] Processing CHAT intent (or fallback)")
+                llm = LLMFactory.get_llm_for_scenario("chat", config=session_config)
+                chat_provider = session_config.get("CHAT_LLM_PROVIDER") or settings.CHAT_LLM_PROVIDER or settings.DEFAULT_LLM_PROVIDER
+                chat_model = session_config.get("CHAT_LLM_MODEL") or settings.CHAT_LLM_MODEL or settings.DEFAULT_LLM_MODEL
+                metadata["models_used"]["executor"] = chat_model
+
+                # Only a routed chat is cached: fallbacks from failed search/RAG may answer a different question
+                cacheable_chat = cacheable and metadata["route"] == "chat"
+                cache_scope = response_cache.scope("chat", session_language, chat_provider, chat_model, prompt_registry.digest)
+                cached = await self._lookup_response_cache(query_vector_task, cache_scope, query, metadata) if cacheable_chat else None
+                if cached:
+                    logger.info(f"[{trace_id}] Chat answered from the response cache ({cached['score']:.3f}): {cached['query']}")
+                    async with aclosing(self._stream_with_ttft(response_cache.replay(cached["answer"]), metadata, start_time)) as stream:
+                        async for content_chunk in stream:
                             response_content += content_chunk
                             yield content_chunk
-                        
-                        break
-                except BaseException as e:
-                    logger.error(f"[{trace_id}] RAG Error: {e}, falling back to SEARCH", exc_info=True)
-                    intent = "search"
-                    metadata["route"] = "rag_error_fallback_search"
-                    continue
-
-            if intent == "search":
-                try:
-                    logger.info(f"[{trace_id}] Processing SEARCH intent")
-                    llm = LLMFactory.get_llm_for_scenario("search", config=session_config)
-                    metadata["models_used"]["executor"] = session_config.get("SEARCH_LLM_MODEL") or settings.SEARCH_LLM_MODEL or settings.DEFAULT_LLM_MODEL
-
-                    logger.info(f"[{trace_id}] Executing search for: {query}")
-                    search_results = await search_service.search(query)
-                    metadata["search_results"] = search_results
-                    logger.info(f"[{trace_id}] Search returned {len(search_results)} results")
-                    
-                    # Format search results
-                    context_str = ""
-                    for i, res in enumerate(search_results):
-                        context_str += f"{i+1}. {res['title']}: {res.get('body', '')}\n"
-                    
-                    system_prompt = self._get_system_prompt(
-                        provider=session_config.get("SEARCH_LLM_PROVIDER") or settings.SEARCH_LLM_PROVIDER or settings.DEFAULT_LLM_PROVIDER,
-                        model=session_config.get("SEARCH_LLM_MODEL") or settings.SEARCH_LLM_MODEL or settings.DEFAULT_LLM_MODEL,
-                        intent="search",
-                        language=session_language,
-                        context_str=context_str
-                    )
-                    
-                    # Inject Mid-term Memory Context
-                    if memory_context_str:
-                        system_prompt = memory_context_str + system_prompt
-
-                    messages = [
-                        SystemMessage(content=system_prompt)
-                    ]
-                    messages.extend(self._format_history(history))
-                    messages.append(HumanMessage(content=query))
-                    
-                    async for content_chunk in self._stream_with_ttft(self._stream_llm_response(llm, messages), metadata,
-                                                                    start_time):
-                        response_content += content_chunk
-                        yield content_chunk
-                    
                     break
-                except BaseException as e:
-                    logger.error(f"[{trace_id}] Search Error: {e}, falling back to CHAT", exc_info=True)
-                    intent = "chat"
-                    metadata["route"] = "search_error_fallback_chat"
-                    continue
-
-            # Default to CHAT if intent is 'chat' or unknown or fallthrough
-            logger.info(f"[{trace_id}] Processing CHAT intent (or fallback)")
-            llm = LLMFactory.get_llm_for_scenario("chat", config=session_config)
-            metadata["models_used"]["executor"] = session_config.get("CHAT_LLM_MODEL") or settings.CHAT_LLM_MODEL or settings.DEFAULT_LLM_MODEL
-
-            system_prompt = self._get_system_prompt(
-                provider=session_config.get("CHAT_LLM_PROVIDER") or settings.CHAT_LLM_PROVIDER or settings.DEFAULT_LLM_PROVIDER,
-                model=session_config.get("CHAT_LLM_MODEL") or settings.CHAT_LLM_MODEL or settings.DEFAULT_LLM_MODEL,
-                intent="chat",
-                language=session_language
-            )
-            
-            # Inject Mid-term Memory Context
-            if memory_context_str:
-                system_prompt = memory_context_str + system_prompt
-
-            messages = [
-                SystemMessage(content=system_prompt)
-            ]
-            messages.extend(self._format_history(history))
-            messages.append(HumanMessage(content=query))
-
-            async for content_chunk in self._stream_with_ttft(self._stream_llm_response(llm, messages), metadata,
-                                                              start_time):
-                response_content += content_chunk
-                yield content_chunk
-            
-            break
 
-        # Finalize Metadata
-        logger.info(f"[{trace_id}] Response generation complete. Length: {len(response_content)}")
-        logger.debug(f"[{trace_id}] Full Response:\n {response_content}")
+                messages = self._build_messages(
+                    metadata, query, history, mid_term_memory,
+                    provider=chat_provider,
+                    model=chat_model,
+                    intent="chat",
+                    language=session_language
+                )
 
-        # Finalize Metadata
-        end_time = time.time()
-        metadata["latency"]["total_ms"] = int((end_time - start_time) * 1000)
-        metadata["session_id"] = session_id
+                async with aclosing(self._stream_with_ttft(self._stream_llm_response(llm, messages), metadata, start_time)) as stream:
+                    async for content_chunk in stream:
+                        response_content += content_chunk
+                        yield content_chunk
 
-        # 4. Save Memory (Scoped to user)
-        # User message was already saved at the start of the function
-        msg_id = await memory.save_message(session_id, "assistant", response_content, user_id, metadata=metadata)
-        metadata["message_id"] = msg_id
+                if cacheable_chat:
+                    await self._store_response(query_vector_task, cache_scope, "chat", query, response_content)
+                break
 
-        # Yield final metadata chunk
-        yield {
-            "metadata": metadata,
-            "actions": actions
-        }
+            if query_vector_task is not None and not query_vector_task.done():
+                query_vector_task.cancel()
+
+            # Finalize Metadata
+            logger.info(f"[{trace_id}] Response generation complete. Length: {len(response_content)}")
+            logger.debug(f"[{trace_id}] Full Response:\n {response_content}")
+
+            # Finalize Metadata
+            end_time = time.time()
+            metadata["latency"]["total_ms"] = int((end_time - start_time) * 1000)
+            metadata["session_id"] = session_id
+
+            # 4. Save Memory (Scoped to user)
+            # User message was already saved at the start of the function (still in flight after a fast-path answer)
+            if fast_hit:
+                metadata["reply_to"] = await save_task
+            msg_id = await memory.save_message(session_id, "assistant", response_content, user_id, metadata=metadata)
+            assistant_saved = True
+            metadata["message_id"] = msg_id
+            if trace is not None:
+                # Per-stage timings for this response only; not persisted with the message
+                trace.root.set("route", metadata["route"])
+                metadata["latency"]["spans"] = trace.finish()
+
+            # Yield final metadata chunk
+            yield {
+                "metadata": metadata,
+                "actions": actions
+            }
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client gone: the upstream calls were cancelled with us; keep what was already streamed
+            if not assistant_saved:
+                self._save_cancelled_response(
+                    session_id, user_id, response_content, metadata, start_time, trace_id,
+                    reply_task=save_task if fast_hit else None
+                )
+            if query_vector_task is not None:
+                query_vector_task.cancel()
+            if trace is not None:
+                trace.root.set("cancelled", True)
+                trace.finish()
+            raise
 
     def _log_llm_messages(self, trace_id: str, context_msg: str, messages: List[Any]):
         """Helper to log full LLM messages"""
@@ -657,7 +727,12 @@ class DialogueManager:
 
         logger.info("\n".join(log_content))
 
-    async def _route_intent(self, llm, query: str, history: list, trace_id: str = "N/A", session_config: dict = None, language: str = None) -> tuple[str, int]:
+    @traced("intent.route")
+    async def _route_intent(self, llm, query: str, history: list, trace_id: str = "N/A", session_config: dict = None, language: str = None) -> tuple[str, int, str, Optional[dict]]:
+        """
+        Returns (intent, latency_ms, router, cache_hit). Tried in order: the local classifier when it is
+        confident, a cached router decision ({"tier", "saved_ms"} in cache_hit), then the router LLM.
+        """
         start_time = time.time()
         session_config = session_config or {}
         # Prioritize INTENT_LLM, fallback to INSTRUCTION_LLM (legacy), then DEFAULT
@@ -673,9 +748,6 @@ class DialogueManager:
         # The 'llm' passed in might be the one for 'instruction' scenario which might be different now.
         # Ideally we should get the correct LLM here.
         
-        # Re-instantiate LLM for routing to ensure we use the correct config
-        router_llm = LLMFactory.create_llm(provider, model, temperature=0.1)
-
         # Check RAG configuration
         rag_enabled = session_config.get("RAG_ENABLE")
         # Strict check: RAG must be explicitly enabled (True, "true", 1)
@@ -687,6 +759,23 @@ class DialogueManager:
         elif isinstance(rag_enabled, int) and rag_enabled == 1:
             is_rag_enabled = True
 
+        # Confident local classification answers without an LLM call
+        allowed = ["instruction", "rag", "search", "chat"] if is_rag_enabled else ["instruction", "search", "chat"]
+        local_intent, confidence = intent_classifier.predict(query, allowed)
+        if local_intent:
+            logger.info(f"[{trace_id}] Intent classifier routed to {local_intent} (confidence {confidence:.3f})")
+            return local_intent, int((time.time() - start_time) * 1000), INTENT_CLASSIFIER_ROUTER, None
+
+        cache_key = intent_cache.key(query, language, is_rag_enabled, provider, model, prompt_registry.digest)
+        cached, tier = await intent_cache.get(cache_key)
+        if cached:
+            latency_ms = int((time.time() - start_time) * 1000)
+            logger.info(f"[{trace_id}] Intent cache hit ({tier}): {cached['intent']}")
+            return cached["intent"], latency_ms, model, {"tier": tier, "saved_ms": max(cached["latency_ms"] - latency_ms, 0)}
+
+        # Re-instantiate LLM for routing to ensure we use the correct config
+        router_llm = LLMFactory.create_llm(provider, model, temperature=0.1)
+
         # Build intent list
         intent_list = "['instruction', 'search', 'chat']"
         if is_rag_enabled:
@@ -704,8 +793,11 @@ class DialogueManager:
         messages = [HumanMessage(content=prompt)]
         self._log_llm_messages(trace_id, "Router LLM Input Messages:", messages)
 
+        cacheable = False
         try:
-            resp = await router_llm.ainvoke(messages)
+            # Keyed like the decision cache plus the resolved LLM config: identical concurrent queries share one router call
+            router_key = single_flight.key(cache_key, LLMFactory.fingerprint(router_llm))
+            resp = await single_flight.run("router", router_key, lambda: router_llm.ainvoke(messages))
             intent = resp.content.strip().lower()
             
             # Simple validation
@@ -718,6 +810,8 @@ class DialogueManager:
                     found = True
                     break
             
+            # Only real decisions are cached, not the 'chat' fallbacks
+            cacheable = found
             if not found:
                 logger.warning(f"[{trace_id}] Router returned unknown intent: {intent}, defaulting to 'chat'")
                 intent = "chat"
@@ -727,7 +821,9 @@ class DialogueManager:
             intent = "chat"
             
         latency_ms = int((time.time() - start_time) * 1000)
-        return intent, latency_ms
+        if cacheable:
+            await intent_cache.set(cache_key, intent, latency_ms)
+        return intent, latency_ms, model, None
 
     async def _generate_rag_response(self, llm, query, context, history):
         system_prompt = self._get_system_prompt(
@@ -775,6 +871,80 @@ class DialogueManager:
         resp = await llm.ainvoke(messages)
         return resp.content
 
+    def _save_cancelled_response(self, session_id: str, user_id: str, content: str, metadata: Dict[str, Any],
+                                 start_time: float, trace_id: str, reply_task: Optional[asyncio.Task] = None):
+        """
+        Persists the partial answer of a cancelled request, flagged "cancelled", in a detached task:
+        the request's task is being cancelled and its database session is about to close.
+        """
+        metadata["cancelled"] = True
+        metadata["latency"]["total_ms"] = int((time.time() - start_time) * 1000)
+        metadata["session_id"] = session_id
+        logger.info(f"[{trace_id}] Client disconnected, persisting {len(content)} chars of partial response")
+
+        async def save():
+            try:
+                if reply_task is not None:
+                    metadata["reply_to"] = await reply_task
+                async with AsyncSessionLocal() as stage_db:
+                    await MemoryManager(stage_db).save_message(session_id, "assistant", content, user_id, metadata=metadata)
+            except Exception as e:
+                logger.error(f"[{trace_id}] Failed to persist cancelled response: {e}")
+
+        task = asyncio.create_task(save())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _lookup_response_cache(self, query_vector_task, scope: str, query: str,
+                                     metadata: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """A cached answer for the query in the scope; marks the metadata on a hit."""
+        with span("response_cache.lookup") as lookup_span:
+            hit = response_cache.lookup(scope, query, await query_vector_task)
+            lookup_span.set("hit", hit is not None)
+        if hit:
+            metadata["hit_source"] = "semantic_cache"
+            metadata["models_used"]["executor"] = "response_cache"
+            metadata["response_cache"] = {
+                "score": round(hit["score"], 4),
+                "cached_query": hit["query"],
+                "age_seconds": int(time.time() - hit["created_at"]),
+                "freshness": hit["intent"]
+            }
+        return hit
+
+    async def _store_response(self, query_vector_task, scope: str, intent: str, query: str, answer: str,
+                              search_results: Optional[List[Dict[str, Any]]] = None):
+        # Generation failures are streamed as text; never cache them
+        if not answer or "[System Error:" in answer:
+            return
+        try:
+            await response_cache.store(scope, intent, query, await query_vector_task, answer, search_results)
+        except Exception as e:
+            logger.error(f"Failed to cache response: {e}")
+
+    def _build_messages(self, metadata: Dict[str, Any], query: str, history: List[Dict], memory: List[Dict],
+                        provider: str, model: str, intent: str, language: str = None,
+                        retrieved: Optional[List[ContextItem]] = None, render_retrieved=None, **prompt_kwargs) -> List[Any]:
+        """
+        System prompt (mid-term memory + template), history and query fitted into the model's token
+        budget by the context assembler. Tokens per section go to metadata["context_tokens"].
+        """
+        def render_system(context_str: str) -> str:
+            if retrieved is not None:
+                prompt_kwargs["context_str"] = context_str
+            return self._get_system_prompt(provider=provider, model=model, intent=intent, language=language, **prompt_kwargs)
+
+        with span("context.assemble", intent=intent):
+            assembled = context_assembler.assemble(
+                model, render_system, query, history, memory,
+                retrieved=retrieved, render_retrieved=render_retrieved or "\n".join
+            )
+        metadata["context_tokens"] = assembled.report
+        messages = [SystemMessage(content=assembled.system_prompt)]
+        messages.extend(self._format_history(assembled.history))
+        messages.append(HumanMessage(content=query))
+        return messages
+
     def _format_history(self, history):
         msgs = []
         for h in history:
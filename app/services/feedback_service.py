@@ -3,6 +3,8 @@ from sqlalchemy import select, desc, asc, and_, or_
 from app.models.base import Message, Session, BenchmarkCase
 from app.core.redis import RedisClient
 from app.core.logger import logger
+from app.services.query_normalizer import normalize_query
+from app.services.message_writer import message_writer
 import hashlib
 import json
 import uuid
@@ -11,13 +13,15 @@ from datetime import datetime, timezone
 import pytz
 
 class FeedbackService:
+    MGET_CHUNK = 1000
+
     def __init__(self, db: AsyncSession):
         self.db = db
         self.redis = RedisClient.get_instance()
 
     def _get_cache_key(self, query: str, repository_id: Optional[uuid.UUID] = None) -> str:
-        # Normalize query
-        normalized_query = query.strip().lower()
+        # Normalize query (same pipeline as the instruction matcher)
+        normalized_query = normalize_query(query).strip().lower()
         # Create hash
         query_hash = hashlib.sha256(normalized_query.encode('utf-8')).hexdigest()
         
@@ -40,6 +44,28 @@ class FeedbackService:
             logger.error(f"Redis get error: {e}")
         return None
 
+    async def get_cached_instruction_responses(self, queries: List[str], repository_id: Optional[uuid.UUID] = None) -> List[Optional[str]]:
+        """
+        Batch form of get_cached_instruction_response: one MGET per chunk instead of a GET per query.
+        Returns the cached responses (or None) in query order.
+        """
+        keys = [self._get_cache_key(query, repository_id) for query in queries]
+        responses: List[Optional[str]] = [None] * len(keys)
+        for start in range(0, len(keys), self.MGET_CHUNK):
+            try:
+                values = await self.redis.mget(keys[start:start + self.MGET_CHUNK])
+            except Exception as e:
+                logger.error(f"Redis mget error: {e}")
+                continue
+            for offset, cached_data in enumerate(values):
+                if not cached_data:
+                    continue
+                try:
+                    responses[start + offset] = json.loads(cached_data).get("response")
+                except (ValueError, AttributeError):
+                    pass
+        return responses
+
     async def cache_instruction_response(self, query: str, response: str, repository_id: Optional[uuid.UUID] = None):
         """
         Cache instruction response.
@@ -66,6 +92,10 @@ class FeedbackService:
                 
             await self.redis.set(key, json.dumps(data, ensure_ascii=False), ex=ttl)
             logger.info(f"Cached instruction response for query: {query} (repo: {repository_id})")
+
+            # Liked pairs also feed the semantic fallback tier
+            from app.services.semantic_instruction_index import semantic_index
+            await semantic_index.add_liked(key, repository_id, query, response)
         except Exception as e:
             logger.error(f"Redis set error: {e}")
 
@@ -98,9 +128,14 @@ class FeedbackService:
             if feedback == "delete":
                 await self.db.delete(case)
                 await self.db.commit()
+                # Drop its matcher template
+                from app.services.instruction_matcher import matcher_service
+                await matcher_service.remove_case(case.id)
                 # Remove from Redis cache if exists
                 key = self._get_cache_key(case.question, case.repository_id)
                 await self.redis.delete(key)
+                from app.services.semantic_instruction_index import semantic_index
+                await semantic_index.remove_liked(key, case.repository_id)
                 return
             
             # If it's a benchmark case, we just check if feedback is like to cache it
@@ -108,7 +143,9 @@ class FeedbackService:
                 await self.cache_instruction_response(case.question, case.answer, repository_id=case.repository_id)
             return
 
-        # Try Message
+        # Try Message (it may still be in the write-behind queue)
+        if message_writer.is_pending(message_id):
+            await message_writer.flush()
         stmt = select(Message).where(Message.id == message_id)
         result = await self.db.execute(stmt)
         message = result.scalar_one_or_none()
@@ -193,7 +230,7 @@ class FeedbackService:
         version: Optional[int] = None,
         unmatched: Optional[bool] = None,
         sort_by: Optional[str] = None, # 'hit_count_asc', 'hit_count_desc'
-        hit_source: Optional[str] = None # 'llm', 'redis', 'memory'
+        hit_source: Optional[str] = None # 'llm', 'redis', 'memory', 'semantic'
     ):
         """
         Get instruction question-answer pairs across all sessions.
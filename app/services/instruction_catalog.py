@@ -0,0 +1,210 @@
+import asyncio
+import json
+import logging
+import math
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.invalidation import invalidation_bus
+from app.services.instruction_service import InstructionService
+from app.services.query_normalizer import normalize_query
+from app.services.vector_service import vector_service
+
+logger = logging.getLogger(__name__)
+
+
+def _serialize(inst) -> str:
+    """Compact JSON of one instruction for the executor prompt (no indentation: it only costs tokens)."""
+    return json.dumps(
+        {"name": inst.name, "description": inst.description, "parameters": inst.parameters},
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+
+
+def _document(inst) -> str:
+    """Text an instruction is retrieved by: name words, description, parameter descriptions and enum values."""
+    parts = [(inst.name or "").replace("_", " "), inst.description or ""]
+    properties = (inst.parameters or {}).get("properties") if isinstance(inst.parameters, dict) else None
+    for schema in (properties or {}).values():
+        if not isinstance(schema, dict):
+            continue
+        parts.append(str(schema.get("description") or ""))
+        parts.extend(str(v) for v in schema.get("enum") or [])
+    return " ".join(parts)
+
+
+def _grams(text: str) -> set:
+    """Character bigrams of the normalized text (whitespace removed), which works for CJK and English alike."""
+    text = "".join(normalize_query(text).lower().split())
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class _CatalogEntry:
+    """One repository's catalogue at one version: the serialized fragments and their retrieval index."""
+
+    def __init__(self, version: Tuple[int, int], instructions):
+        self.version = version
+        self.fragments = [_serialize(inst) for inst in instructions]
+        self.catalog = "[" + ",".join(self.fragments) + "]"
+        self.documents = [_document(inst) for inst in instructions]
+        self.grams = [_grams(doc) for doc in self.documents]
+        df = Counter(g for grams in self.grams for g in grams)
+        n = len(self.grams)
+        self.idf = {g: math.log((n + 1) / (count + 0.5)) for g, count in df.items()}
+        self.vectors: Optional[np.ndarray] = None
+        self.embed_task: Optional[asyncio.Task] = None
+        self.embed_retry_at = 0.0  # time.monotonic() before which a failed embedding is not retried
+
+    def keyword_scores(self, query: str) -> np.ndarray:
+        """
+        IDF-weighted share of the query's bigrams each instruction contains. Bigrams no instruction
+        has (glue like "把空" in "把空调...") still count against the match, with a flat weight of 1.
+        """
+        query_grams = _grams(query)
+        weights = {g: self.idf.get(g, 1.0) for g in query_grams}
+        total = sum(weights.values())
+        if not total:
+            return np.zeros(len(self.grams), dtype=np.float32)
+        return np.array([sum(w for g, w in weights.items() if g in grams) / total for grams in self.grams], dtype=np.float32)
+
+
+class InstructionCatalog:
+    """
+    Per-repository cache of the serialized instruction catalogue for the executor prompt.
+    Each repository has a version that every create/import/delete bumps (here and, through the
+    invalidation bus, on the other workers); a load that raced with a bump is not cached.
+
+    For large repositories select() sends the executor only the top-K instructions by keyword and
+    embedding similarity to the query, and the full catalogue when the best match is weak.
+    """
+
+    MAX_ENTRIES = 1024
+    EMBED_RETRY_SECONDS = 30.0
+
+    def __init__(self):
+        # (user_id, repository_id) -> catalogue entry
+        self._entries: Dict[Tuple[uuid.UUID, uuid.UUID], _CatalogEntry] = {}
+        self._versions: Dict[uuid.UUID, int] = {}
+        self._epoch = 0  # Bumped when every repository is invalidated at once
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, repository_id: uuid.UUID) -> Tuple[int, int]:
+        return self._epoch, self._versions.get(repository_id, 0)
+
+    async def _entry(self, db: AsyncSession, user_id: uuid.UUID, repository_id: uuid.UUID) -> _CatalogEntry:
+        key = (user_id, repository_id)
+        version = self.version(repository_id)
+        entry = self._entries.get(key)
+        if entry is not None and entry.version == version:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        instructions = await InstructionService(db).get_all_instructions(user_id, repository_id=repository_id)
+        entry = _CatalogEntry(version, instructions)
+        if self.version(repository_id) == version:
+            if len(self._entries) >= self.MAX_ENTRIES:
+                self._entries.clear()
+            self._entries[key] = entry
+        return entry
+
+    async def get(self, db: AsyncSession, user_id: uuid.UUID, repository_id: uuid.UUID) -> str:
+        """The full serialized catalogue."""
+        return (await self._entry(db, user_id, repository_id)).catalog
+
+    async def select(self, db: AsyncSession, user_id: uuid.UUID, repository_id: uuid.UUID,
+                     query: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Returns (serialized instructions, selection info) for the executor prompt: the top-K
+        instructions for the query, or the full catalogue for small repositories and weak matches.
+        """
+        entry = await self._entry(db, user_id, repository_id)
+        total = len(entry.fragments)
+        top_k = settings.INSTRUCTION_PRESELECT_TOP_K
+        info: Dict[str, Any] = {"total": total, "selected": total, "mode": "full"}
+        if not settings.INSTRUCTION_PRESELECT_ENABLE or total <= top_k:
+            return entry.catalog, info
+
+        scores = entry.keyword_scores(query)
+        mode = "keyword"
+        vectors = self._vectors(entry)
+        if vectors is not None:
+            try:
+                query_vector = np.asarray(await vector_service.embed_query(query), dtype=np.float32)
+                norm = float(np.linalg.norm(query_vector))
+                if norm:
+                    weight = settings.INSTRUCTION_PRESELECT_EMBEDDING_WEIGHT
+                    scores = weight * (vectors @ (query_vector / norm)) + (1 - weight) * scores
+                    mode = "hybrid"
+            except Exception as e:
+                logger.warning(f"Instruction preselection query embedding failed, using keywords only: {e}")
+
+        best = float(scores.max())
+        info["best_score"] = round(best, 4)
+        if best < settings.INSTRUCTION_PRESELECT_MIN_SCORE:
+            info["mode"] = "full_low_confidence"
+            return entry.catalog, info
+
+        # Keep catalogue order among the selected ones
+        top = np.sort(np.argpartition(-scores, top_k - 1)[:top_k])
+        info.update({"selected": top_k, "mode": mode})
+        return "[" + ",".join(entry.fragments[i] for i in top) + "]", info
+
+    def _vectors(self, entry: _CatalogEntry) -> Optional[np.ndarray]:
+        """Instruction embeddings once computed; the first requests of a version use keywords while they are."""
+        if not settings.INSTRUCTION_PRESELECT_EMBEDDINGS:
+            return None
+        if entry.vectors is None and entry.embed_task is None and time.monotonic() >= entry.embed_retry_at:
+            entry.embed_task = asyncio.create_task(self._embed(entry))
+        return entry.vectors
+
+    async def _embed(self, entry: _CatalogEntry):
+        try:
+            rows = []
+            batch = settings.SEMANTIC_INSTRUCTION_EMBED_BATCH
+            for start in range(0, len(entry.documents), batch):
+                rows.extend(await vector_service.embed_documents(entry.documents[start:start + batch]))
+            vectors = np.asarray(rows, dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            entry.vectors = vectors / np.where(norms == 0, 1, norms)
+        except Exception as e:
+            logger.error(f"Failed to embed instruction catalogue, retrying in {self.EMBED_RETRY_SECONDS}s: {e}")
+            # Let a later select() try again instead of staying keyword-only until the next version
+            entry.embed_retry_at = time.monotonic() + self.EMBED_RETRY_SECONDS
+            entry.embed_task = None
+
+    def _bump(self, repository_id: Optional[uuid.UUID]):
+        if repository_id is None:
+            # Unknown repository: drop everything
+            self._epoch += 1
+            self._entries.clear()
+            return
+        self._versions[repository_id] = self._versions.get(repository_id, 0) + 1
+        for key in [key for key in self._entries if key[1] == repository_id]:
+            del self._entries[key]
+
+    async def invalidate(self, repository_id: Optional[uuid.UUID]):
+        """Call after instructions of the repository were created, imported or deleted."""
+        self._bump(repository_id)
+        await invalidation_bus.publish("instruction_catalog", repository_id, {"repository_id": str(repository_id) if repository_id else None})
+
+    async def apply_remote(self, payload: Dict[str, Any]):
+        repository_id = payload.get("repository_id")
+        self._bump(uuid.UUID(repository_id) if repository_id else None)
+
+    async def resync(self):
+        self._bump(None)
+
+
+instruction_catalog = InstructionCatalog()
+invalidation_bus.register("instruction_catalog", instruction_catalog.apply_remote, resync=instruction_catalog.resync)
@@ -5,7 +5,8 @@ import logging
 import uuid
 from typing import List, Dict, Any
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.services.instruction_service import InstructionService
+from app.services.instruction_service import InstructionService, refresh_matcher_slot_enums
+from app.services.instruction_catalog import instruction_catalog
 
 logger = logging.getLogger(__name__)
 
@@ -59,13 +60,18 @@ class InstructionImportService:
                         "is_active": True
                     }
                     
-                    await self.instruction_service.create_instruction(data, user_id=user_id)
+                    await self.instruction_service.create_instruction(data, user_id=user_id, invalidate_catalog=False)
                     success_count += 1
                     
                 except Exception as e:
                     failed_count += 1
                     errors.append(f"Row {index+2}: {str(e)}")
             
+            if success_count:
+                # Once for the whole file rather than per row
+                await instruction_catalog.invalidate(repository_id)
+                await refresh_matcher_slot_enums(self.db, repository_id)
+
             return {
                 "total": len(df),
                 "success": success_count,
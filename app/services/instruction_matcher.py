@@ -2,22 +2,376 @@ import re
 import json
 import copy
 import logging
-from typing import List, Dict, Any, Optional
+import time
+from typing import List, Dict, Any, Optional, Callable, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.models.base import BenchmarkCase
-from app.models.instruction import InstructionRepository
+from app.models.instruction import Instruction, InstructionRepository
 from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.core.invalidation import invalidation_bus
+from app.services.semantic_instruction_index import semantic_index
+from app.services.feedback_service import FeedbackService
+from app.services.query_normalizer import normalize_query, normalize_query_spans, normalize_value
 import os
 import asyncio
+import hashlib
+import hmac
 import uuid
+from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
+class _LiteralTrie:
+    """
+    Character trie over lower-cased literal keys.
+    Used as a prefilter so only templates whose static text can line up with the query are regex-tested.
+    """
+    __slots__ = ("children", "items")
+
+    def __init__(self):
+        self.children: Dict[str, "_LiteralTrie"] = {}
+        self.items: List[Dict[str, Any]] = []
+
+    def insert(self, key: str, item: Dict[str, Any]):
+        node = self
+        for ch in key:
+            child = node.children.get(ch)
+            if child is None:
+                child = _LiteralTrie()
+                node.children[ch] = child
+            node = child
+        node.items.append(item)
+
+    def remove(self, key: str, item: Dict[str, Any]):
+        node = self
+        for ch in key:
+            node = node.children.get(ch)
+            if node is None:
+                return
+        node.items = [i for i in node.items if i is not item]
+
+    def collect_prefixes(self, text: str, out: List[Dict[str, Any]]):
+        """Appends every item whose key is a prefix of text."""
+        node = self
+        for ch in text:
+            node = node.children.get(ch)
+            if node is None:
+                return
+            if node.items:
+                out.extend(node.items)
+
+
+class _TemplateIndex:
+    """
+    Templates of a single repository, indexed by their static text:
+    - literal templates (no parameters) by exact lower-cased query
+    - templates with a static head in a prefix trie
+    - templates starting with a parameter but with a static tail in a (reversed) suffix trie
+    - anything else in a small list filtered by required substrings
+    """
+
+    def __init__(self):
+        self.by_pattern: Dict[str, Dict[str, Any]] = {}
+        self.literals: Dict[str, List[Dict[str, Any]]] = {}
+        self.prefix_trie = _LiteralTrie()
+        self.suffix_trie = _LiteralTrie()
+        self.unanchored: List[Dict[str, Any]] = []
+
+    def __len__(self):
+        return len(self.by_pattern)
+
+    def add(self, template: Dict[str, Any]):
+        self.by_pattern[template["pattern"]] = template
+        segments = template["static_segments"]
+        if template["param_map"] == {}:
+            self.literals.setdefault(segments[0], []).append(template)
+        elif segments[0]:
+            self.prefix_trie.insert(segments[0], template)
+        elif segments[-1]:
+            self.suffix_trie.insert(segments[-1][::-1], template)
+        else:
+            self.unanchored.append(template)
+
+    def remove(self, template: Dict[str, Any]):
+        self.by_pattern.pop(template["pattern"], None)
+        segments = template["static_segments"]
+        if template["param_map"] == {}:
+            bucket = [t for t in self.literals.get(segments[0], []) if t is not template]
+            if bucket:
+                self.literals[segments[0]] = bucket
+            else:
+                self.literals.pop(segments[0], None)
+        elif segments[0]:
+            self.prefix_trie.remove(segments[0], template)
+        elif segments[-1]:
+            self.suffix_trie.remove(segments[-1][::-1], template)
+        else:
+            self.unanchored = [t for t in self.unanchored if t is not template]
+
+    def candidates(self, probe: str) -> List[Dict[str, Any]]:
+        """Returns templates that can possibly match the lower-cased probe (regex still decides)."""
+        found = list(self.literals.get(probe, ()))
+
+        prefixed: List[Dict[str, Any]] = []
+        self.prefix_trie.collect_prefixes(probe, prefixed)
+        suffixed: List[Dict[str, Any]] = []
+        self.suffix_trie.collect_prefixes(probe[::-1], suffixed)
+
+        for template in prefixed + suffixed + self.unanchored:
+            # Bounded slots bound the match length too: long transcripts skip the regex entirely
+            if not template["min_length"] <= len(probe) <= template["max_length"]:
+                continue
+            segments = template["static_segments"]
+            if not probe.endswith(segments[-1]):
+                continue
+            if all(seg in probe for seg in segments[1:-1]):
+                found.append(template)
+        return found
+
+
+_FLOAT_RE = re.compile(r'\d+\.\d+')
+
+
+def _convert_number(val_str: str, raw: str) -> Any:
+    """Converter for number slots; the slot regex already guarantees the shape."""
+    return float(val_str) if "." in val_str else int(val_str)
+
+
+def _convert_text(val_str: str, raw: str) -> Any:
+    """
+    Converter for string slots: captured digits (including normalized Chinese numerals) come back
+    as numbers, anything else as the user's original wording.
+    """
+    if val_str.isdecimal():
+        return int(val_str)
+    if _FLOAT_RE.fullmatch(val_str):
+        return float(val_str)
+    return raw
+
+
+def _compile_fill_plan(json_template: Any, slots: Dict[str, Tuple[int, Callable[[str, str], Any]]], path: str = '') -> Callable[[tuple, tuple], Any]:
+    """
+    Compiles a JSON template into a builder that produces a fresh result from the captured groups
+    (normalized, and mapped back onto the original query).
+    `slots` maps dotted leaf paths to (group index, converter); every other leaf is a constant.
+    Static containers are rebuilt on each call so callers can mutate the result freely.
+    """
+    if isinstance(json_template, dict):
+        items = [(k, _compile_fill_plan(v, slots, f"{path}.{k}" if path else k)) for k, v in json_template.items()]
+        return lambda groups, raw: {k: build(groups, raw) for k, build in items}
+    if isinstance(json_template, list):
+        builders = [_compile_fill_plan(v, slots, f"{path}.{i}" if path else str(i)) for i, v in enumerate(json_template)]
+        return lambda groups, raw: [build(groups, raw) for build in builders]
+
+    slot = slots.get(path)
+    if slot is not None:
+        group_idx, convert = slot
+        return lambda groups, raw: convert(groups[group_idx], raw[group_idx])
+    return lambda groups, raw: json_template
+
+
+def _raw_groups(user_query: str, match) -> tuple:
+    """Maps the groups of a match against the normalized query back onto the original wording."""
+    _, source, starts, ends = normalize_query_spans(user_query)
+    raw = []
+    for i in range(1, (match.re.groups or 0) + 1):
+        start, end = match.span(i)
+        raw.append(source[starts[start]:ends[end - 1]] if end > start else "")
+    return tuple(raw)
+
+
+# Up to 9 integer digits and 4 decimals; wider values are not voice-command parameters
+_NUMBER_SLOT_PATTERN = r"\d{1,9}(?:\.\d{1,4})?"
+_NUMBER_SLOT_MAX = 14
+# Distinct lengths a number slot can try on a digit run (greedy digits, optional fraction)
+_NUMBER_SLOT_WIDTH = 10
+
+
+class _EnumConverter:
+    """Converter for enum slots: maps the captured (normalized) value back to the declared enum value."""
+    __slots__ = ("values",)
+
+    def __init__(self, values: Dict[str, str]):
+        self.values = values
+
+    def __call__(self, val_str: str, raw: str) -> Any:
+        return self.values.get(val_str.lower(), raw)
+
+
+def _export_slot(slot: Tuple[int, Callable[[str, str], Any]]) -> List[Any]:
+    """(group index, converter) -> [group index, kind(, enum values)] for the snapshot."""
+    group_idx, convert = slot
+    if isinstance(convert, _EnumConverter):
+        return [group_idx, "enum", convert.values]
+    return [group_idx, "number" if convert is _convert_number else "text"]
+
+
+def _import_slot(data: List[Any]) -> Tuple[int, Callable[[str, str], Any]]:
+    group_idx, kind = data[0], data[1]
+    if kind == "enum":
+        return group_idx, _EnumConverter(data[2])
+    if kind == "number":
+        return group_idx, _convert_number
+    if kind == "text":
+        return group_idx, _convert_text
+    raise ValueError(f"Unknown slot kind {kind!r}")
+
+
+def _id_to_str(value: Optional[uuid.UUID]) -> Optional[str]:
+    return str(value) if value is not None else None
+
+
+def _str_to_id(value: Optional[str]) -> Optional[uuid.UUID]:
+    return uuid.UUID(value) if value is not None else None
+
+
+def build_slot_enums(instructions) -> Dict[Tuple[Optional[uuid.UUID], str], Dict[str, Dict[str, str]]]:
+    """
+    Indexes the enum parameters of an instruction catalogue, given as (repository_id, name, parameters)
+    rows: (repository_id, name) -> {leaf path: {normalized lower-cased value: declared value}}.
+    """
+    enums: Dict[Tuple[Optional[uuid.UUID], str], Dict[str, Dict[str, str]]] = {}
+    for repository_id, name, parameters in instructions:
+        properties = (parameters or {}).get("properties") if isinstance(parameters, dict) else None
+        for prop, schema in (properties or {}).items():
+            values = schema.get("enum") if isinstance(schema, dict) else None
+            if not values:
+                continue
+            mapping = {normalize_value(v).lower(): v for v in values if isinstance(v, str) and v.strip()}
+            if mapping:
+                enums.setdefault((repository_id, name), {})[f"parameters.{prop}"] = mapping
+    return enums
+
+
+def _slot_spec(m: Dict[str, Any], enum_values: Optional[Dict[str, str]]) -> Tuple[str, int, Optional[frozenset]]:
+    """(kind, max length, enum values) of a slot found in the query."""
+    if isinstance(m["value"], (int, float)):
+        return ("number", _NUMBER_SLOT_MAX, None)
+    if enum_values and m["val_str"].lower() in enum_values:
+        values = frozenset(enum_values)
+        return ("enum", max(len(v) for v in values), values)
+    return ("text", max(settings.INSTRUCTION_SLOT_MAX_CHARS, len(m["val_str"])), None)
+
+
+def _template_cost(static_length: int, specs: List[Tuple[str, int, Optional[frozenset]]]) -> int:
+    """
+    Upper bound on regex steps for one anchored match attempt: every combination of slot
+    lengths (enum alternatives) may be tried, each checking at most the template's length.
+    """
+    cost = static_length + sum(spec[1] for spec in specs)
+    for kind, max_len, values in specs:
+        cost *= len(values) if kind == "enum" else _NUMBER_SLOT_WIDTH if kind == "number" else max_len
+    return cost
+
+
+def _compiled_regex(template: Dict[str, Any]):
+    regex = template["regex"]
+    if regex is None:
+        regex = template["regex"] = re.compile(template["pattern"], re.IGNORECASE)
+    return regex
+
+
+def _template_tokens(template: Dict[str, Any]) -> List[Any]:
+    """Lower-cased literal characters interleaved with slot specs (tuples), in pattern order."""
+    specs = template["slot_specs"]
+    tokens: List[Any] = []
+    for i, segment in enumerate(template["static_segments"]):
+        tokens.extend(segment)
+        if i < len(specs):
+            tokens.append(specs[i])
+    return tokens
+
+
+def _representative(template: Dict[str, Any]) -> str:
+    """A query the template is guaranteed to match."""
+    parts = []
+    for t in _template_tokens(template):
+        if not isinstance(t, tuple):
+            parts.append(t)
+        elif t[0] == "number":
+            parts.append("0")
+        elif t[0] == "enum":
+            parts.append(min(t[2]))
+        else:
+            parts.append("\x00")
+    return "".join(parts)
+
+
+def _token_max_length(token: Any) -> int:
+    return token[1] if isinstance(token, tuple) else 1
+
+
+def _covers(general: Dict[str, Any], specific: Dict[str, Any]) -> bool:
+    """
+    True if every query matched by `specific` is also matched by `general` (sound, not complete).
+    A text slot absorbs any non-empty run of characters/slots that fits its length bound; a number
+    slot only a number slot; an enum slot only an enum slot with a subset of its values.
+    """
+    b = _template_tokens(general)
+    a = _template_tokens(specific)
+    memo: Dict[Tuple[int, int], bool] = {}
+
+    def covers_from(i: int, j: int) -> bool:
+        key = (i, j)
+        if key in memo:
+            return memo[key]
+        if j == len(b):
+            result = i == len(a)
+        elif isinstance(b[j], tuple) and b[j][0] == "text":
+            result = False
+            run_max = 0
+            for k in range(i + 1, len(a) + 1):
+                run_max += _token_max_length(a[k - 1])
+                if a[k - 1] == "\n" or run_max > b[j][1]:
+                    break
+                if covers_from(k, j + 1):
+                    result = True
+                    break
+        elif i == len(a):
+            result = False
+        elif isinstance(b[j], tuple):
+            kind = b[j][0]
+            result = (
+                isinstance(a[i], tuple) and a[i][0] == kind
+                and (kind == "number" or a[i][2] <= b[j][2])
+                and covers_from(i + 1, j + 1)
+            )
+        else:
+            result = not isinstance(a[i], tuple) and a[i] == b[j] and covers_from(i + 1, j + 1)
+        memo[key] = result
+        return result
+
+    return covers_from(0, 0)
+
+
 class InstructionMatcher:
+    SLOW_MATCH_STRIKES = 3
+
     def __init__(self):
-        self.templates = []
-    
+        self._templates: Dict[int, Dict[str, Any]] = {}
+        # Pruned templates (never the first match), kept to come back if their cover goes away
+        self._shadowed: Dict[int, Dict[str, Any]] = {}
+        # (repository_id, pattern) -> shadowed template, so re-adding its pattern merges into it
+        self._shadowed_patterns: Dict[Tuple[Optional[uuid.UUID], str], Dict[str, Any]] = {}
+        self._merged = 0
+        self.prune_report: Optional[Dict[str, Any]] = None
+        self._indexes: Dict[Optional[uuid.UUID], _TemplateIndex] = {}
+        # BenchmarkCase.id -> owning template plus the source pair (to regenerate on removal)
+        self._cases: Dict[uuid.UUID, Dict[str, Any]] = {}
+        self._seq = 0
+        # (repository_id, instruction name) -> enum parameters, see build_slot_enums
+        self.slot_enums: Dict[Tuple[Optional[uuid.UUID], str], Dict[str, Dict[str, str]]] = {}
+        # Templates taken out of matching after repeated slow regex runs
+        self._quarantined: Dict[int, Dict[str, Any]] = {}
+        self.slow_match_seconds = settings.INSTRUCTION_MATCH_SLOW_MS / 1000.0
+
+    @property
+    def templates(self) -> List[Dict[str, Any]]:
+        """All templates in insertion order (match priority)."""
+        return list(self._templates.values())
+
     def _flatten_json(self, obj: Any, parent_key: str = '', sep: str = '.') -> List[Dict[str, Any]]:
         """
         Flatten JSON to list of {path: 'a.b', value: val}
@@ -35,40 +389,29 @@ class InstructionMatcher:
             items.append({"path": parent_key, "value": obj})
         return items
 
-    def _set_value_by_path(self, obj: Any, path: str, value: Any, sep: str = '.'):
-        """Sets value in nested dict/list by dot-notation path."""
-        parts = path.split(sep)
-        curr = obj
-        for i, part in enumerate(parts[:-1]):
-            if isinstance(curr, list):
-                idx = int(part)
-                curr = curr[idx]
-            else:
-                curr = curr[part]
-        
-        last = parts[-1]
-        if isinstance(curr, list):
-            curr[int(last)] = value
-        else:
-            curr[last] = value
-
-    def generalize_instruction(self, query: str, json_response: Dict[str, Any]) -> Dict[str, Any]:
+    def generalize_instruction(self, query: str, json_response: Dict[str, Any],
+                               repository_id: Optional[uuid.UUID] = None) -> Dict[str, Any]:
         """
         Generalizes a specific instruction into a regex template.
+        The template is built over the normalized query, the same form match() compares against.
+        Slots are typed and length bounded so a near-miss query cannot backtrack for long:
+        numbers, enums declared by the instruction's parameter schema, and short text.
         """
+        normalized = normalize_query(query)
+
         # 1. Extract all leaf values from JSON
         leaves = self._flatten_json(json_response)
         
         # 2. Filter values that are actually present in the query
         matches = []
         for leaf in leaves:
-            val_str = str(leaf['value'])
+            val_str = normalize_value(str(leaf['value']))
             # Skip very short matches to avoid noise (e.g. "1") unless it's the whole query?
             # For now, let's allow everything but require strict substring match.
-            if val_str in query:
+            if val_str and val_str in normalized:
                 # Find ALL occurrences? No, just first one for simplicity or we get complex overlaps.
                 # Or we can support multiple parameters.
-                start_idx = query.find(val_str)
+                start_idx = normalized.find(val_str)
                 matches.append({
                     "val_str": val_str,
                     "start": start_idx,
@@ -86,131 +429,477 @@ class InstructionMatcher:
             if m['start'] >= last_end:
                 final_matches.append(m)
                 last_end = m['end']
+
+        # 4. Type each slot, then demote text slots to literal text while the template is too costly
+        enums = self._slot_enums_for(repository_id, json_response)
+        for m in final_matches:
+            m["spec"] = _slot_spec(m, enums.get(m["path"]))
+        static_length = len(normalized) - sum(m["end"] - m["start"] for m in final_matches)
+        cost = _template_cost(static_length, [m["spec"] for m in final_matches])
+        while cost > settings.INSTRUCTION_TEMPLATE_MAX_COST:
+            text_slots = [m for m in final_matches if m["spec"][0] == "text"]
+            if not text_slots:
+                break
+            demoted = text_slots[-1]
+            final_matches.remove(demoted)
+            static_length += demoted["end"] - demoted["start"]
+            cost = _template_cost(static_length, [m["spec"] for m in final_matches])
         
-        # 4. Build Regex and Template JSON
+        # 5. Build Regex and Template JSON
         regex_parts = []
+        static_segments = [] # Unescaped static text around params (head, middles..., tail)
         current_idx = 0
         param_map = {} # param_name -> path
+        slots = {} # path -> (group index, converter)
+        slot_specs = [] # group index -> (kind, max length, enum values)
         template_json = copy.deepcopy(json_response)
         
         for i, m in enumerate(final_matches):
             # Static part before this param
-            static_text = query[current_idx:m['start']]
+            static_text = normalized[current_idx:m['start']]
             if static_text:
                 regex_parts.append(re.escape(static_text))
+            static_segments.append(static_text.lower())
             
             # Param part
             param_name = f"p_{i}"
-            
-            # Determine regex type based on value type
-            if isinstance(m['value'], (int, float)):
-                 # Number: \d+ or \d+(\.\d+)?
-                 regex_parts.append(f"(?P<{param_name}>\\d+(?:\\.\\d+)?)")
+            kind, max_len, values = m["spec"]
+            if kind == "number":
+                regex_parts.append(f"(?P<{param_name}>{_NUMBER_SLOT_PATTERN})")
+                convert = _convert_number
+            elif kind == "enum":
+                alternatives = "|".join(re.escape(v) for v in sorted(values, key=len, reverse=True))
+                regex_parts.append(f"(?P<{param_name}>{alternatives})")
+                convert = _EnumConverter(enums[m["path"]])
             else:
-                 # String: .+? (Non-greedy match)
-                 regex_parts.append(f"(?P<{param_name}>.+?)")
+                # Lazy but bounded: at most max_len characters to try per slot
+                regex_parts.append(f"(?P<{param_name}>.{{1,{max_len}}}?)")
+                convert = _convert_text
             
             # Update mapping
             param_map[param_name] = m['path']
-            
-            # Update JSON template with placeholder (for debugging/reference)
-            # self._set_value_by_path(template_json, m['path'], f"{{{{{param_name}}}}}")
+            slots[m['path']] = (i, convert)
+            slot_specs.append(m["spec"])
             
             current_idx = m['end']
             
         # Tail
-        tail_text = query[current_idx:]
+        tail_text = normalized[current_idx:]
         if tail_text:
             regex_parts.append(re.escape(tail_text))
+        static_segments.append(tail_text.lower())
         
         full_regex = "^" + "".join(regex_parts) + "$"
+        static_length = sum(len(seg) for seg in static_segments)
         
         return {
             "pattern": full_regex,
             "json_template": template_json,
             "param_map": param_map,
-            "original_query": query
+            "slots": slots,
+            "slot_specs": slot_specs,
+            "original_query": query,
+            "static_segments": static_segments,
+            # Every param consumes at least one character and at most its bound
+            "min_length": static_length + len(param_map),
+            "max_length": static_length + sum(spec[1] for spec in slot_specs),
+            "cost": _template_cost(static_length, slot_specs)
         }
 
-    def add_instruction(self, query: str, json_response: Dict[str, Any], repository_id: Optional[uuid.UUID] = None):
-        template = self.generalize_instruction(query, json_response)
+    def update_slot_enums(self, repository_id: Optional[uuid.UUID],
+                          enums: Dict[Tuple[Optional[uuid.UUID], str], Dict[str, Dict[str, str]]]) -> int:
+        """
+        Replaces the enum parameters of one repository's catalogue (build_slot_enums of its active
+        instructions) and regenerates the cases of every instruction whose enums changed, so their
+        templates get the current enum slots. Returns the number of regenerated cases.
+        """
+        old = {name: values for (repo, name), values in self.slot_enums.items() if repo == repository_id}
+        new = {name: values for (repo, name), values in enums.items() if repo == repository_id}
+        changed = {name for name in old.keys() | new.keys() if old.get(name) != new.get(name)}
+        if not changed:
+            return 0
+        slot_enums = {key: values for key, values in self.slot_enums.items() if key[0] != repository_id}
+        slot_enums.update({(repository_id, name): values for name, values in new.items()})
+        self.slot_enums = slot_enums
+
+        # Global instructions are the fallback of every repository
+        affected = [
+            (case_id, entry) for case_id, entry in self._cases.items()
+            if (repository_id is None or entry["template"]["repository_id"] == repository_id)
+            and isinstance(entry["json_response"], dict) and entry["json_response"].get("name") in changed
+        ]
+        for case_id, entry in affected:
+            self.add_instruction(entry["query"], entry["json_response"], entry["template"]["repository_id"], case_id)
+        return len(affected)
+
+    def _slot_enums_for(self, repository_id: Optional[uuid.UUID], json_response: Any) -> Dict[str, Dict[str, str]]:
+        """Enum-valued parameters of the answer's instruction (repository catalogue first, then global)."""
+        if not self.slot_enums or not isinstance(json_response, dict):
+            return {}
+        name = json_response.get("name")
+        if not isinstance(name, str):
+            return {}
+        found = self.slot_enums.get((repository_id, name))
+        if found is None and repository_id is not None:
+            found = self.slot_enums.get((None, name))
+        return found or {}
+
+    def add_instruction(self, query: str, json_response: Dict[str, Any], repository_id: Optional[uuid.UUID] = None,
+                        case_id: Optional[uuid.UUID] = None):
+        """
+        Adds a generalized template. When case_id (BenchmarkCase.id) is given the template can later
+        be removed or replaced by that id; adding an already known case_id replaces it.
+        """
+        if case_id is not None and case_id in self._cases:
+            self.remove_case(case_id)
+
+        template = self.generalize_instruction(query, json_response, repository_id)
         template["repository_id"] = repository_id
         
-        # Deduplication (avoid adding identical patterns)
-        for t in self.templates:
-            if t["pattern"] == template["pattern"] and t.get("repository_id") == repository_id:
-                return
-        self.templates.append(template)
+        index = self._indexes.get(repository_id)
+        if index is None:
+            index = _TemplateIndex()
+            self._indexes[repository_id] = index
+
+        # Deduplication (avoid adding identical patterns), but remember every owning case.
+        # A pruned template is out of the index but still owns its pattern.
+        existing = index.by_pattern.get(template["pattern"]) or self._shadowed_patterns.get((repository_id, template["pattern"]))
+        if existing is not None:
+            self._merged += 1
+            if case_id is None:
+                existing["pinned"] = True
+            else:
+                existing["case_ids"].append(case_id)
+                self._cases[case_id] = {"template": existing, "query": query, "json_response": json_response}
+            return
+
+        # Regex and fill plan are compiled on first use: most templates are never a candidate,
+        # and compiling dominates load time
+        template["regex"] = None
+        template["fill"] = None
+        template["seq"] = self._seq
+        template["case_ids"] = [case_id] if case_id is not None else []
+        # Templates added without a case id cannot be removed by id
+        template["pinned"] = case_id is None
+        self._seq += 1
+        self._templates[template["seq"]] = template
+        index.add(template)
+        if case_id is not None:
+            self._cases[case_id] = {"template": template, "query": query, "json_response": json_response}
+
+    def remove_case(self, case_id: uuid.UUID) -> bool:
+        """Removes the template contributed by a BenchmarkCase. Returns False if the case is unknown."""
+        entry = self._cases.pop(case_id, None)
+        if entry is None:
+            return False
+
+        template = entry["template"]
+        owners = template["case_ids"]
+        was_primary = owners[0] == case_id
+        owners.remove(case_id)
+
+        if not owners and not template["pinned"]:
+            if template.get("shadowed_by") is not None:
+                self._unshadow(template)
+            elif template["seq"] in self._quarantined:
+                self._quarantined.pop(template["seq"])
+            else:
+                index = self._indexes.get(template["repository_id"])
+                if index is not None:
+                    index.remove(template)
+                self._templates.pop(template["seq"], None)
+                self._revive_shadows(template)
+                if index is not None and not len(index):
+                    del self._indexes[template["repository_id"]]
+        elif was_primary and owners:
+            # Same pattern, but the answer now comes from the next owning case
+            successor = self._cases[owners[0]]
+            rebuilt = self.generalize_instruction(successor["query"], successor["json_response"], template["repository_id"])
+            template["json_template"] = rebuilt["json_template"]
+            template["param_map"] = rebuilt["param_map"]
+            template["slots"] = rebuilt["slots"]
+            template["slot_specs"] = rebuilt["slot_specs"]
+            template["fill"] = None
+            template["original_query"] = rebuilt["original_query"]
+        return True
+
+    def _unshadow(self, template: Dict[str, Any]) -> bool:
+        if self._shadowed.pop(template["seq"], None) is None:
+            return False
+        key = (template["repository_id"], template["pattern"])
+        if self._shadowed_patterns.get(key) is template:
+            del self._shadowed_patterns[key]
+        return True
+
+    def _revive_shadows(self, template: Dict[str, Any]):
+        """Re-indexes templates pruned in favour of a template that is going away (with their old priority)."""
+        for seq in template.get("shadows", ()):
+            shadowed = self._shadowed.get(seq)
+            if shadowed is None:
+                continue
+            self._unshadow(shadowed)
+            shadowed["shadowed_by"] = None
+            index = self._indexes.get(shadowed["repository_id"])
+            if index is None:
+                index = _TemplateIndex()
+                self._indexes[shadowed["repository_id"]] = index
+            live = index.by_pattern.get(shadowed["pattern"])
+            if live is not None:
+                # The pattern is indexed again meanwhile: one template keeps it, the earlier one
+                if live["seq"] < shadowed["seq"]:
+                    self._merge_template(shadowed, live)
+                    continue
+                index.remove(live)
+                self._templates.pop(live["seq"], None)
+                self._merge_template(live, shadowed)
+            self._templates[seq] = shadowed
+            index.add(shadowed)
+
+    def _merge_template(self, source: Dict[str, Any], target: Dict[str, Any]):
+        """Moves the cases (and shadows) of a template with the same pattern onto target."""
+        self._merged += 1
+        for case_id in source["case_ids"]:
+            target["case_ids"].append(case_id)
+            self._cases[case_id]["template"] = target
+        target["pinned"] = target["pinned"] or source["pinned"]
+        for seq in source.get("shadows", ()):
+            shadow = self._shadowed.get(seq)
+            if shadow is not None:
+                shadow["shadowed_by"] = target["seq"]
+                target.setdefault("shadows", []).append(seq)
+
+    def prune(self, repository_ids: Optional[set] = None) -> Dict[str, Any]:
+        """
+        Drops templates that can never be the first match: every query they accept is already
+        accepted by a higher-priority template of the same repository. Exact duplicates are merged
+        on add; this pass handles subsumed ones (e.g. a literal under a slot template of a newer
+        system version). Match results are unchanged; pruned templates keep their cases and come
+        back if the covering template is removed.
+        """
+        before = len(self._templates)
+        subsumed: Dict[str, int] = {}
+        for repository_id, index in list(self._indexes.items()):
+            if repository_ids is not None and repository_id not in repository_ids:
+                continue
+            for template in sorted(index.by_pattern.values(), key=lambda t: t["seq"]):
+                cover = self._find_cover(index, template)
+                if cover is None:
+                    continue
+                index.remove(template)
+                self._templates.pop(template["seq"], None)
+                template["shadowed_by"] = cover["seq"]
+                self._shadowed[template["seq"]] = template
+                self._shadowed_patterns[(repository_id, template["pattern"])] = template
+                cover.setdefault("shadows", []).append(template["seq"])
+                key = str(repository_id) if repository_id is not None else "global"
+                subsumed[key] = subsumed.get(key, 0) + 1
+
+        self.prune_report = {
+            "duplicates_merged": self._merged,
+            "subsumed": sum(subsumed.values()),
+            "templates_before": before,
+            "templates_after": len(self._templates),
+            "shadowed_total": len(self._shadowed),
+            "subsumed_by_repository": subsumed
+        }
+        return self.prune_report
+
+    def _find_cover(self, index: _TemplateIndex, template: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        probe = _representative(template)
+        for other in index.candidates(probe):
+            if other["seq"] >= template["seq"] or other is template:
+                continue
+            if _compiled_regex(other).match(probe) and _covers(other, template):
+                return other
+        return None
+
+    def has_case(self, case_id: uuid.UUID) -> bool:
+        return case_id in self._cases
+
+    def get_case_repository(self, case_id: uuid.UUID) -> Optional[uuid.UUID]:
+        return self._cases[case_id]["template"]["repository_id"]
+
+    def case_ids(self) -> List[uuid.UUID]:
+        return list(self._cases)
+
+    def iter_cases(self):
+        """Yields (case_id, repository_id, query, json_response) for every tracked case."""
+        for case_id, entry in self._cases.items():
+            yield case_id, entry["template"]["repository_id"], entry["query"], entry["json_response"]
+
+    def export_state(self) -> Dict[str, Any]:
+        """
+        JSON-serializable copy of the generalized templates: ids as strings, converters by kind
+        (compiled regexes and fill plans are rebuilt on load).
+        """
+        templates = []
+        # Quarantined templates get another chance in the next process
+        for template in [*self._templates.values(), *self._shadowed.values(), *self._quarantined.values()]:
+            entry = {k: v for k, v in template.items() if k not in ("regex", "fill", "slow_strikes")}
+            entry["repository_id"] = _id_to_str(template["repository_id"])
+            entry["case_ids"] = [str(case_id) for case_id in template["case_ids"]]
+            entry["slots"] = {path: _export_slot(slot) for path, slot in template["slots"].items()}
+            entry["slot_specs"] = [
+                [kind, max_len, sorted(values) if values is not None else None]
+                for kind, max_len, values in template["slot_specs"]
+            ]
+            if "shadows" in entry:
+                entry["shadows"] = list(entry["shadows"])
+            templates.append(entry)
+        cases = {
+            str(case_id): [entry["template"]["seq"], entry["query"], entry["json_response"]]
+            for case_id, entry in self._cases.items()
+        }
+        slot_enums = [[_id_to_str(repository_id), name, values] for (repository_id, name), values in self.slot_enums.items()]
+        return {"seq": self._seq, "templates": templates, "cases": cases, "slot_enums": slot_enums}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "InstructionMatcher":
+        matcher = cls()
+        for template in state["templates"]:
+            template["regex"] = None
+            template["fill"] = None
+            template["repository_id"] = _str_to_id(template["repository_id"])
+            template["case_ids"] = [uuid.UUID(case_id) for case_id in template["case_ids"]]
+            template["slots"] = {path: _import_slot(slot) for path, slot in template["slots"].items()}
+            template["slot_specs"] = [
+                (kind, max_len, frozenset(values) if values is not None else None)
+                for kind, max_len, values in template["slot_specs"]
+            ]
+            if template.get("shadowed_by") is not None:
+                matcher._shadowed[template["seq"]] = template
+                matcher._shadowed_patterns[(template["repository_id"], template["pattern"])] = template
+                continue
+            matcher._templates[template["seq"]] = template
+            index = matcher._indexes.get(template["repository_id"])
+            if index is None:
+                index = _TemplateIndex()
+                matcher._indexes[template["repository_id"]] = index
+            index.add(template)
+        for case_id, (seq, query, json_response) in state["cases"].items():
+            template = matcher._templates.get(seq) or matcher._shadowed[seq]
+            matcher._cases[uuid.UUID(case_id)] = {"template": template, "query": query, "json_response": json_response}
+        matcher._seq = state["seq"]
+        # The enums the templates were built with, to find the ones the catalogue changed since
+        matcher.slot_enums = {(_str_to_id(repository_id), name): values for repository_id, name, values in state["slot_enums"]}
+        return matcher
 
     def has_template(self, query: str, repository_id: Optional[uuid.UUID] = None) -> bool:
         """Checks if a template for the query already exists."""
         # This is a bit ambiguous. If we want to check if the query *matches* an existing template:
         return self.match(query, repository_id) is not None
 
+    def _candidates(self, user_query: str, repository_id: Optional[uuid.UUID]) -> List[Dict[str, Any]]:
+        """
+        Collects templates that can possibly match, in priority order.
+        Repository templates are isolated; global templates (repository_id None) apply to every repository.
+        """
+        # `$` also matches before a single trailing newline
+        probe = user_query.lower()
+        if probe.endswith("\n"):
+            probe = probe[:-1]
+
+        candidates = []
+        index = self._indexes.get(repository_id)
+        if index is not None:
+            candidates.extend(index.candidates(probe))
+        if repository_id is not None:
+            global_index = self._indexes.get(None)
+            if global_index is not None:
+                candidates.extend(global_index.candidates(probe))
+
+        if len(candidates) > 1:
+            candidates.sort(key=lambda t: t["seq"])
+        return candidates
+
     def match(self, user_query: str, repository_id: Optional[uuid.UUID] = None) -> Optional[Dict[str, Any]]:
         """
         Matches a user query against templates and injects parameters.
         If repository_id is provided, filters templates by that ID.
         """
-        for template in self.templates:
-            # Filter by repository_id
-            tpl_repo_id = template.get("repository_id")
-            
-            # Strict isolation:
-            # If template has a repo ID, it MUST match the requested repository_id.
-            if tpl_repo_id is not None and tpl_repo_id != repository_id:
-                continue
-            
-            # If template is Global (None), it matches everyone? 
-            # Or should we enforce strict repo match if repo_id is provided?
-            # Let's assume Global templates apply to all.
-            
-            match = re.match(template["pattern"], user_query, re.IGNORECASE)
+        query = normalize_query(user_query)
+        for template in self._candidates(query, repository_id):
+            regex = template["regex"]
+            if regex is None:
+                regex = template["regex"] = re.compile(template["pattern"], re.IGNORECASE)
+            started = time.perf_counter()
+            match = regex.match(query)
+            if time.perf_counter() - started > self.slow_match_seconds:
+                self._note_slow(template, query)
             if match:
-                groups = match.groupdict()
-                result = copy.deepcopy(template["json_template"])
-                param_map = template.get("param_map", {})
-                
-                # Fill values
-                for param_name, val_str in groups.items():
-                    path = param_map.get(param_name)
-                    if path:
-                        # Simple type inference
-                        final_val = val_str
-                        if re.match(r'^\d+$', val_str):
-                            final_val = int(val_str)
-                        elif re.match(r'^\d+\.\d+$', val_str):
-                            final_val = float(val_str)
-                        
-                        self._set_value_by_path(result, path, final_val)
-                
+                fill = template["fill"]
+                if fill is None:
+                    fill = template["fill"] = _compile_fill_plan(template["json_template"], template["slots"])
+                groups = match.groups()
+                raw = groups if query == user_query or not groups else _raw_groups(user_query, match)
                 return {
                     "source": "instruction_matcher",
                     "template_pattern": template["pattern"],
-                    "result": result,
-                    "repository_id": tpl_repo_id,
+                    "result": fill(groups, raw),
+                    "repository_id": template["repository_id"],
                     "original_query": template.get("original_query")
                 }
         return None
 
+    def _note_slow(self, template: Dict[str, Any], query: str):
+        """
+        Re can't be interrupted, so a template that keeps running slow is taken out of matching
+        (until the next rebuild). Several strikes are needed: a single slow run may be a GIL switch.
+        """
+        strikes = template.get("slow_strikes", 0) + 1
+        template["slow_strikes"] = strikes
+        if strikes < self.SLOW_MATCH_STRIKES or template["seq"] not in self._templates:
+            return
+        logger.warning(
+            f"Quarantining slow instruction template {template['pattern']!r} "
+            f"(cost {template.get('cost')}, last query length {len(query)})."
+        )
+        index = self._indexes.get(template["repository_id"])
+        if index is not None:
+            index.remove(template)
+        self._templates.pop(template["seq"], None)
+        self._quarantined[template["seq"]] = template
+        # Its shadows are no longer covered
+        self._revive_shadows(template)
+        template.pop("shadows", None)
+
     def clear(self):
-        self.templates = []
+        self._templates = {}
+        self._shadowed = {}
+        self._shadowed_patterns = {}
+        self._merged = 0
+        self.prune_report = None
+        self._indexes = {}
+        self._cases = {}
+        self._quarantined = {}
+        self._seq = 0
 
     def print_templates(self):
         """Prints all current templates to log for debugging."""
-        logger.info(f"=== Current Regex Templates ({len(self.templates)}) ===")
+        logger.info(f"=== Current Regex Templates ({len(self._templates)}) ===")
         for i, t in enumerate(self.templates):
             logger.info(f"[{i}] Pattern: {t['pattern']} | Repo: {t.get('repository_id')} | Sample: {t.get('original_query')}")
         logger.info("=============================================")
 
 class InstructionMatcherService:
     _instance = None
+    REBUILD_YIELD_EVERY = 500
+    MATCH_MANY_YIELD_EVERY = 500
+    REBUILD_BATCH_SIZE = 1000
+    SNAPSHOT_FORMAT = 5
+    # updated_at is written by the app servers' clocks; replay a little before the mark to absorb skew
+    SNAPSHOT_REPLAY_MARGIN = timedelta(minutes=5)
     
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(InstructionMatcherService, cls).__new__(cls)
             cls._instance.matcher = InstructionMatcher()
             cls._instance.default_pairs_path = os.path.join("app", "config", "default_system_pairs.json")
+            cls._instance.session_factory = AsyncSessionLocal
+            cls._instance.snapshot_path = settings.INSTRUCTION_MATCHER_SNAPSHOT_PATH
+            cls._instance._reload_task = None
+            cls._instance._reload_pending = False
+            cls._instance.last_prune_report = None
         return cls._instance
 
     def match(self, query: str, repository_id: Optional[uuid.UUID] = None) -> Optional[Dict[str, Any]]:
@@ -219,44 +908,439 @@ class InstructionMatcherService:
         """
         return self.matcher.match(query, repository_id)
 
-    async def reload(self, db: AsyncSession):
-        """Reloads templates from Database ONLY (after ensuring defaults are seeded)."""
-        # Ensure defaults are seeded first
-        await self._ensure_defaults_seeded(db)
+    async def match_many(self, queries: List[str], repository_id: Optional[uuid.UUID] = None) -> List[Dict[str, Any]]:
+        """
+        Resolves many utterances in one call: the matcher first, then the Redis instruction cache
+        for the misses (pipelined MGET). Read-only, so replays and pre-validation leave hit counts alone.
+        Returns {"query", "hit_source" ("memory" / "redis" / None), "result", "template_pattern"} per query, in order.
+        """
+        matcher = self.matcher  # One template set for the whole batch even if a reload swaps meanwhile
+        resolved: Dict[str, Dict[str, Any]] = {}
+        misses = []
+        for i, query in enumerate(dict.fromkeys(queries)):
+            matched = matcher.match(query, repository_id)
+            if matched:
+                resolved[query] = {
+                    "query": query,
+                    "hit_source": "memory",
+                    "result": matched["result"],
+                    "template_pattern": matched["template_pattern"]
+                }
+            else:
+                misses.append(query)
+            # Matching is CPU bound; let live requests run in between
+            if (i + 1) % self.MATCH_MANY_YIELD_EVERY == 0:
+                await asyncio.sleep(0)
+
+        if misses:
+            # The cache lookups need no DB session
+            cached = await FeedbackService(None).get_cached_instruction_responses(misses, repository_id)
+            for query, response in zip(misses, cached):
+                entry = {"query": query, "hit_source": None, "result": None, "template_pattern": None}
+                if response is not None:
+                    entry["hit_source"] = "redis"
+                    try:
+                        entry["result"] = json.loads(response)
+                    except (TypeError, ValueError):
+                        entry["result"] = response
+                resolved[query] = entry
 
-        self.matcher.clear()
-        
-        # Load from DB
+        return [resolved[query] for query in queries]
+
+    async def reload(self, broadcast: bool = False, warm: bool = False):
+        """
+        Rebuilds the matcher from the Database (after ensuring defaults are seeded).
+        Only meant for startup and repair; admin edits apply deltas (add_case/replace_case/remove_case).
+        With warm=True (startup) the on-disk snapshot is loaded and only newer cases are replayed.
+
+        The new matcher is built off to the side and swapped in with a single assignment,
+        so concurrent requests keep matching against the previous templates meanwhile.
+        Reload requests arriving while a rebuild is running collapse into one follow-up rebuild.
+        """
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = asyncio.create_task(self._reload_loop(self._warm_start if warm else self._rebuild))
+        else:
+            self._reload_pending = True
+        # Shield so a cancelled caller does not abort the shared rebuild
+        await asyncio.shield(self._reload_task)
+        if broadcast:
+            await invalidation_bus.publish("matcher", None, {"op": "reload"})
+
+    async def _reload_loop(self, build):
+        while True:
+            self._reload_pending = False
+            await build()
+            if not self._reload_pending:
+                break
+            build = self._rebuild
+
+    @staticmethod
+    def _live_cases_filter():
+        """Manual cases plus system cases of each repository's active version."""
+        return (BenchmarkCase.source == 'manual') | (
+            (BenchmarkCase.source == 'system') &
+            (BenchmarkCase.version == InstructionRepository.active_system_version)
+        )
+
+    def _load_row(self, matcher: InstructionMatcher, case: BenchmarkCase) -> bool:
         try:
-            # Join with Repo to get active version
-            stmt = select(BenchmarkCase, InstructionRepository.active_system_version)\
-                .outerjoin(InstructionRepository, BenchmarkCase.repository_id == InstructionRepository.id)\
-                .where(
-                    (BenchmarkCase.source == 'manual') | 
-                    (
-                        (BenchmarkCase.source == 'system') & 
-                        (BenchmarkCase.version == InstructionRepository.active_system_version)
-                    )
-                )
-            
-            result = await db.execute(stmt)
-            rows = result.all()
-            
-            count = 0
-            for case, active_version in rows:
-                try:
-                    json_response = json.loads(case.answer)
-                    self.matcher.add_instruction(case.question, json_response, repository_id=case.repository_id)
-                    count += 1
-                except Exception as e:
-                    logger.warning(f"Failed to load instruction case {case.id}: {e}")
-            
+            json_response = json.loads(case.answer)
+            matcher.add_instruction(case.question, json_response, repository_id=case.repository_id, case_id=case.id)
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to load instruction case {case.id}: {e}")
+            return False
+
+    @staticmethod
+    async def _load_slot_enums(db: AsyncSession):
+        """Enum parameters of the active instruction catalogue, for typed enum slots."""
+        stmt = select(Instruction.repository_id, Instruction.name, Instruction.parameters, Instruction.is_active)
+        result = await db.execute(stmt)
+        return build_slot_enums(
+            (repository_id, name, parameters)
+            for repository_id, name, parameters, is_active in result.all() if is_active
+        )
+
+    async def _rebuild(self):
+        matcher = InstructionMatcher()
+        high_water = None
+        try:
+            # Own session: the rebuild is shared by several callers and may outlive any of them
+            async with self.session_factory() as db:
+                # Ensure defaults are seeded first
+                await self._ensure_defaults_seeded(db)
+                matcher.slot_enums = await self._load_slot_enums(db)
+
+                # Join with Repo to get active version; stream rows instead of materializing the library
+                stmt = select(BenchmarkCase)\
+                    .outerjoin(InstructionRepository, BenchmarkCase.repository_id == InstructionRepository.id)\
+                    .where(self._live_cases_filter())\
+                    .execution_options(yield_per=self.REBUILD_BATCH_SIZE)
+
+                result = await db.stream(stmt)
+                count = 0
+                i = 0
+                async for case in result.scalars():
+                    if self._load_row(matcher, case):
+                        count += 1
+                    if case.updated_at is not None and (high_water is None or case.updated_at > high_water):
+                        high_water = case.updated_at
+                    i += 1
+                    # Compiling patterns is CPU bound; let live requests run in between
+                    if i % self.REBUILD_YIELD_EVERY == 0:
+                        await asyncio.sleep(0)
+
+            # Drop duplicate/subsumed templates; the new matcher is not shared yet, so a thread is safe
+            report = await asyncio.to_thread(matcher.prune)
+            self.last_prune_report = report
+            logger.info(
+                f"Matcher pruning: {report['templates_before']} -> {report['templates_after']} templates "
+                f"({report['subsumed']} subsumed, {report['duplicates_merged']} duplicates merged)."
+            )
+
+            # Atomic swap
+            self.matcher = matcher
+            semantic_index.sync_cases(matcher.iter_cases())
             logger.info(f"Reloaded {count} instruction templates into memory.")
             self.matcher.print_templates()
-            
+            await self._save_snapshot(matcher, high_water)
+
         except Exception as e:
             logger.error(f"Failed to reload instruction matcher: {e}")
 
+    async def _warm_start(self):
+        """Loads the snapshot and replays cases that are new, changed or gone since it was written."""
+        snapshot = await self._read_snapshot()
+        if snapshot is None:
+            await self._rebuild()
+            return
+
+        try:
+            matcher = InstructionMatcher.from_state(snapshot["state"])
+            high_water = snapshot["high_water"]
+            replay_from = high_water - self.SNAPSHOT_REPLAY_MARGIN if high_water is not None else None
+
+            async with self.session_factory() as db:
+                await self._ensure_defaults_seeded(db)
+                # Cases of instructions whose enums changed since the snapshot are regenerated
+                current_enums = await self._load_slot_enums(db)
+                touched = set()
+                for repository_id in {key[0] for key in current_enums} | {key[0] for key in matcher.slot_enums}:
+                    if matcher.update_slot_enums(repository_id, current_enums):
+                        touched.add(repository_id)
+                if None in touched:
+                    touched.update(matcher._indexes)
+
+                # Ids and timestamps of the live set are cheap; full rows only for what changed
+                stmt = select(BenchmarkCase.id, BenchmarkCase.updated_at)\
+                    .outerjoin(InstructionRepository, BenchmarkCase.repository_id == InstructionRepository.id)\
+                    .where(self._live_cases_filter())\
+                    .execution_options(yield_per=self.REBUILD_BATCH_SIZE)
+                live = set()
+                changed = []
+                result = await db.stream(stmt)
+                async for case_id, updated_at in result:
+                    live.add(case_id)
+                    if updated_at is not None and (high_water is None or updated_at > high_water):
+                        high_water = updated_at
+                    if not matcher.has_case(case_id) or updated_at is None or replay_from is None or updated_at >= replay_from:
+                        changed.append(case_id)
+
+                removed = [case_id for case_id in matcher.case_ids() if case_id not in live]
+                for case_id in removed:
+                    matcher.remove_case(case_id)
+
+                for start in range(0, len(changed), self.REBUILD_BATCH_SIZE):
+                    batch = changed[start:start + self.REBUILD_BATCH_SIZE]
+                    result = await db.execute(select(BenchmarkCase).where(BenchmarkCase.id.in_(batch)))
+                    for case in result.scalars().all():
+                        self._load_row(matcher, case)
+                        touched.add(case.repository_id)
+                    await asyncio.sleep(0)
+
+            # The snapshot was pruned when written; only re-check repositories that got new cases
+            if touched:
+                self.last_prune_report = await asyncio.to_thread(matcher.prune, touched)
+
+            self.matcher = matcher
+            semantic_index.sync_cases(matcher.iter_cases())
+            logger.info(
+                f"Loaded instruction matcher snapshot: {len(matcher.templates)} templates, "
+                f"replayed {len(changed)} cases, dropped {len(removed)}."
+            )
+            if changed or removed:
+                await self._save_snapshot(matcher, high_water)
+        except Exception as e:
+            logger.warning(f"Matcher snapshot unusable ({e}), rebuilding from the database.")
+            await self._rebuild()
+
+    @staticmethod
+    def _snapshot_signature(body: bytes) -> str:
+        return hmac.new(settings.SECRET_KEY.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+    async def _read_snapshot(self) -> Optional[Dict[str, Any]]:
+        """
+        The snapshot if it is ours: the file is "<HMAC-SHA256 hex>\n<JSON>" signed with SECRET_KEY,
+        so a file written by anyone else (or an older format) is ignored and the matcher rebuilt.
+        """
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return None
+
+        def _read():
+            with open(self.snapshot_path, "rb") as f:
+                return f.read()
+
+        try:
+            signature, _, body = (await asyncio.to_thread(_read)).partition(b"\n")
+        except Exception as e:
+            logger.warning(f"Failed to read matcher snapshot {self.snapshot_path}: {e}")
+            return None
+        if not hmac.compare_digest(signature, self._snapshot_signature(body).encode("ascii")):
+            logger.warning(f"Matcher snapshot {self.snapshot_path} is unsigned or its signature does not match, ignoring it.")
+            return None
+        try:
+            snapshot = json.loads(body)
+        except ValueError as e:
+            logger.warning(f"Matcher snapshot {self.snapshot_path} is not valid JSON ({e}), ignoring it.")
+            return None
+        if not isinstance(snapshot, dict) or snapshot.get("format") != self.SNAPSHOT_FORMAT \
+                or not isinstance(snapshot.get("state"), dict):
+            logger.info("Matcher snapshot format changed, ignoring it.")
+            return None
+        try:
+            high_water = snapshot.get("high_water")
+            snapshot["high_water"] = datetime.fromisoformat(high_water) if high_water else None
+        except (TypeError, ValueError):
+            logger.info("Matcher snapshot has no usable high-water mark, ignoring it.")
+            return None
+        return snapshot
+
+    async def _save_snapshot(self, matcher: InstructionMatcher, high_water: Optional[datetime]):
+        if not self.snapshot_path:
+            return
+        # Export on the loop (deltas may mutate the matcher), serialize and write in a thread
+        snapshot = {
+            "format": self.SNAPSHOT_FORMAT,
+            "high_water": high_water.isoformat() if high_water is not None else None,
+            "created_at": datetime.utcnow().isoformat(),
+            "state": matcher.export_state()
+        }
+
+        def _write():
+            body = json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            directory = os.path.dirname(self.snapshot_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(self._snapshot_signature(body).encode("ascii") + b"\n" + body)
+            # Atomic on POSIX, so concurrent workers never see a torn file
+            os.replace(tmp_path, self.snapshot_path)
+
+        try:
+            await asyncio.to_thread(_write)
+        except Exception as e:
+            logger.warning(f"Failed to write matcher snapshot {self.snapshot_path}: {e}")
+
+    def _note_delta(self):
+        """A rebuild already past its DB query would swap a delta out again, so schedule a follow-up."""
+        if self._reload_task is not None and not self._reload_task.done():
+            self._reload_pending = True
+
+    @staticmethod
+    def is_live(case: BenchmarkCase, active_version: Optional[int] = None) -> bool:
+        """Manual cases are always matched; system cases only for the repository's active version."""
+        if case.source == 'manual':
+            return True
+        return case.source == 'system' and active_version is not None and case.version == active_version
+
+    def _add_local(self, case: BenchmarkCase):
+        try:
+            json_response = json.loads(case.answer)
+            self.matcher.add_instruction(case.question, json_response, repository_id=case.repository_id, case_id=case.id)
+            semantic_index.upsert(semantic_index.case_key(case.id), case.repository_id, case.question, case.answer)
+        except Exception as e:
+            logger.warning(f"Failed to add instruction case {case.id} to matcher: {e}")
+            self.matcher.remove_case(case.id)
+            semantic_index.remove(semantic_index.case_key(case.id))
+        self._note_delta()
+
+    def _remove_local(self, case_ids: List[uuid.UUID]) -> Dict[Optional[uuid.UUID], List[uuid.UUID]]:
+        """Removes cases from this worker's matcher and returns the removed ids grouped by repository."""
+        removed: Dict[Optional[uuid.UUID], List[uuid.UUID]] = {}
+        for case_id in case_ids:
+            if not self.matcher.has_case(case_id):
+                continue
+            repository_id = self.matcher.get_case_repository(case_id)
+            self.matcher.remove_case(case_id)
+            semantic_index.remove(semantic_index.case_key(case_id))
+            removed.setdefault(repository_id, []).append(case_id)
+        if removed:
+            logger.info(f"Removed {sum(len(ids) for ids in removed.values())} instruction templates from memory.")
+        self._note_delta()
+        return removed
+
+    async def add_case(self, case: BenchmarkCase):
+        """Adds (or replaces) the template of a single BenchmarkCase on every worker."""
+        self._add_local(case)
+        await invalidation_bus.publish("matcher", case.repository_id, {"op": "cases", "case_ids": [str(case.id)]})
+
+    async def replace_case(self, case: BenchmarkCase, active_version: Optional[int] = None):
+        """Re-applies an edited case: replaced if it is still live, removed otherwise."""
+        if self.is_live(case, active_version):
+            await self.add_case(case)
+        else:
+            await self.remove_case(case.id)
+
+    async def remove_case(self, case_id: uuid.UUID):
+        await self.remove_cases([case_id])
+
+    async def remove_cases(self, case_ids: List[uuid.UUID]):
+        removed = self._remove_local(case_ids)
+        for repository_id, ids in removed.items():
+            await invalidation_bus.publish("matcher", repository_id, {"op": "cases", "case_ids": [str(i) for i in ids]})
+
+    async def switch_version(self, db: AsyncSession, repository_id: uuid.UUID, old_version: Optional[int], new_version: Optional[int],
+                             broadcast: bool = True):
+        """
+        Swaps the system cases of one repository from old_version to new_version.
+        Only the two versions involved are read from the DB.
+        """
+        if old_version == new_version:
+            return
+
+        if old_version is not None:
+            stmt = select(BenchmarkCase.id).where(
+                BenchmarkCase.repository_id == repository_id,
+                BenchmarkCase.source == 'system',
+                BenchmarkCase.version == old_version
+            )
+            result = await db.execute(stmt)
+            self._remove_local(result.scalars().all())
+
+        if new_version:
+            stmt = select(BenchmarkCase).where(
+                BenchmarkCase.repository_id == repository_id,
+                BenchmarkCase.source == 'system',
+                BenchmarkCase.version == new_version
+            )
+            result = await db.execute(stmt)
+            cases = result.scalars().all()
+            for case in cases:
+                self._add_local(case)
+            logger.info(f"Switched repository {repository_id} matcher to system version {new_version} ({len(cases)} cases).")
+
+        if broadcast:
+            await invalidation_bus.publish("matcher", repository_id, {
+                "op": "switch_version",
+                "repository_id": str(repository_id),
+                "old_version": old_version,
+                "new_version": new_version
+            })
+
+    async def refresh_slot_enums(self, db: AsyncSession, repository_id: Optional[uuid.UUID], broadcast: bool = True):
+        """
+        Reloads one repository's enum parameters after its instructions were created, imported or
+        deleted, regenerating the templates they affect (see InstructionMatcher.update_slot_enums).
+        """
+        stmt = select(Instruction.name, Instruction.parameters).where(
+            Instruction.repository_id == repository_id,
+            Instruction.is_active.is_(True)
+        )
+        result = await db.execute(stmt)
+        enums = build_slot_enums((repository_id, name, parameters) for name, parameters in result.all())
+        regenerated = self.matcher.update_slot_enums(repository_id, enums)
+        if regenerated:
+            logger.info(f"Slot enums of repository {repository_id} changed, regenerated {regenerated} cases.")
+        # A rebuild in flight may have read the catalogue before the change
+        self._note_delta()
+        if broadcast:
+            await invalidation_bus.publish("matcher", repository_id, {
+                "op": "slot_enums",
+                "repository_id": str(repository_id) if repository_id else None
+            })
+
+    async def apply_remote(self, payload: Dict[str, Any]):
+        """Applies a matcher event published by another worker."""
+        op = payload.get("op")
+        if op == "slot_enums":
+            repository_id = payload.get("repository_id")
+            async with self.session_factory() as db:
+                await self.refresh_slot_enums(db, uuid.UUID(repository_id) if repository_id else None, broadcast=False)
+        elif op == "cases":
+            await self._sync_cases([uuid.UUID(i) for i in payload.get("case_ids", [])])
+        elif op == "switch_version":
+            async with self.session_factory() as db:
+                await self.switch_version(
+                    db,
+                    uuid.UUID(payload["repository_id"]),
+                    payload.get("old_version"),
+                    payload.get("new_version"),
+                    broadcast=False
+                )
+        elif op == "reload":
+            await self.reload()
+
+    async def _sync_cases(self, case_ids: List[uuid.UUID]):
+        """Re-reads the given cases from the DB: live ones are (re)added, missing or inactive ones removed."""
+        if not case_ids:
+            return
+        async with self.session_factory() as db:
+            stmt = select(BenchmarkCase, InstructionRepository.active_system_version)\
+                .outerjoin(InstructionRepository, BenchmarkCase.repository_id == InstructionRepository.id)\
+                .where(BenchmarkCase.id.in_(case_ids))
+            result = await db.execute(stmt)
+            rows = result.all()
+
+        found = set()
+        for case, active_version in rows:
+            found.add(case.id)
+            if self.is_live(case, active_version):
+                self._add_local(case)
+            else:
+                self._remove_local([case.id])
+        self._remove_local([i for i in case_ids if i not in found])
+
     async def generalize_and_save(self, query: str, json_response: Dict[str, Any], db: AsyncSession, repository_id: Optional[uuid.UUID] = None):
         """
         Generalizes an instruction pair and saves it as a manual benchmark case.
@@ -285,7 +1369,10 @@ class InstructionMatcherService:
 
         # 2. Add to in-memory matcher
         try:
-            self.matcher.add_instruction(query, json_response, repository_id=repository_id)
+            self.matcher.add_instruction(query, json_response, repository_id=repository_id, case_id=case.id)
+            semantic_index.upsert(semantic_index.case_key(case.id), repository_id, query, case.answer)
+            self._note_delta()
+            await invalidation_bus.publish("matcher", repository_id, {"op": "cases", "case_ids": [str(case.id)]})
             logger.info(f"Added generalized instruction to memory: {query}")
         except Exception as e:
             logger.error(f"Failed to add instruction to matcher: {e}")
@@ -327,3 +1414,4 @@ class InstructionMatcherService:
             logger.error(f"Failed to seed default pairs: {e}")
 
 matcher_service = InstructionMatcherService()
+invalidation_bus.register("matcher", matcher_service.apply_remote, resync=matcher_service.reload)
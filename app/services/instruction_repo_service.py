@@ -2,6 +2,8 @@ from typing import List, Dict, Any, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, delete, update
 from app.models.instruction import InstructionRepository, Instruction
+from app.services.instruction_catalog import instruction_catalog
+from app.services.instruction_service import refresh_matcher_slot_enums
 import uuid
 from datetime import datetime
 
@@ -64,4 +66,6 @@ class InstructionRepositoryService:
         await self.db.execute(delete(Instruction).where(Instruction.repository_id == repo_id))
         await self.db.delete(repo)
         await self.db.commit()
+        await instruction_catalog.invalidate(repo_id)
+        await refresh_matcher_slot_enums(self.db, repo_id)
         return True
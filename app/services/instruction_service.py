@@ -93,11 +93,24 @@ class InstructionService:
                 
         return valid_actions
 
-    async def create_instruction(self, data: Dict[str, Any], user_id: uuid.UUID) -> Instruction:
+    async def create_instruction(self, data: Dict[str, Any], user_id: uuid.UUID, invalidate_catalog: bool = True) -> Instruction:
         # Ensure repository_id is provided or handle it
         # For now, data should contain repository_id
         instruction = Instruction(**data, user_id=user_id)
         self.db.add(instruction)
         await self.db.commit()
         await self.db.refresh(instruction)
+        if invalidate_catalog:
+            from app.services.instruction_catalog import instruction_catalog
+            await instruction_catalog.invalidate(instruction.repository_id)
+            await refresh_matcher_slot_enums(self.db, instruction.repository_id)
         return instruction
+
+
+async def refresh_matcher_slot_enums(db: AsyncSession, repository_id: Optional[uuid.UUID]):
+    """Keeps the matcher's enum slots in line with the repository's instructions; never fails the request."""
+    try:
+        from app.services.instruction_matcher import matcher_service
+        await matcher_service.refresh_slot_enums(db, repository_id)
+    except Exception as e:
+        print(f"Failed to update matcher slot enums for repository {repository_id}: {e}")
@@ -0,0 +1,80 @@
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.redis import RedisClient
+from app.services.query_normalizer import normalize_query
+
+logger = logging.getLogger(__name__)
+
+
+class IntentCache:
+    """
+    Router LLM decisions keyed by normalized query, language, RAG flag, router model and prompt version.
+    An in-process LRU in front of Redis, both with the same TTL. The routing prompt only sees the
+    query, so the decision does not depend on the conversation.
+    """
+
+    KEY_PREFIX = "intent_route"
+
+    def __init__(self):
+        self._local: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    def key(self, query: str, language: Optional[str], rag_enabled: bool, provider: str, model: str,
+            prompt_digest: Optional[str] = None) -> str:
+        normalized = normalize_query(query).strip().lower()
+        raw = "\x1f".join([normalized, language or "", "rag" if rag_enabled else "norag",
+                           f"{provider}/{model}", prompt_digest or ""])
+        return f"{self.KEY_PREFIX}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+    async def get(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Returns (entry, tier) with tier "memory" or "redis", or (None, None) on a miss."""
+        if not settings.INTENT_CACHE_ENABLE:
+            return None, None
+        cached = self._local.get(key)
+        if cached is not None:
+            expires_at, entry = cached
+            if expires_at > time.monotonic():
+                self._local.move_to_end(key)
+                return entry, "memory"
+            del self._local[key]
+
+        try:
+            raw = await RedisClient.get_instance().get(key)
+        except Exception as e:
+            logger.error(f"Intent cache get error: {e}")
+            return None, None
+        if not raw:
+            return None, None
+        try:
+            entry = json.loads(raw)
+        except ValueError:
+            return None, None
+        self._remember(key, entry)
+        return entry, "redis"
+
+    async def set(self, key: str, intent: str, latency_ms: int):
+        if not settings.INTENT_CACHE_ENABLE:
+            return
+        entry = {"intent": intent, "latency_ms": latency_ms}
+        self._remember(key, entry)
+        try:
+            await RedisClient.get_instance().set(key, json.dumps(entry), ex=settings.INTENT_CACHE_TTL_SECONDS)
+        except Exception as e:
+            logger.error(f"Intent cache set error: {e}")
+
+    def _remember(self, key: str, entry: Dict[str, Any]):
+        self._local[key] = (time.monotonic() + settings.INTENT_CACHE_TTL_SECONDS, entry)
+        self._local.move_to_end(key)
+        while len(self._local) > settings.INTENT_CACHE_MAX_ENTRIES:
+            self._local.popitem(last=False)
+
+    def clear(self):
+        self._local.clear()
+
+
+intent_cache = IntentCache()
@@ -0,0 +1,381 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+import zlib
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import desc, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.invalidation import invalidation_bus
+from app.db.session import AsyncSessionLocal
+from app.models.base import BenchmarkCase, Message
+from app.services.query_normalizer import normalize_query
+
+logger = logging.getLogger(__name__)
+
+LABELS = ("instruction", "chat", "search", "rag")
+# Message.metadata_["route"] -> label the router gave (rag_disabled_chat: the router said rag)
+_ROUTE_LABELS = {
+    "instruction": "instruction",
+    "instruction_fastpath": "instruction",
+    "chat": "chat",
+    "search": "search",
+    "rag": "rag",
+    "rag_disabled_chat": "rag",
+}
+# Routes decided by this classifier are not trained on again (no self-reinforcement)
+ROUTER_NAME = "intent_classifier"
+
+
+def _features(text: str, dim: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Hashed char 1-3 grams of the normalized text, L2-normalized counts."""
+    text = normalize_query(text).lower()
+    padded = f"\x02{text}\x03"
+    grams = list(text)
+    grams.extend(padded[i:i + 2] for i in range(len(padded) - 1))
+    grams.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    counts = Counter(zlib.crc32(g.encode("utf-8")) & (dim - 1) for g in grams)
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    values /= np.sqrt((values * values).sum())
+    return indices, values
+
+
+def _softmax(z: np.ndarray) -> np.ndarray:
+    z = z - z.max(axis=-1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+class _Model:
+    """Multinomial logistic regression over hashed char n-grams, plus its calibration."""
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, labels: Sequence[str],
+                 temperature: float, threshold: float, stats: Dict[str, Any]):
+        self.weights = weights
+        self.bias = bias
+        self.labels = list(labels)
+        self.temperature = temperature
+        self.threshold = threshold
+        self.stats = stats
+
+    @property
+    def dim(self) -> int:
+        return self.weights.shape[0]
+
+    def probabilities(self, text: str) -> np.ndarray:
+        indices, values = _features(text, self.dim)
+        scores = (values @ self.weights[indices] + self.bias).astype(np.float64)
+        return _softmax(scores / self.temperature)
+
+
+def _fit(rows: List[Tuple[np.ndarray, np.ndarray]], y: np.ndarray, n_labels: int, dim: int,
+         epochs: int = 80, lr: float = 0.05, l2: float = 1e-4) -> Tuple[np.ndarray, np.ndarray]:
+    """Full-batch Adam on the softmax cross-entropy, vectorized over a CSR layout of the samples."""
+    lengths = np.fromiter((len(i) for i, _ in rows), dtype=np.int64, count=len(rows))
+    indptr = np.concatenate(([0], np.cumsum(lengths)))
+    indices = np.concatenate([i for i, _ in rows])
+    data = np.concatenate([v for _, v in rows])
+    row_of = np.repeat(np.arange(len(rows)), lengths)
+    onehot = np.eye(n_labels, dtype=np.float32)[y]
+
+    weights = np.zeros((dim, n_labels), dtype=np.float32)
+    bias = np.zeros(n_labels, dtype=np.float32)
+    m_w, v_w = np.zeros_like(weights), np.zeros_like(weights)
+    m_b, v_b = np.zeros_like(bias), np.zeros_like(bias)
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+    for step in range(1, epochs + 1):
+        scores = np.add.reduceat(weights[indices] * data[:, None], indptr[:-1], axis=0) + bias
+        grad = (_softmax(scores) - onehot) / len(rows)
+        grad_w = np.stack([
+            np.bincount(indices, weights=data * grad[row_of, c], minlength=dim) for c in range(n_labels)
+        ], axis=1).astype(np.float32) + l2 * weights
+        grad_b = grad.sum(axis=0)
+        for param, g, m, v in ((weights, grad_w, m_w, v_w), (bias, grad_b, m_b, v_b)):
+            m *= beta1
+            m += (1 - beta1) * g
+            v *= beta2
+            v += (1 - beta2) * g * g
+            param -= lr * (m / (1 - beta1 ** step)) / (np.sqrt(v / (1 - beta2 ** step)) + eps)
+    return weights, bias
+
+
+def _calibrate(logits: np.ndarray, y: np.ndarray, target_precision: float) -> Tuple[float, float, Dict[str, Any]]:
+    """
+    Temperature scaling on held-out logits, then the lowest confidence threshold whose accepted
+    predictions reach target_precision. Returns (temperature, threshold, calibration stats).
+    """
+    logits = logits.astype(np.float64)
+    best_t, best_nll = 1.0, float("inf")
+    for t in np.linspace(0.5, 4.0, 36):
+        p = _softmax(logits / t)
+        nll = -np.log(p[np.arange(len(y)), y] + 1e-12).mean()
+        if nll < best_nll:
+            best_t, best_nll = float(t), float(nll)
+
+    probs = _softmax(logits / best_t)
+    confidence = probs.max(axis=1)
+    correct = probs.argmax(axis=1) == y
+
+    bins = []
+    ece = 0.0
+    edges = np.linspace(0.0, 1.0, 11)
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        mask = (confidence > lo) & (confidence <= hi)
+        if not mask.any():
+            continue
+        gap = abs(float(correct[mask].mean()) - float(confidence[mask].mean()))
+        ece += gap * mask.sum() / len(y)
+        bins.append({
+            "range": f"{lo:.1f}-{hi:.1f}",
+            "count": int(mask.sum()),
+            "confidence": round(float(confidence[mask].mean()), 4),
+            "accuracy": round(float(correct[mask].mean()), 4)
+        })
+
+    # Walk thresholds from the most confident prediction down while precision holds
+    threshold = 1.01  # Never confident unless the held-out set supports a threshold
+    order = np.argsort(-confidence)
+    hits = np.cumsum(correct[order])
+    precision = hits / np.arange(1, len(order) + 1)
+    ok = np.nonzero(precision >= target_precision)[0]
+    if len(ok):
+        threshold = float(confidence[order][ok[-1]])
+    accepted = confidence >= threshold
+
+    stats = {
+        "holdout_samples": int(len(y)),
+        "holdout_accuracy": round(float(correct.mean()), 4),
+        "temperature": round(best_t, 3),
+        "holdout_nll": round(best_nll, 4),
+        "ece": round(float(ece), 4),
+        "reliability": bins,
+        "target_precision": target_precision,
+        "threshold": round(threshold, 4),
+        "coverage_at_threshold": round(float(accepted.mean()), 4),
+        "accuracy_at_threshold": round(float(correct[accepted].mean()), 4) if accepted.any() else None
+    }
+    return best_t, threshold, stats
+
+
+def train_model(samples: Iterable[Tuple[str, str]], dim: int, target_precision: float,
+                holdout_fraction: float = 0.2, seed: int = 13) -> _Model:
+    """Trains on (text, label) samples; a held-out split gives the calibration and threshold."""
+    # One label per text: the majority one
+    votes: Dict[str, Counter] = defaultdict(Counter)
+    for text, label in samples:
+        if text and text.strip() and label in LABELS:
+            votes[text][label] += 1
+    texts = list(votes)
+    if len(texts) < settings.INTENT_CLASSIFIER_MIN_SAMPLES:
+        raise ValueError(f"Need at least {settings.INTENT_CLASSIFIER_MIN_SAMPLES} labelled queries, got {len(texts)}")
+
+    labels = [label for label in LABELS if any(v.most_common(1)[0][0] == label for v in votes.values())]
+    label_idx = {label: i for i, label in enumerate(labels)}
+    y = np.array([label_idx[votes[t].most_common(1)[0][0]] for t in texts], dtype=np.int64)
+    rows = [_features(t, dim) for t in texts]
+
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(texts))
+    n_holdout = max(1, int(len(texts) * holdout_fraction))
+    holdout, train = order[:n_holdout], order[n_holdout:]
+
+    weights, bias = _fit([rows[i] for i in train], y[train], len(labels), dim)
+    logits = np.stack([rows[i][1] @ weights[rows[i][0]] + bias for i in holdout])
+    temperature, threshold, stats = _calibrate(logits, y[holdout], target_precision)
+    stats.update({
+        "trained_at": datetime.utcnow().isoformat(),
+        "train_samples": int(len(train)),
+        "label_counts": {label: int((y == i).sum()) for i, label in enumerate(labels)},
+    })
+    return _Model(weights, bias, labels, temperature, threshold, stats)
+
+
+class IntentClassifier:
+    """
+    Local CPU-only intent router: answers confident queries in well under a millisecond and
+    leaves the rest to the router LLM. Trained from BenchmarkCase.intent labels and the routes
+    recorded on past assistant messages; persisted next to the matcher snapshot.
+    """
+
+    def __init__(self):
+        self.path = settings.INTENT_CLASSIFIER_PATH
+        self.session_factory = AsyncSessionLocal
+        self._model: Optional[_Model] = None
+        # trained_at of a newer model another worker published that this worker could not load
+        self._stale_behind: Optional[str] = None
+        self._train_lock = asyncio.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self._confident = 0
+        self._deferred = 0
+        self._predict_seconds = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self._model is not None
+
+    def predict(self, query: str, allowed: Optional[Sequence[str]] = None) -> Tuple[Optional[str], float]:
+        """
+        Returns (label, confidence), with label None when the classifier is not confident enough
+        (or not trained). Probabilities are renormalized over the allowed labels.
+        """
+        model = self._model
+        if model is None or not settings.INTENT_CLASSIFIER_ENABLE or not query or not query.strip():
+            return None, 0.0
+        started = time.perf_counter()
+        probs = model.probabilities(query)
+        if allowed is not None:
+            mask = np.array([label in allowed for label in model.labels])
+            if not mask.any():
+                return None, 0.0
+            probs = np.where(mask, probs, 0.0)
+            probs = probs / probs.sum()
+        best = int(probs.argmax())
+        confidence = float(probs[best])
+        self._predict_seconds += time.perf_counter() - started
+        if confidence >= model.threshold:
+            self._confident += 1
+            return model.labels[best], confidence
+        self._deferred += 1
+        return None, confidence
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self._confident + self._deferred
+        return {
+            "enabled": settings.INTENT_CLASSIFIER_ENABLE,
+            "trained": self._model is not None,
+            "labels": self._model.labels if self._model else [],
+            "calibration": self._model.stats if self._model else None,
+            "stale_behind": self._stale_behind,
+            "runtime": {
+                "confident": self._confident,
+                "deferred_to_llm": self._deferred,
+                "confident_rate": round(self._confident / calls, 4) if calls else None,
+                "mean_predict_ms": round(self._predict_seconds / calls * 1000, 4) if calls else None
+            }
+        }
+
+    async def _training_samples(self, db: AsyncSession) -> List[Tuple[str, str]]:
+        samples: List[Tuple[str, str]] = []
+        result = await db.execute(select(BenchmarkCase.question, BenchmarkCase.intent).where(BenchmarkCase.intent.in_(LABELS)))
+        samples.extend((question, intent) for question, intent in result.all())
+
+        # Routes of past answers, joined to the user message they replied to
+        stmt = select(Message.metadata_).where(Message.role == "assistant")\
+            .order_by(desc(Message.created_at)).limit(settings.INTENT_CLASSIFIER_MAX_MESSAGES)
+        result = await db.execute(stmt)
+        routed: Dict[str, str] = {}
+        for (metadata,) in result.all():
+            if not isinstance(metadata, dict):
+                continue
+            label = _ROUTE_LABELS.get(metadata.get("route"))
+            if label is None or (metadata.get("models_used") or {}).get("router") == ROUTER_NAME:
+                continue
+            reply_to = metadata.get("reply_to")
+            if reply_to:
+                routed[reply_to] = label
+
+        ids = []
+        for reply_to in routed:
+            try:
+                ids.append(uuid.UUID(str(reply_to)))
+            except ValueError:
+                continue
+        for start in range(0, len(ids), 1000):
+            result = await db.execute(select(Message.id, Message.content).where(Message.id.in_(ids[start:start + 1000])))
+            samples.extend((content, routed[str(msg_id)]) for msg_id, content in result.all())
+        return samples
+
+    async def retrain(self, broadcast: bool = True) -> Dict[str, Any]:
+        """Trains a new model from the database, swaps it in and saves it. Returns its calibration stats."""
+        async with self._train_lock:
+            async with self.session_factory() as db:
+                samples = await self._training_samples(db)
+            model = await asyncio.to_thread(
+                train_model, samples, settings.INTENT_CLASSIFIER_FEATURES, settings.INTENT_CLASSIFIER_TARGET_PRECISION
+            )
+            self._model = model
+            self._stale_behind = None
+            self.reset_stats()
+            await asyncio.to_thread(self._save, model)
+        logger.info(
+            f"Intent classifier trained on {model.stats['train_samples']} queries: holdout accuracy "
+            f"{model.stats['holdout_accuracy']}, coverage {model.stats['coverage_at_threshold']} at threshold {model.stats['threshold']}."
+        )
+        if broadcast:
+            await invalidation_bus.publish("intent_classifier", None, {"op": "retrained", "trained_at": model.stats["trained_at"]})
+        return model.stats
+
+    async def load(self) -> bool:
+        """Loads the persisted model, if any."""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            self._model = await asyncio.to_thread(self._read)
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to load intent classifier {self.path}: {e}")
+            return False
+
+    async def apply_remote(self, payload: Dict[str, Any]):
+        """
+        Another worker retrained: pick its model up from the shared file. Only the publisher trains;
+        a worker that can't see the new file (or sees an older one) keeps its current model and
+        reports itself stale instead of retraining, so one publish never fans out into N trainings.
+        """
+        published = payload.get("trained_at") or ""
+        model = None
+        if self.path and os.path.exists(self.path):
+            try:
+                model = await asyncio.to_thread(self._read)
+            except Exception as e:
+                logger.warning(f"Failed to load intent classifier {self.path}: {e}")
+        if model is not None and model.stats.get("trained_at", "") >= published:
+            self._model = model
+            self._stale_behind = None
+            self.reset_stats()
+            return
+        self._stale_behind = published
+        logger.warning(
+            f"Intent classifier trained at {published} by another worker is not readable at {self.path}; "
+            f"keeping the current model."
+        )
+
+    def _save(self, model: _Model):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            weights=model.weights,
+            bias=model.bias,
+            meta=np.array(json.dumps({
+                "labels": model.labels,
+                "temperature": model.temperature,
+                "threshold": model.threshold,
+                "stats": model.stats
+            }))
+        )
+        os.replace(tmp_path, self.path)
+
+    def _read(self) -> _Model:
+        with np.load(self.path) as f:
+            meta = json.loads(str(f["meta"]))
+            return _Model(f["weights"], f["bias"], meta["labels"], meta["temperature"], meta["threshold"], meta["stats"])
+
+
+intent_classifier = IntentClassifier()
+invalidation_bus.register("intent_classifier", intent_classifier.apply_remote)
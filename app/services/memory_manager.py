@@ -10,6 +10,8 @@ from app.core.redis import RedisClient
 import logging
 import random
 from app.services.vector_service import vector_service
+from app.services.message_writer import message_writer
+from app.core.tracing import traced
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +20,7 @@ class MemoryManager:
         self.db = db
         self.redis = RedisClient.get_instance()
         
+    @traced("memory.history")
     async def get_short_term_memory(self, session_id: str) -> List[Dict]:
         """获取短期记忆 (Redis)"""
         if not settings.MEMORY_ENABLE:
@@ -31,6 +34,7 @@ class MemoryManager:
             logger.error(f"Short-term Memory Error: {e}")
             return []
 
+    @traced("memory.mid_term_search")
     async def get_relevant_mid_term_memory(self, session_id: str, query: str, limit: int = 5) -> List[Dict]:
         """
         获取相关的中期记忆 (Vector Search from DB)
@@ -77,6 +81,7 @@ class MemoryManager:
             logger.error(f"Long-term Memory Error: {e}")
             return {}
 
+    @traced("memory.save")
     async def save_message(self, session_id: str, role: str, content: str, user_id: str, metadata: Optional[Dict] = None) -> str:
         """保存消息到 Redis (短期) 和 DB (中期)"""
         if not settings.MEMORY_ENABLE:
@@ -94,6 +99,10 @@ class MemoryManager:
                     await pipe.execute()
 
             # 2. Save to DB (Mid-term)
+            # Write-behind when the background writer runs: insert and embedding happen off the request path
+            if message_writer.running:
+                return await message_writer.submit(session_id, role, content, metadata)
+
             # Calculate embedding if enabled
             embedding = None
             if settings.MID_TERM_MEMORY_ENABLE_EMBEDDING and content.strip():
@@ -0,0 +1,191 @@
+import asyncio
+import copy
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert, update
+
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.base import Message
+from app.services.vector_service import vector_service
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+    """
+    Write-behind persistence for conversation messages. submit() hands back a pre-generated message id
+    right away; a background task inserts queued rows in multi-row batches, and a second one embeds
+    them in batches and fills in Message.embedding afterwards.
+    The queues are bounded: a full write queue makes submit() wait, a full embedding queue drops the
+    embedding (the message is still stored, it just can't be recalled as mid-term memory).
+    """
+
+    def __init__(self):
+        self.session_factory = AsyncSessionLocal
+        self._queue: Optional[asyncio.Queue] = None
+        self._embed_queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._pending: set = set()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self._written = 0
+        self._failed = 0
+        self._embedded = 0
+        self._embed_dropped = 0
+        self._flushes = 0
+        self._flush_seconds = 0.0
+        self._flush_max_seconds = 0.0
+        self._last_batch = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        if self._tasks or not settings.MESSAGE_WRITE_BEHIND_ENABLE:
+            return
+        self._queue = asyncio.Queue(maxsize=settings.MESSAGE_WRITE_QUEUE_MAX)
+        self._embed_queue = asyncio.Queue(maxsize=settings.MESSAGE_WRITE_QUEUE_MAX)
+        self._tasks = [asyncio.create_task(self._write_loop()), asyncio.create_task(self._embed_loop())]
+
+    async def stop(self):
+        """Flushes everything queued (rows, then embeddings) and stops the background tasks."""
+        if not self._tasks:
+            return
+        await self._queue.join()
+        await self._embed_queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info(f"Message writer stopped after writing {self._written} messages.")
+
+    async def submit(self, session_id: str, role: str, content: str, metadata: Optional[Dict] = None) -> str:
+        """Queues a message row and returns its id. Waits only while the queue is full."""
+        message_id = uuid.uuid4()
+        metadata = copy.deepcopy(metadata) if metadata else {}  # Callers keep mutating theirs
+        row = {
+            "id": message_id,
+            "session_id": uuid.UUID(str(session_id)),
+            "role": role,
+            "content": content,
+            "metadata_": metadata,
+            "hit_source": metadata.get("hit_source"),
+            "created_at": datetime.utcnow()
+        }
+        self._pending.add(message_id)
+        await self._queue.put(row)
+        return str(message_id)
+
+    def is_pending(self, message_id: Any) -> bool:
+        try:
+            return uuid.UUID(str(message_id)) in self._pending
+        except ValueError:
+            return False
+
+    async def flush(self):
+        """Waits until every message queued so far is in the database (embeddings may still follow)."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def _next_batch(self, queue: asyncio.Queue, size: int) -> List[Dict[str, Any]]:
+        batch = [await queue.get()]
+        deadline = time.monotonic() + settings.MESSAGE_WRITE_FLUSH_INTERVAL_MS / 1000
+        while len(batch) < size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write_loop(self):
+        while True:
+            batch = await self._next_batch(self._queue, settings.MESSAGE_WRITE_BATCH_SIZE)
+            try:
+                started = time.perf_counter()
+                written = await self._insert(batch)
+                elapsed = time.perf_counter() - started
+                self._flushes += 1
+                self._flush_seconds += elapsed
+                self._flush_max_seconds = max(self._flush_max_seconds, elapsed)
+                self._last_batch = len(batch)
+                if settings.MID_TERM_MEMORY_ENABLE_EMBEDDING:
+                    for row in written:
+                        if not row["content"].strip():
+                            continue
+                        try:
+                            self._embed_queue.put_nowait(row)
+                        except asyncio.QueueFull:
+                            self._embed_dropped += 1
+            except Exception as e:
+                logger.error(f"Message write-behind flush failed: {e}")
+            finally:
+                for row in batch:
+                    self._pending.discard(row["id"])
+                    self._queue.task_done()
+
+    async def _insert(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Multi-row INSERT of the batch; on failure retries row by row so one bad row loses only itself."""
+        async with self.session_factory() as db:
+            try:
+                await db.execute(insert(Message), batch)
+                await db.commit()
+                self._written += len(batch)
+                return batch
+            except Exception as e:
+                await db.rollback()
+                if len(batch) == 1:
+                    self._failed += 1
+                    logger.error(f"Failed to persist message {batch[0]['id']}: {e}")
+                    return []
+                logger.warning(f"Batch insert of {len(batch)} messages failed, retrying one by one: {e}")
+
+        written = []
+        for row in batch:
+            written.extend(await self._insert([row]))
+        return written
+
+    async def _embed_loop(self):
+        while True:
+            batch = await self._next_batch(self._embed_queue, settings.MESSAGE_EMBED_BATCH_SIZE)
+            try:
+                embeddings = await vector_service.embed_documents([row["content"] for row in batch])
+                async with self.session_factory() as db:
+                    await db.execute(
+                        update(Message),
+                        [{"id": row["id"], "embedding": embedding} for row, embedding in zip(batch, embeddings)]
+                    )
+                    await db.commit()
+                self._embedded += len(batch)
+            except Exception as e:
+                logger.error(f"Failed to embed {len(batch)} messages: {e}")
+            finally:
+                for _ in batch:
+                    self._embed_queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "embed_queue_depth": self._embed_queue.qsize() if self._embed_queue else 0,
+            "written": self._written,
+            "failed": self._failed,
+            "embedded": self._embedded,
+            "embed_dropped": self._embed_dropped,
+            "flushes": self._flushes,
+            "last_batch": self._last_batch,
+            "mean_flush_ms": round(self._flush_seconds / self._flushes * 1000, 3) if self._flushes else None,
+            "max_flush_ms": round(self._flush_max_seconds * 1000, 3)
+        }
+
+
+message_writer = MessageWriter()
@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from string import Formatter
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class _CompiledTemplate:
+    """A prompt template parsed once: its fields are known, and templates without fields are pre-rendered."""
+    __slots__ = ("text", "fields", "static")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.fields = frozenset(field for _, field, _, _ in Formatter().parse(text) if field is not None)
+        self.static = text.format() if not self.fields else None
+
+    def render(self, kwargs: Dict[str, Any]) -> str:
+        if self.static is not None:
+            return self.static
+        missing = [field for field in self.fields if field not in kwargs]
+        if missing:
+            logger.error(f"Missing key for prompt formatting: {missing}")
+            return self.text  # Unformatted is better than a crash
+        try:
+            return self.text.format(**kwargs)
+        except (KeyError, IndexError, ValueError) as e:
+            logger.error(f"Failed to format prompt: {e}")
+            return self.text
+
+
+class _PromptSet:
+    """One parsed version of prompts.json, indexed for lookups."""
+
+    def __init__(self, config: Dict[str, Any]):
+        self.empty = not config
+        self.language_defaults: Dict[str, str] = config.get("settings", {}).get("provider_language_defaults", {})
+        self.templates: Dict[Tuple[str, str], _CompiledTemplate] = {}
+        for intent, by_lang in config.get("templates", {}).items():
+            for lang, text in by_lang.items():
+                if text:
+                    self.templates[(intent, lang)] = _CompiledTemplate(text)
+        # (provider, model, intent, lang) -> template; the first override in file order wins
+        self.overrides: Dict[Tuple[str, str, str, str], _CompiledTemplate] = {}
+        for override in config.get("overrides", []):
+            for lang, text in override.get("templates", {}).items():
+                key = (override.get("provider"), override.get("model"), override.get("intent"), lang)
+                if text and key not in self.overrides:
+                    self.overrides[key] = _CompiledTemplate(text)
+        self.resolved: Dict[Tuple[str, str, str, str], Optional[_CompiledTemplate]] = {}
+
+    def resolve(self, provider: str, model: str, intent: str, lang: str) -> Optional[_CompiledTemplate]:
+        key = (provider, model, intent, lang)
+        template = self.resolved.get(key, _MISSING)
+        if template is _MISSING:
+            template = self.overrides.get(key) or self.templates.get((intent, lang)) or self.templates.get((intent, "en"))
+            if len(self.resolved) >= 4096:
+                self.resolved.clear()
+            self.resolved[key] = template
+        return template
+
+
+class PromptRegistry:
+    """
+    System prompts from app/config/prompts.json, loaded once and kept in memory.
+    A background task re-reads the file when its mtime/size changes and re-parses it only when the
+    content hash changes, so serving a prompt never touches the disk.
+    """
+
+    def __init__(self, path: str = os.path.join("app", "config", "prompts.json")):
+        self.path = path
+        self._prompts: Optional[_PromptSet] = None
+        self._stat: Optional[Tuple[int, int]] = None
+        self._digest: Optional[str] = None
+        self.version = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def _read_stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def refresh(self) -> bool:
+        """Reloads the file if it changed since the last load. Returns True if a new version was installed."""
+        stat = self._read_stat()
+        if self._prompts is not None and stat == self._stat:
+            return False
+
+        if stat is None:
+            if self._prompts is None or not self._prompts.empty:
+                logger.warning(f"Prompts config not found at {self.path}, using hardcoded defaults.")
+            self._stat, self._digest = None, None
+            return self._install(_PromptSet({}))
+
+        try:
+            with open(self.path, "rb") as f:
+                raw = f.read()
+        except OSError as e:
+            logger.error(f"Failed to read prompts config: {e}")
+            return False
+        self._stat = stat
+        digest = hashlib.sha256(raw).hexdigest()
+        if self._prompts is not None and digest == self._digest:
+            return False  # Touched, not changed
+
+        try:
+            prompts = _PromptSet(json.loads(raw.decode("utf-8")))
+        except Exception as e:
+            # Keep serving the previous version rather than falling back to defaults mid-edit
+            logger.error(f"Failed to load prompts config: {e}")
+            if self._prompts is None:
+                return self._install(_PromptSet({}))
+            return False
+        self._digest = digest
+        logger.info(f"Prompts configuration loaded (version {self.version + 1}).")
+        return self._install(prompts)
+
+    def _install(self, prompts: _PromptSet) -> bool:
+        self._prompts = prompts
+        self.version += 1
+        return True
+
+    @property
+    def digest(self) -> Optional[str]:
+        """Content hash of the loaded prompts.json; the same on every worker serving the same file."""
+        return self._digest
+
+    def ensure_loaded(self):
+        if self._prompts is None:
+            self.refresh()
+
+    def render(self, provider: Optional[str], model: Optional[str], intent: str,
+               language: Optional[str] = None, **kwargs) -> Optional[str]:
+        """
+        Formats the system prompt for provider/model/intent, or returns None if prompts.json has none.
+        Resolution: override for (provider, model, intent, lang) > template for (intent, lang) > (intent, "en").
+        The language defaults to the provider's configured language, then "en".
+        """
+        prompts = self._prompts
+        if prompts is None:
+            self.ensure_loaded()
+            prompts = self._prompts
+        if prompts.empty:
+            return None
+
+        provider = provider.lower() if provider else "openai"
+        model = model.lower() if model else "default"
+        lang = language or prompts.language_defaults.get(provider, "en")
+        template = prompts.resolve(provider, model, intent, lang)
+        if template is None:
+            return None
+        return template.render(kwargs)
+
+    async def start(self):
+        if self._task is not None or settings.PROMPTS_RELOAD_INTERVAL_SECONDS <= 0:
+            return
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(settings.PROMPTS_RELOAD_INTERVAL_SECONDS)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.error(f"Prompt registry refresh failed: {e}")
+
+
+prompt_registry = PromptRegistry()
@@ -0,0 +1,242 @@
+"""
+Query normalization shared by the instruction matcher and the instruction cache key.
+
+Steps (single pass after a 1:1 translate):
+- full-width ASCII forms and the ideographic space -> half-width
+- Chinese numerals -> Arabic digits when they are quantities, i.e. followed by a measure word or
+  unit or by nothing CJK ("三十七" -> "37", "二十五点五度" -> "25.5度"); names ("三里屯") and
+  approximate counts ("三四个") stay
+- whitespace next to CJK removed, other runs collapsed to one space
+- leading politeness fillers ("请", "帮我", "please") and trailing punctuation / modal particles
+  dropped, only where they stand alone: "请" before a command verb ("请打开", not "请假" / "请问"),
+  a particle not ending a word ("好吧", not "酒吧")
+
+Letter case is left alone (matching is case-insensitive; the cache key lower-cases on its own),
+so text captured from a normalized query can still be mapped back to the user's wording.
+"""
+import re
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+
+_FULLWIDTH_RE = re.compile("[\uff01-\uff5e\u3000]")
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+_CN_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_CN_UNITS = {"十": 10, "百": 100, "千": 1000}
+# Idioms where the numeral is not a quantity: 一下, 一点 (a bit), 一起, 十分 (very)...
+_CN_KEEP_BEFORE = {"一": set("下点些会起样直定切共般旦"), "十": set("分")}
+# ...unless it is a time of day: 一点半 is read like 两点半
+_CLOCK_TIMES = ("点半", "点钟", "点整")
+# Measure words and units that make a numeral a quantity. Characters common in place names
+# (里, 道, 环, 元, 台, 棵, 间...) are left out: 三里屯, 五道口, 三元桥 keep their numerals.
+_CN_MEASURE_WORDS = (
+    "个", "位", "次", "遍", "倍", "档", "级", "格", "层", "楼", "号", "年", "月", "日", "天", "周",
+    "点", "分", "秒", "小时", "钟头", "岁", "首", "集", "章", "页", "部", "张", "条", "本", "块",
+    "度", "米", "公里", "千米", "厘米", "毫米", "斤", "公斤", "千克", "克", "升", "毫升", "瓦", "杯", "份", "人", "频道"
+)
+
+_CN_NUMBER = r"[零〇一二两三四五六七八九十百千万亿]+(?:点[零〇一二三四五六七八九]+)?"
+# "请" / "麻烦" are only fillers in front of a request ("请打开", "麻烦你帮我"), not in 请假, 请问, 麻烦事
+_LEAD_VERBS = (
+    "把", "将", "帮", "给", "打", "开", "关", "调", "设", "放", "播", "停", "暂停", "继续", "导航", "切",
+    "换", "增", "减", "降", "提高", "升高", "查", "搜", "告诉", "讲", "说", "念", "读", "推荐", "提醒",
+    "定", "拨", "发", "添加", "删", "取消", "启动", "退出", "返回", "显示", "找"
+)
+_LEAD = re.compile(
+    r"(?:[\s,，]|(?:请|麻烦)你?(?=[\s,，]*(?:" + "|".join(_LEAD_VERBS) + r"))|帮我|帮忙|(?i:please)(?![a-z]))+"
+)
+_LEAD_FIRST = set(" \t\r\n,，请麻帮pP")
+_TRAIL_PUNCT = " \t\r\n\u3000,，。.!?、~～;；…"
+_PARTICLES = "吧啊呀呢哦嘛啦"
+_TRAIL_CHARS = _TRAIL_PUNCT + _PARTICLES
+# Words ending in a particle character: the particle is part of the word, not of the sentence
+_PARTICLE_WORDS = {
+    "酒吧", "网吧", "贴吧", "水吧", "书吧", "氧吧", "话吧", "陶吧", "迪吧", "琴吧",
+    "干嘛", "喇嘛", "毛呢", "哗啦", "呼啦", "哇啦", "哎呀", "咿呀"
+}
+# Whitespace worth editing: runs, tabs/newlines, or a space next to CJK (plain single spaces stay)
+_WS = r"\s{2,}|[^\S ]|(?<=[\u4e00-\u9fff]) | (?=[\u4e00-\u9fff])"
+_EDITS = re.compile(f"(?P<num>{_CN_NUMBER})|(?P<ws>{_WS})")
+# Cheap prefilter: most queries need none of the edits
+_EDIT_HINT = re.compile(f"[零〇一二两三四五六七八九十百千万亿]|{_WS}")
+
+
+def _is_cjk(ch: str) -> bool:
+    return "一" <= ch <= "鿿"
+
+
+def _parse_cn_int(run: str) -> Optional[int]:
+    if all(ch in _CN_DIGITS for ch in run):
+        if len(run) == 1:
+            return _CN_DIGITS[run]
+        # Digit-by-digit reading (二零二四, 一零一), but two adjacent digits are an approximation
+        # (三四个 = three or four), not a number
+        if "零" in run or "〇" in run or len(run) >= 3:
+            return int("".join(str(_CN_DIGITS[ch]) for ch in run))
+        return None
+
+    total = 0
+    section = 0
+    digit = None
+    last_unit = None  # Unit right before a trailing digit: 一百五 = 150, 两万三 = 23000
+    for ch in run:
+        if ch in _CN_DIGITS:
+            digit = _CN_DIGITS[ch]
+            if digit == 0:
+                last_unit = None
+            continue
+        if ch in _CN_UNITS:
+            unit = _CN_UNITS[ch]
+            section += (1 if digit is None else digit) * unit
+        elif ch == "万":
+            unit = 10 ** 4
+            total += (section + (digit or 0)) * unit
+            section = 0
+        else:  # 亿 scales everything read so far
+            unit = 10 ** 8
+            total = (total + section + (digit or 0)) * unit
+            section = 0
+        digit = None
+        last_unit = unit
+
+    if digit is not None:
+        if last_unit is not None and last_unit >= 100:
+            digit *= last_unit // 10
+        section += digit
+    return total + section
+
+
+def _cn_number(text: str, match, limit: int) -> Optional[str]:
+    """The numeral as digits if it is a quantity: followed (before `limit`) by a measure word or nothing CJK."""
+    run = match.group()
+    end = match.end()
+    keep = _CN_KEEP_BEFORE.get(run)
+    if keep is not None and end < len(text) and text[end] in keep and not text.startswith(_CLOCK_TIMES, end):
+        return None
+    if end < limit and _is_cjk(text[end]) and not text.startswith(_CN_MEASURE_WORDS, end):
+        return None
+    return _cn_to_arabic(run)
+
+
+@lru_cache(maxsize=4096)
+def _cn_to_arabic(run: str) -> Optional[str]:
+    if run[0] not in _CN_DIGITS and run[0] != "十":
+        return None
+    integer, _, fraction = run.partition("点")
+    value = _parse_cn_int(integer)
+    if value is None:
+        return None
+    if fraction:
+        return f"{value}." + "".join(str(_CN_DIGITS[ch]) for ch in fraction)
+    return str(value)
+
+
+def _replacement(text: str, match, limit: int) -> Optional[str]:
+    if match.lastgroup == "num":
+        return _cn_number(text, match, limit)
+    before = text[match.start() - 1] if match.start() else ""
+    after = text[match.end()] if match.end() < len(text) else ""
+    if _is_cjk(before) or _is_cjk(after):
+        return ""
+    return None if match.group() == " " else " "
+
+
+def _trail_start(text: str, floor: int) -> int:
+    """Start of the trailing run of punctuation, stand-alone modal particles and "please"."""
+    end = len(text)
+    while end > floor:
+        ch = text[end - 1]
+        if ch in _TRAIL_PUNCT or (ch in _PARTICLES and text[end - 2:end] not in _PARTICLE_WORDS):
+            end -= 1
+        elif end - floor >= 6 and text[end - 6:end].lower() == "please":
+            end -= 6
+        else:
+            break
+    return end
+
+
+def _half_width(match) -> str:
+    ch = match.group()
+    return " " if ch == "\u3000" else chr(ord(ch) - 0xFEE0)
+
+
+def fold_width(text: str) -> str:
+    """Full-width ASCII forms -> half-width (length preserving)."""
+    if text.isascii() or _FULLWIDTH_RE.search(text) is None:
+        return text
+    return _FULLWIDTH_RE.sub(_half_width, text)
+
+
+def _normalize(text: str, strip_fillers: bool, with_spans: bool) -> Tuple[str, Optional[List[int]], Optional[List[int]]]:
+    text = fold_width(text)
+    lead_end, trail_start = 0, len(text)
+    if strip_fillers and text:
+        if text[0] in _LEAD_FIRST:
+            lead = _LEAD.match(text)
+            if lead is not None:
+                lead_end = lead.end()
+        if text[-1] in _TRAIL_CHARS or text[-1] in "eE":
+            trail_start = _trail_start(text, lead_end)
+        if lead_end == trail_start:
+            # Nothing but filler: keep the text rather than collapsing distinct queries into ""
+            lead_end, trail_start = 0, len(text)
+
+    parts = []
+    starts: Optional[List[int]] = [] if with_spans else None
+    ends: Optional[List[int]] = [] if with_spans else None
+    pos = lead_end
+    edits = _EDITS.finditer(text, lead_end, trail_start) if _EDIT_HINT.search(text, lead_end, trail_start) else ()
+    for match in edits:
+        repl = _replacement(text, match, trail_start)
+        if repl is None:
+            continue
+        parts.append(text[pos:match.start()])
+        parts.append(repl)
+        if with_spans:
+            starts.extend(range(pos, match.start()))
+            ends.extend(range(pos + 1, match.start() + 1))
+            starts.extend([match.start()] * len(repl))
+            ends.extend([match.end()] * len(repl))
+        pos = match.end()
+
+    if parts:
+        parts.append(text[pos:trail_start])
+        normalized = "".join(parts)
+    elif lead_end or trail_start < len(text):
+        normalized = text[lead_end:trail_start]
+    else:
+        normalized = text
+
+    if with_spans:
+        starts.extend(range(pos, trail_start))
+        ends.extend(range(pos + 1, trail_start + 1))
+    return normalized, starts, ends
+
+
+def normalize_query(text: str) -> str:
+    """Normalizes a user query (or a template source question) for matching and cache keys."""
+    return _normalize(text, True, False)[0]
+
+
+def normalize_query_spans(text: str) -> Tuple[str, str, List[int], List[int]]:
+    """
+    Like normalize_query, plus the width-folded source and, for every output character, the
+    [start, end) span it came from in that source, so captured slots can be mapped back to the
+    user's wording.
+    """
+    normalized, starts, ends = _normalize(text, True, True)
+    return normalized, fold_width(text), starts, ends
+
+
+def normalize_value(text: str) -> str:
+    """Character-level normalization only (no filler stripping), for slot values inside a query."""
+    return _normalize(text, False, False)[0]
+
+
+def query_numbers(text: str) -> List[str]:
+    """
+    The numbers of a query after normalization, sorted, so "调到三十七" and "调到37" agree. Used to
+    refuse similarity hits that differ only in a number.
+    """
+    return sorted(_NUMBER_RE.findall(normalize_query(text)))
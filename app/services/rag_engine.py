@@ -5,6 +5,7 @@ from sqlalchemy import select, func, text
 from app.models.base import DocumentChunk, Document
 from app.models.rag_config import RAGConfig
 from app.core.config import settings
+from app.core.tracing import span, traced
 from app.services.vector_service import vector_service
 import logging
 import uuid
@@ -84,6 +85,7 @@ class RAGEngine:
                 
         return unique_models
 
+    @traced("rag.search")
     async def search(self, query: str, user_id: uuid.UUID, top_k: int = 3, doc_ids: List[uuid.UUID] = None, language: str = None) -> List[Any]:
         try:
             # 1. Get User Config
@@ -161,8 +163,9 @@ class RAGEngine:
                             DocumentChunk.embedding.cosine_distance(query_embedding)
                         ).limit(effective_top_k * 2) 
                         
-                        res = await self.db.execute(stmt)
-                        return res.scalars().all()
+                        with span("rag.vector_query", model=f"{provider}/{model}"):
+                            res = await self.db.execute(stmt)
+                            return res.scalars().all()
                         
                     except Exception as ex:
                         logger.error(f"Search failed for model {provider}/{model}: {ex}")
@@ -234,8 +237,9 @@ class RAGEngine:
                         func.ts_rank(search_vector, search_query).desc()
                     ).limit(effective_top_k * 2)
                 
-                 kw_result = await self.db.execute(stmt)
-                 keyword_results = kw_result.scalars().all()
+                 with span("rag.keyword_query", language=lang):
+                     kw_result = await self.db.execute(stmt)
+                     keyword_results = kw_result.scalars().all()
             
             # 4. Rerank (Reciprocal Rank Fusion)
             final_chunks = self._rerank(vector_results, keyword_results, effective_top_k, config.rerank_enabled)
@@ -0,0 +1,257 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.invalidation import invalidation_bus
+from app.core.redis import RedisClient
+from app.services.query_normalizer import query_numbers
+from app.services.vector_service import vector_service
+
+logger = logging.getLogger(__name__)
+
+
+def _ttl(intent: str) -> int:
+    """Freshness class: search answers quote live results and expire fast, chat answers slowly."""
+    if intent == "search":
+        return settings.RESPONSE_CACHE_SEARCH_TTL_SECONDS
+    return settings.RESPONSE_CACHE_CHAT_TTL_SECONDS
+
+
+class _ScopeIndex:
+    """Normalized query embeddings of one scope in a growable buffer; removal swaps the last row into the hole."""
+    __slots__ = ("ids", "rows", "buffer", "expires", "size")
+
+    def __init__(self, dim: int):
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.buffer = np.empty((16, dim), dtype=np.float32)
+        self.expires = np.empty(16, dtype=np.float64)
+        self.size = 0
+
+    def add(self, entry_id: str, vector: np.ndarray, expires_at: float):
+        if self.size == len(self.buffer):
+            self.buffer = np.concatenate([self.buffer, np.empty_like(self.buffer)])
+            self.expires = np.concatenate([self.expires, np.empty_like(self.expires)])
+        self.rows[entry_id] = self.size
+        self.ids.append(entry_id)
+        self.buffer[self.size] = vector
+        self.expires[self.size] = expires_at
+        self.size += 1
+
+    def remove(self, entry_id: str):
+        row = self.rows.pop(entry_id, None)
+        if row is None:
+            return
+        last = self.size - 1
+        if row != last:
+            moved = self.ids[last]
+            self.ids[row] = moved
+            self.buffer[row] = self.buffer[last]
+            self.expires[row] = self.expires[last]
+            self.rows[moved] = row
+        self.ids.pop()
+        self.size = last
+
+
+class ResponseCache:
+    """
+    Semantic cache of chat and search answers (opt-in via RESPONSE_CACHE_ENABLE).
+
+    A scope is (intent, language, provider/model, prompt version); within it the nearest cached
+    question by embedding cosine similarity is reused when it clears RESPONSE_CACHE_THRESHOLD and
+    has the same numbers as the query. Entries live in Redis with their freshness class TTL and in
+    an in-process index per worker; new entries reach the other workers over the invalidation bus.
+    Only the first turn of a conversation is cached, since later answers depend on the history.
+    """
+
+    KEY_PREFIX = "response_cache:entry"
+    SCORE_BUCKETS = 20
+
+    def __init__(self):
+        self._scopes: Dict[str, _ScopeIndex] = {}
+        # entry id -> entry (query, answer, scope, ...), oldest first for eviction
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.reset_stats()
+
+    @property
+    def enabled(self) -> bool:
+        return settings.RESPONSE_CACHE_ENABLE
+
+    def reset_stats(self):
+        self._stats = {"lookups": 0, "hits": 0, "misses": 0, "rejected_numbers": 0, "stores": 0, "errors": 0,
+                       "score_histogram": [0] * self.SCORE_BUCKETS}
+
+    def stats(self) -> Dict[str, Any]:
+        s = self._stats
+        return {
+            "enabled": self.enabled,
+            "threshold": settings.RESPONSE_CACHE_THRESHOLD,
+            "entries": len(self._entries),
+            "scopes": len(self._scopes),
+            **{k: v for k, v in s.items() if k != "score_histogram"},
+            "hit_rate": s["hits"] / s["lookups"] if s["lookups"] else 0.0,
+            # Bucket i counts lookups whose best score fell in [i/20, (i+1)/20)
+            "score_histogram": list(s["score_histogram"])
+        }
+
+    @staticmethod
+    def scope(intent: str, language: Optional[str], provider: str, model: str, prompt_digest: Optional[str] = None) -> str:
+        raw = "\x1f".join([intent, language or "", f"{provider}/{model}", prompt_digest or ""])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+    async def embed(self, query: str) -> Optional[np.ndarray]:
+        """Normalized query embedding, or None if the embedding call failed."""
+        try:
+            vector = np.asarray(await vector_service.embed_query(query), dtype=np.float32)
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Response cache query embedding failed: {e}")
+            return None
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else None
+
+    def lookup(self, scope: str, query: str, vector: Optional[np.ndarray]) -> Optional[Dict[str, Any]]:
+        """The cached entry answering the query, with its similarity "score", or None."""
+        if not self.enabled or vector is None:
+            return None
+        self._stats["lookups"] += 1
+        index = self._scopes.get(scope)
+        if index is not None:
+            expired = np.nonzero(index.expires[:index.size] <= time.time())[0]
+            for entry_id in [index.ids[row] for row in expired]:
+                self._remove(entry_id)
+            index = self._scopes.get(scope)
+        if index is None or index.buffer.shape[1] != vector.shape[0]:
+            self._stats["misses"] += 1
+            return None
+
+        scores = index.buffer[:index.size] @ vector
+        row = int(np.argmax(scores))
+        score = float(scores[row])
+        bucket = min(max(int(score * self.SCORE_BUCKETS), 0), self.SCORE_BUCKETS - 1)
+        self._stats["score_histogram"][bucket] += 1
+        if score < settings.RESPONSE_CACHE_THRESHOLD:
+            self._stats["misses"] += 1
+            return None
+        entry = self._entries[index.ids[row]]
+        if query_numbers(query) != query_numbers(entry["query"]):
+            self._stats["rejected_numbers"] += 1
+            return None
+        self._stats["hits"] += 1
+        return {**entry, "score": score}
+
+    async def store(self, scope: str, intent: str, query: str, vector: Optional[np.ndarray], answer: str,
+                    search_results: Optional[List[Dict[str, Any]]] = None):
+        if not self.enabled or vector is None or not answer:
+            return
+        ttl = _ttl(intent)
+        now = time.time()
+        entry = {
+            "id": uuid.uuid4().hex,
+            "scope": scope,
+            "intent": intent,
+            "query": query,
+            "answer": answer,
+            "search_results": search_results or [],
+            "created_at": now,
+            "expires_at": now + ttl,
+            "vector": base64.b64encode(vector.astype(np.float32).tobytes()).decode("ascii")
+        }
+        self._add(entry)
+        self._stats["stores"] += 1
+        key = f"{self.KEY_PREFIX}:{entry['id']}"
+        try:
+            await RedisClient.get_instance().set(key, json.dumps(entry, ensure_ascii=False, default=str), ex=ttl)
+        except Exception as e:
+            logger.error(f"Response cache set error: {e}")
+            return
+        await invalidation_bus.publish("response_cache", None, {"key": key})
+
+    def _add(self, entry: Dict[str, Any]):
+        if entry["id"] in self._entries or entry["expires_at"] <= time.time():
+            return
+        vector = np.frombuffer(base64.b64decode(entry["vector"]), dtype=np.float32)
+        index = self._scopes.get(entry["scope"])
+        if index is None:
+            index = self._scopes[entry["scope"]] = _ScopeIndex(vector.shape[0])
+        index.add(entry["id"], vector, entry["expires_at"])
+        self._entries[entry["id"]] = {k: v for k, v in entry.items() if k != "vector"}
+        while len(self._entries) > settings.RESPONSE_CACHE_MAX_ENTRIES:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: str):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        index = self._scopes.get(entry["scope"])
+        if index is not None:
+            index.remove(entry_id)
+            if not index.size:
+                del self._scopes[entry["scope"]]
+
+    async def replay(self, answer: str) -> AsyncIterator[str]:
+        """Streams a cached answer in small chunks, like a generation, so clients render it the same way."""
+        size = max(settings.RESPONSE_CACHE_REPLAY_CHUNK_CHARS, 1)
+        for start in range(0, len(answer), size):
+            yield answer[start:start + size]
+            await asyncio.sleep(0)
+
+    async def load(self):
+        """Fills this worker's index from the entries in Redis (startup and resync)."""
+        if not self.enabled:
+            return
+        redis = RedisClient.get_instance()
+        keys = [key async for key in redis.scan_iter(match=f"{self.KEY_PREFIX}:*", count=500)]
+        loaded = 0
+        for start in range(0, len(keys), 500):
+            for raw in await redis.mget(keys[start:start + 500]):
+                if not raw:
+                    continue
+                try:
+                    self._add(json.loads(raw))
+                    loaded += 1
+                except (ValueError, KeyError) as e:
+                    logger.warning(f"Skipping malformed response cache entry: {e}")
+        logger.info(f"Loaded {loaded} response cache entries")
+
+    async def clear(self):
+        """Drops every cached answer here, in Redis and on the other workers."""
+        self._entries.clear()
+        self._scopes.clear()
+        try:
+            redis = RedisClient.get_instance()
+            keys = [key async for key in redis.scan_iter(match=f"{self.KEY_PREFIX}:*", count=500)]
+            for start in range(0, len(keys), 500):
+                await redis.delete(*keys[start:start + 500])
+        except Exception as e:
+            logger.error(f"Response cache clear error: {e}")
+        await invalidation_bus.publish("response_cache", None, {"clear": True})
+
+    async def apply_remote(self, payload: Dict[str, Any]):
+        if payload.get("clear"):
+            self._entries.clear()
+            self._scopes.clear()
+            return
+        if not self.enabled or not payload.get("key"):
+            return
+        raw = await RedisClient.get_instance().get(payload["key"])
+        if raw:
+            self._add(json.loads(raw))
+
+    async def resync(self):
+        self._entries.clear()
+        self._scopes.clear()
+        await self.load()
+
+
+response_cache = ResponseCache()
+invalidation_bus.register("response_cache", response_cache.apply_remote, response_cache.resync)
@@ -1,6 +1,8 @@
 import logging
 from typing import List, Dict, Optional
 from app.core.config import settings
+from app.core.single_flight import single_flight
+from app.services.query_normalizer import normalize_query
 
 logger = logging.getLogger(__name__)
 
@@ -13,7 +15,12 @@ class SearchService:
         """
         Execute search based on configured provider.
         Returns a list of dicts: [{'title': '...', 'href': '...', 'body': '...'}]
+        Identical concurrent searches share one provider call (and the returned list).
         """
+        key = single_flight.key(self.provider, max_results, normalize_query(query).strip().lower())
+        return await single_flight.run("search", key, lambda: self._search(query, max_results))
+
+    async def _search(self, query: str, max_results: int) -> List[Dict[str, str]]:
         if self.provider == "duckduckgo":
             return await self._search_duckduckgo(query, max_results)
         elif self.provider == "tavily":
@@ -0,0 +1,406 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.invalidation import invalidation_bus
+from app.core.redis import RedisClient
+from app.services.query_normalizer import query_numbers
+from app.services.vector_service import vector_service
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+class _RepoVectors:
+    """
+    Normalized question embeddings of one repository, one row per pair.
+    Rows live in a growable buffer; removal swaps the last row into the hole.
+    """
+    __slots__ = ("keys", "questions", "answers", "rows", "buffer", "size")
+
+    def __init__(self, dim: int):
+        self.keys: List[str] = []
+        self.questions: List[str] = []
+        self.answers: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.buffer = np.empty((16, dim), dtype=np.float32)
+        self.size = 0
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self.buffer[:self.size]
+
+    def upsert(self, key: str, question: str, answer: str, vector: np.ndarray):
+        row = self.rows.get(key)
+        if row is None:
+            if self.size == len(self.buffer):
+                grown = np.empty((len(self.buffer) * 2, self.buffer.shape[1]), dtype=np.float32)
+                grown[:self.size] = self.buffer[:self.size]
+                self.buffer = grown
+            row = self.size
+            self.size += 1
+            self.rows[key] = row
+            self.keys.append(key)
+            self.questions.append(question)
+            self.answers.append(answer)
+        else:
+            self.questions[row] = question
+            self.answers[row] = answer
+        self.buffer[row] = vector
+
+    def remove(self, key: str) -> bool:
+        row = self.rows.pop(key, None)
+        if row is None:
+            return False
+        last = self.size - 1
+        if row != last:
+            moved = self.keys[last]
+            self.keys[row] = moved
+            self.questions[row] = self.questions[last]
+            self.answers[row] = self.answers[last]
+            self.buffer[row] = self.buffer[last]
+            self.rows[moved] = row
+        self.keys.pop()
+        self.questions.pop()
+        self.answers.pop()
+        self.size = last
+        return True
+
+
+class SemanticInstructionIndex:
+    """
+    Embedding nearest-neighbour fallback for instruction resolution.
+
+    Holds one in-memory matrix per repository over the questions of live benchmark pairs
+    (fed by the matcher service) and liked pairs (the Redis instruction cache). A query whose
+    best cosine similarity clears SEMANTIC_INSTRUCTION_THRESHOLD reuses that pair's answer.
+    Pair embeddings are computed in the background and cached in Redis by question hash.
+    """
+    SCORE_BUCKETS = 20
+    LIKED_PREFIX = "instruction_cache:"
+
+    def __init__(self):
+        self._repos: Dict[Optional[uuid.UUID], _RepoVectors] = {}
+        self._key_repo: Dict[str, Optional[uuid.UUID]] = {}
+        # key -> (repository_id, question, answer) waiting to be embedded
+        self._pending: Dict[str, Tuple[Optional[uuid.UUID], str, str]] = {}
+        self._drain_task: Optional[asyncio.Task] = None
+        self.reset_stats()
+
+    @property
+    def enabled(self) -> bool:
+        return settings.SEMANTIC_INSTRUCTION_ENABLE
+
+    def reset_stats(self):
+        self._stats = {
+            "lookups": 0,
+            "hits": 0,
+            "misses": 0,
+            "rejected_numbers": 0,
+            "skipped_empty": 0,
+            "errors": 0,
+            "embed_ms_total": 0.0,
+            "search_ms_total": 0.0,
+            "score_histogram": [0] * self.SCORE_BUCKETS
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for tuning the threshold: hit rate, latency split and the best-score distribution."""
+        s = self._stats
+        searched = s["hits"] + s["misses"] + s["rejected_numbers"]
+        return {
+            "enabled": self.enabled,
+            "threshold": settings.SEMANTIC_INSTRUCTION_THRESHOLD,
+            "entries": sum(v.size for v in self._repos.values()),
+            "pending": len(self._pending),
+            "lookups": s["lookups"],
+            "hits": s["hits"],
+            "misses": s["misses"],
+            "rejected_numbers": s["rejected_numbers"],
+            "skipped_empty": s["skipped_empty"],
+            "errors": s["errors"],
+            "hit_rate": s["hits"] / s["lookups"] if s["lookups"] else 0.0,
+            "avg_embed_ms": s["embed_ms_total"] / searched if searched else 0.0,
+            "avg_search_ms": s["search_ms_total"] / searched if searched else 0.0,
+            # Bucket i counts lookups whose best score fell in [i/20, (i+1)/20)
+            "score_histogram": list(s["score_histogram"])
+        }
+
+    # --- Index maintenance -------------------------------------------------
+
+    def upsert(self, key: str, repository_id: Optional[uuid.UUID], question: str, answer: str):
+        """Queues a pair for embedding; it becomes searchable once the background drain has run."""
+        if not self.enabled:
+            return
+        if self._key_repo.get(key, repository_id) != repository_id:
+            self._remove_vector(key)
+        self._pending[key] = (repository_id, question, answer)
+        self._schedule_drain()
+
+    def remove(self, key: str):
+        self._pending.pop(key, None)
+        self._remove_vector(key)
+
+    def sync_cases(self, cases: Iterable[Tuple[uuid.UUID, Optional[uuid.UUID], str, Any]]):
+        """Replaces all benchmark-case entries with the given (case_id, repository_id, question, answer) set."""
+        if not self.enabled:
+            return
+        live = set()
+        for case_id, repository_id, question, answer in cases:
+            key = self.case_key(case_id)
+            live.add(key)
+            if not isinstance(answer, str):
+                answer = json.dumps(answer, ensure_ascii=False)
+            if not self._is_current(key, repository_id, question, answer):
+                self.upsert(key, repository_id, question, answer)
+        for key in [k for k in list(self._key_repo) + list(self._pending) if k.startswith("case:") and k not in live]:
+            self.remove(key)
+
+    @staticmethod
+    def case_key(case_id: uuid.UUID) -> str:
+        return f"case:{case_id}"
+
+    @staticmethod
+    def liked_key(cache_key: str) -> str:
+        return f"like:{cache_key}"
+
+    async def load_liked(self):
+        """Indexes every liked pair currently in the Redis instruction cache."""
+        if not self.enabled:
+            return
+        redis = RedisClient.get_instance()
+        live = set()
+        batch: List[str] = []
+
+        async def flush():
+            values = await redis.mget(batch)
+            for cache_key, raw in zip(batch, values):
+                if raw and self._upsert_liked(cache_key, raw):
+                    live.add(self.liked_key(cache_key))
+            batch.clear()
+
+        async for cache_key in redis.scan_iter(match=f"{self.LIKED_PREFIX}*", count=500):
+            batch.append(cache_key)
+            if len(batch) >= 500:
+                await flush()
+        if batch:
+            await flush()
+
+        for key in [k for k in list(self._key_repo) if k.startswith("like:") and k not in live]:
+            self.remove(key)
+        logger.info(f"Semantic index: {len(live)} liked pairs queued.")
+
+    def _upsert_liked(self, cache_key: str, raw: str) -> bool:
+        try:
+            data = json.loads(raw)
+            repo_str = data.get("repository_id")
+            repository_id = uuid.UUID(repo_str) if repo_str else None
+            question, answer = data.get("original_query"), data.get("response")
+        except Exception:
+            return False
+        if not question or not answer:
+            return False
+        key = self.liked_key(cache_key)
+        if not self._is_current(key, repository_id, question, answer):
+            self.upsert(key, repository_id, question, answer)
+        return True
+
+    async def add_liked(self, cache_key: str, repository_id: Optional[uuid.UUID], question: str, answer: str):
+        """Indexes a newly liked pair here and on the other workers."""
+        if not self.enabled:
+            return
+        self.upsert(self.liked_key(cache_key), repository_id, question, answer)
+        await invalidation_bus.publish("semantic_index", repository_id, {"op": "like", "key": cache_key})
+
+    async def remove_liked(self, cache_key: str, repository_id: Optional[uuid.UUID] = None):
+        if not self.enabled:
+            return
+        self.remove(self.liked_key(cache_key))
+        await invalidation_bus.publish("semantic_index", repository_id, {"op": "unlike", "key": cache_key})
+
+    async def apply_remote(self, payload: Dict[str, Any]):
+        """Applies a liked-pair event published by another worker (cases arrive via the matcher)."""
+        if not self.enabled:
+            return
+        cache_key = payload.get("key")
+        if not cache_key:
+            return
+        if payload.get("op") == "like":
+            raw = await RedisClient.get_instance().get(cache_key)
+            if raw:
+                self._upsert_liked(cache_key, raw)
+        elif payload.get("op") == "unlike":
+            self.remove(self.liked_key(cache_key))
+
+    async def stop(self):
+        if self._drain_task is not None and not self._drain_task.done():
+            self._drain_task.cancel()
+            try:
+                await self._drain_task
+            except asyncio.CancelledError:
+                pass
+        self._drain_task = None
+
+    def _is_current(self, key: str, repository_id: Optional[uuid.UUID], question: str, answer: str) -> bool:
+        pending = self._pending.get(key)
+        if pending is not None:
+            return pending == (repository_id, question, answer)
+        if self._key_repo.get(key, object()) != repository_id:
+            return False
+        vectors = self._repos[repository_id]
+        row = vectors.rows[key]
+        return vectors.questions[row] == question and vectors.answers[row] == answer
+
+    def _remove_vector(self, key: str):
+        if key not in self._key_repo:
+            return
+        repository_id = self._key_repo.pop(key)
+        vectors = self._repos.get(repository_id)
+        if vectors is not None:
+            vectors.remove(key)
+            if not vectors.size:
+                del self._repos[repository_id]
+
+    def _schedule_drain(self):
+        if self._drain_task is not None and not self._drain_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # No loop yet; the next upsert from async code picks the queue up
+        self._drain_task = loop.create_task(self._drain())
+
+    async def _drain(self):
+        batch_size = settings.SEMANTIC_INSTRUCTION_EMBED_BATCH
+        while self._pending:
+            batch = list(self._pending.items())[:batch_size]
+            try:
+                vectors = await self._embed_questions([entry[1] for _, entry in batch])
+            except Exception as e:
+                logger.error(f"Semantic index embedding failed, retrying later: {e}")
+                await asyncio.sleep(30)
+                continue
+            for (key, entry), vector in zip(batch, vectors):
+                # Skip entries removed or changed while we were embedding
+                if self._pending.get(key) is not entry:
+                    continue
+                del self._pending[key]
+                repository_id, question, answer = entry
+                repo_vectors = self._repos.get(repository_id)
+                if repo_vectors is None:
+                    repo_vectors = _RepoVectors(len(vector))
+                    self._repos[repository_id] = repo_vectors
+                repo_vectors.upsert(key, question, answer, vector)
+                self._key_repo[key] = repository_id
+
+    @staticmethod
+    def _embedding_cache_key(text: str) -> str:
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return f"semantic_embedding:{settings.EMBEDDING_PROVIDER}:{settings.EMBEDDING_MODEL}:{digest}"
+
+    async def _embed_questions(self, questions: List[str]) -> List[np.ndarray]:
+        """Embeds pair questions, reusing vectors cached in Redis by any worker."""
+        redis = RedisClient.get_instance()
+        cache_keys = [self._embedding_cache_key(q) for q in questions]
+        try:
+            cached = await redis.mget(cache_keys)
+        except Exception as e:
+            logger.warning(f"Semantic index embedding cache unavailable: {e}")
+            cached = [None] * len(questions)
+
+        vectors: List[Optional[np.ndarray]] = [
+            np.frombuffer(base64.b64decode(raw), dtype=np.float32) if raw else None for raw in cached
+        ]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            embedded = await vector_service.embed_documents([questions[i] for i in missing])
+            mapping = {}
+            for i, values in zip(missing, embedded):
+                vector = _normalize(np.asarray(values, dtype=np.float32))
+                vectors[i] = vector
+                mapping[cache_keys[i]] = base64.b64encode(vector.tobytes()).decode('ascii')
+            try:
+                await redis.mset(mapping)
+            except Exception as e:
+                logger.warning(f"Failed to cache semantic index embeddings: {e}")
+        return vectors
+
+    # --- Lookup ------------------------------------------------------------
+
+    async def search(self, query: str, repository_id: Optional[uuid.UUID] = None) -> Optional[Dict[str, Any]]:
+        """
+        Returns the closest pair for the repository (or global pairs) above the threshold, else None.
+        Pairs whose numbers differ from the query's are rejected, since their answer would carry
+        the wrong parameter values.
+        """
+        if not self.enabled:
+            return None
+        self._stats["lookups"] += 1
+        if repository_id not in self._repos and None not in self._repos:
+            # Nothing to compare against: skip the embedding call entirely
+            self._stats["skipped_empty"] += 1
+            return None
+
+        start = time.perf_counter()
+        try:
+            vector = _normalize(np.asarray(await vector_service.embed_query(query), dtype=np.float32))
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Semantic index query embedding failed: {e}")
+            return None
+        embedded = time.perf_counter()
+
+        # Re-read the repositories: the index may have changed while we awaited the embedding
+        best = None
+        scopes = [repository_id] if repository_id is None else [repository_id, None]
+        for scope in scopes:
+            vectors = self._repos.get(scope)
+            if vectors is None or not vectors.size:
+                continue
+            scores = vectors.matrix @ vector
+            row = int(np.argmax(scores))
+            score = float(scores[row])
+            if best is None or score > best[0]:
+                best = (score, vectors.questions[row], vectors.answers[row], scope)
+        done = time.perf_counter()
+        self._stats["embed_ms_total"] += (embedded - start) * 1000
+        self._stats["search_ms_total"] += (done - embedded) * 1000
+
+        if best is None:
+            self._stats["misses"] += 1
+            return None
+        score, question, answer, scope = best
+        bucket = min(max(int(score * self.SCORE_BUCKETS), 0), self.SCORE_BUCKETS - 1)
+        self._stats["score_histogram"][bucket] += 1
+
+        if score < settings.SEMANTIC_INSTRUCTION_THRESHOLD:
+            self._stats["misses"] += 1
+            return None
+        if query_numbers(query) != query_numbers(question):
+            self._stats["rejected_numbers"] += 1
+            return None
+
+        self._stats["hits"] += 1
+        return {
+            "source": "semantic",
+            "response": answer,
+            "score": score,
+            "original_query": question,
+            "repository_id": scope
+        }
+
+
+semantic_index = SemanticInstructionIndex()
+invalidation_bus.register("semantic_index", semantic_index.apply_remote, resync=semantic_index.load_liked)
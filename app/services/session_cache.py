@@ -0,0 +1,140 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.invalidation import invalidation_bus
+from app.core.redis import RedisClient
+
+logger = logging.getLogger(__name__)
+
+# Writes the state only if the session was not invalidated since the writer read its generation
+_SET_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+_INVALIDATE_SCRIPT = """
+redis.call('DEL', KEYS[1])
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return 1
+"""
+
+
+class SessionStateCache:
+    """
+    Per-session state the chat hot path needs: language and llm_config (which carries INSTRUCTION_REPO_ID).
+    In-process LRU in front of Redis. Only sessions past their "New Chat" auto-rename are cached, so a
+    hit never has to write the row. sessions.py invalidates on config changes, renames and deletes.
+
+    Every invalidation bumps the session's generation in Redis. Loaders read it before going to the
+    database and pass it to set(), which is dropped if an invalidation happened in between, so a
+    slow load can't put back the state an update just invalidated.
+    """
+
+    KEY_PREFIX = "session_state"
+
+    def __init__(self):
+        self._local: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # Invalidations seen by this worker, to drop a local write racing one
+        self._invalidations = 0
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.KEY_PREFIX}:{session_id}"
+
+    def _generation_key(self, session_id: str) -> str:
+        return f"{self.KEY_PREFIX}_generation:{session_id}"
+
+    async def generation(self, session_id: str) -> Optional[int]:
+        """The session's invalidation count, to read before loading its state. None if unavailable."""
+        if not settings.SESSION_CACHE_ENABLE:
+            return None
+        try:
+            return int(await RedisClient.get_instance().get(self._generation_key(str(session_id))) or 0)
+        except Exception as e:
+            logger.error(f"Session cache generation error: {e}")
+            return None
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        if not settings.SESSION_CACHE_ENABLE:
+            return None
+        session_id = str(session_id)
+        cached = self._local.get(session_id)
+        if cached is not None:
+            expires_at, state = cached
+            if expires_at > time.monotonic():
+                self._local.move_to_end(session_id)
+                return state
+            del self._local[session_id]
+
+        try:
+            raw = await RedisClient.get_instance().get(self._key(session_id))
+        except Exception as e:
+            logger.error(f"Session cache get error: {e}")
+            return None
+        if not raw:
+            return None
+        try:
+            state = json.loads(raw)
+        except ValueError:
+            return None
+        self._remember(session_id, state)
+        return state
+
+    async def set(self, session_id: str, llm_config: Dict[str, Any], language: str, generation: Optional[int]):
+        """Caches state loaded after reading `generation`; ignored if the session was invalidated since."""
+        if not settings.SESSION_CACHE_ENABLE or generation is None:
+            return
+        session_id = str(session_id)
+        state = {"llm_config": llm_config or {}, "language": language}
+        invalidations = self._invalidations
+        try:
+            stored = await RedisClient.get_instance().eval(
+                _SET_SCRIPT, 2, self._key(session_id), self._generation_key(session_id),
+                str(generation), json.dumps(state, ensure_ascii=False), settings.SESSION_CACHE_TTL_SECONDS
+            )
+        except Exception as e:
+            logger.error(f"Session cache set error: {e}")
+            return
+        if int(stored) and invalidations == self._invalidations:
+            self._remember(session_id, state)
+
+    async def invalidate(self, session_id: str):
+        """Drops the session's state here, in Redis and on the other workers."""
+        session_id = str(session_id)
+        self._invalidations += 1
+        self._local.pop(session_id, None)
+        try:
+            # The generation outlives any state written before it
+            await RedisClient.get_instance().eval(
+                _INVALIDATE_SCRIPT, 2, self._key(session_id), self._generation_key(session_id),
+                settings.SESSION_CACHE_TTL_SECONDS
+            )
+        except Exception as e:
+            logger.error(f"Session cache delete error: {e}")
+        await invalidation_bus.publish("session_state", None, {"session_id": session_id})
+
+    def _remember(self, session_id: str, state: Dict[str, Any]):
+        self._local[session_id] = (time.monotonic() + settings.SESSION_CACHE_LOCAL_TTL_SECONDS, state)
+        self._local.move_to_end(session_id)
+        while len(self._local) > settings.SESSION_CACHE_MAX_ENTRIES:
+            self._local.popitem(last=False)
+
+    async def apply_remote(self, payload: Dict[str, Any]):
+        self._invalidations += 1
+        self._local.pop(str(payload.get("session_id")), None)
+
+    async def resync(self):
+        # Missed invalidations: the local tier may be stale, Redis is not
+        self._invalidations += 1
+        self._local.clear()
+
+
+session_cache = SessionStateCache()
+invalidation_bus.register("session_state", session_cache.apply_remote, session_cache.resync)
@@ -8,6 +8,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import Select
 
 from app.core.config import settings
+from app.core.single_flight import single_flight
+from app.core.tracing import traced
 
 logger = logging.getLogger(__name__)
 
@@ -58,17 +60,21 @@ class VectorService:
         else:
             raise ValueError(f"Unsupported embedding provider '{provider}'")
 
+    @traced("embedding.query")
     async def embed_query(self, text: str, provider: str = None, model: str = None) -> List[float]:
         """Vectorize a single query string."""
         if not text:
             return []
         try:
             instance = self._get_embeddings_instance(provider, model)
-            return await instance.aembed_query(text)
+            # The same text is often embedded by several stages (and devices) at once
+            key = single_flight.key(provider or settings.EMBEDDING_PROVIDER, model or settings.EMBEDDING_MODEL, text)
+            return await single_flight.run("embedding", key, lambda: instance.aembed_query(text))
         except Exception as e:
             logger.error(f"Embedding generation failed: {e}")
             raise e
 
+    @traced("embedding.documents")
     async def embed_documents(self, texts: List[str], provider: str = None, model: str = None) -> List[List[float]]:
         """Vectorize a list of documents."""
         if not texts:
@@ -80,6 +86,7 @@ class VectorService:
             logger.error(f"Document embedding generation failed: {e}")
             raise e
 
+    @traced("vector.search")
     async def search(
         self, 
         db: AsyncSession, 
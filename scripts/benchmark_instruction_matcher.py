@@ -0,0 +1,47 @@
+import sys
+import os
+import time
+import uuid
+import random
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from app.services.instruction_matcher import InstructionMatcher
+
+VERBS = ["打开", "关闭", "调到", "设置", "切换到", "播放", "暂停", "导航去"]
+DEVICES = ["空调", "灯", "窗帘", "电视", "音箱", "风扇", "加湿器", "热水器", "冰箱", "扫地机"]
+
+
+def build_matcher(size: int, repo_id: uuid.UUID) -> InstructionMatcher:
+    """Builds a matcher with `size` distinct templates for one repository."""
+    matcher = InstructionMatcher()
+    rng = random.Random(42)
+    for i in range(size):
+        verb = rng.choice(VERBS)
+        device = rng.choice(DEVICES)
+        query = f"{device}{i}号{verb}{rng.randint(1, 99)}"
+        value = int(query.rsplit(verb, 1)[1])
+        matcher.add_instruction(query, {"name": f"{device}_{verb}", "parameters": {"value": value}}, repository_id=repo_id)
+    return matcher
+
+
+def bench(matcher: InstructionMatcher, queries, repo_id: uuid.UUID, rounds: int = 5) -> float:
+    """Returns mean microseconds per match."""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for q in queries:
+            matcher.match(q, repository_id=repo_id)
+    return (time.perf_counter() - start) / (rounds * len(queries)) * 1e6
+
+
+if __name__ == "__main__":
+    repo_id = uuid.uuid4()
+    queries = [f"空调{i}号调到37" for i in range(50)] + ["今天天气怎么样", "把音量调大一点"] * 25
+
+    print("=== InstructionMatcher latency (hits + misses) ===")
+    for size in (100, 1000, 10000, 100000):
+        matcher = build_matcher(size, repo_id)
+        hits = [t["original_query"] for t in matcher.templates[:100]]
+        print(f"templates={len(matcher.templates):>7}  mean={bench(matcher, queries, repo_id):8.1f} us/query"
+              f"  hits-only={bench(matcher, hits, repo_id):8.1f} us/query")
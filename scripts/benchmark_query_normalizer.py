@@ -0,0 +1,38 @@
+import sys
+import os
+import time
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from app.services.query_normalizer import normalize_query, normalize_query_spans
+
+QUERIES = [
+    "把音量调到50",                     # already normalized (fast path)
+    "音量调到三十七",
+    "音量调到３７。",
+    "请帮我把空调温度调到二十五点五度吧！",
+    "  open   the door , please ",
+    "Navigate to Berlin.",
+    "声音调大一点",
+    "导航去五道口",
+]
+
+
+def bench(fn, rounds: int = 20000) -> float:
+    """Returns mean microseconds per call over QUERIES."""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for q in QUERIES:
+            fn(q)
+    return (time.perf_counter() - start) / (rounds * len(QUERIES)) * 1e6
+
+
+if __name__ == "__main__":
+    print("=== Query normalization ===")
+    for q in QUERIES:
+        print(f"{q!r:45} -> {normalize_query(q)!r}")
+    print()
+    print(f"normalize_query        mean={bench(normalize_query):6.2f} us/query")
+    print(f"normalize_query_spans  mean={bench(normalize_query_spans):6.2f} us/query")
+    print(f"str.strip().lower()    mean={bench(lambda q: q.strip().lower()):6.2f} us/query  (previous cache key)")
@@ -0,0 +1,82 @@
+import sys
+import os
+import random
+import re
+import time
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from app.core.config import settings
+from app.services.instruction_matcher import InstructionMatcher
+
+WORDS = ["客厅", "卧室", "空调", "灯", "窗帘", "音乐", "北京", "上海", "明天", "会议", "提醒", "打开", "关闭"]
+GLUE = ["把", "和", "到", "在", "从", "经", "给"]
+
+
+def random_pair(rng: random.Random, slots: int):
+    """A question with `slots` text values separated by short literals, plus its answer."""
+    values = [rng.choice(WORDS) + str(i) for i in range(slots)]
+    parts = []
+    for value in values:
+        parts.append(rng.choice(GLUE))
+        parts.append(value)
+    parts.append("吧就好")
+    question = "".join(parts)
+    answer = {"name": f"cmd_{slots}", "parameters": {f"v{i}": v for i, v in enumerate(values)}}
+    return question, answer
+
+
+def near_miss(rng: random.Random, template, length: int) -> str:
+    """
+    Template head, then filler made of its own glue characters (every slot boundary can line up),
+    then a truncated tail: the worst case for backtracking, and never a match.
+    """
+    segments = template["static_segments"]
+    glue = [ch for seg in segments[1:-1] for ch in seg] + ["啊"]
+    filler = "".join(rng.choice(glue) for _ in range(length))
+    return segments[0] + filler + segments[-1][:-1]
+
+
+def legacy_pattern(question: str, answer) -> re.Pattern:
+    """The pre-bounded form of a template: every value a slot, each an unbounded lazy `.+?`."""
+    budget = settings.INSTRUCTION_TEMPLATE_MAX_COST
+    settings.INSTRUCTION_TEMPLATE_MAX_COST = float("inf")
+    try:
+        pattern = InstructionMatcher().generalize_instruction(question, answer)["pattern"]
+    finally:
+        settings.INSTRUCTION_TEMPLATE_MAX_COST = budget
+    return re.compile(re.sub(r"\.\{1,\d+\}\?", ".+?", pattern), re.IGNORECASE)
+
+
+def worst(fn, inputs, budget_s: float = 2.0) -> float:
+    """Max milliseconds per call over the inputs (stops early once the budget is spent)."""
+    worst_ms = 0.0
+    deadline = time.perf_counter() + budget_s
+    for q in inputs:
+        start = time.perf_counter()
+        fn(q)
+        worst_ms = max(worst_ms, (time.perf_counter() - start) * 1000)
+        if time.perf_counter() > deadline:
+            break
+    return worst_ms
+
+
+if __name__ == "__main__":
+    rng = random.Random(7)
+    print("=== Instruction matcher fuzz: worst-case match time on near-miss inputs ===")
+    print(f"{'values':>6} {'length':>6} {'cost':>10} {'legacy .+? ms':>14} {'bounded ms':>11} {'match() ms':>11}")
+    for slots in (1, 2, 3, 4):
+        matcher = InstructionMatcher()
+        question, answer = random_pair(rng, slots)
+        matcher.add_instruction(question, answer)
+        template = matcher.templates[0]
+        legacy = legacy_pattern(question, answer)
+        bounded = re.compile(template["pattern"], re.IGNORECASE)
+        for length in (20, 60, 200):
+            inputs = [near_miss(rng, template, length) for _ in range(50)]
+            print(
+                f"{slots:>6} {length:>6} {template['cost']:>10} "
+                f"{worst(legacy.match, inputs):>14.3f} {worst(bounded.match, inputs):>11.3f} "
+                f"{worst(matcher.match, inputs):>11.3f}"
+            )
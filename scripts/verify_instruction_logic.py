@@ -23,7 +23,7 @@ async def verify():
 
         # 2. Initialize Matcher (Seeds DB from JSON, then loads from DB)
         print("\n[Step 2] Initializing Matcher (Seeding DB from Defaults + Loading)...")
-        await matcher_service.reload(db)
+        await matcher_service.reload()
         
         # Verify DB is populated
         result = await db.execute(select(BenchmarkCase))
@@ -0,0 +1,65 @@
+import json
+
+from app.core.config import settings
+from app.services.context_assembler import ContextAssembler, ContextItem, _ApproxEncoding
+
+
+def _assembler():
+    assembler = ContextAssembler()
+    # Deterministic counts without fetching BPE files
+    assembler._encodings["cl100k_base"] = _ApproxEncoding()
+    return assembler
+
+
+def test_budget_split_by_priority_with_truncation(monkeypatch):
+    monkeypatch.setattr(settings, "CONTEXT_MODEL_BUDGETS", {"small": 1400})
+    monkeypatch.setattr(settings, "CONTEXT_RESPONSE_RESERVE_TOKENS", 400)
+    assembler = _assembler()
+    assert assembler.budget("small-model") == 1000
+    assert assembler.budget("other") == settings.CONTEXT_DEFAULT_BUDGET_TOKENS - 400
+
+    chunks = [{"id": i, "score": 1 - i / 10, "content": "段落" * 200} for i in range(5)]
+    history = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"消息{i}" * 30} for i in range(10)]
+    memory = [{"role": "user", "content": "以前的对话" * 40} for _ in range(3)]
+
+    assembled = assembler.assemble(
+        "small-model", lambda context: f"Answer from context:\n{context}", "今天天气怎么样",
+        history, memory,
+        retrieved=[ContextItem.json(chunk) for chunk in chunks],
+        render_retrieved=lambda items: "[" + ", ".join(items) + "]"
+    )
+    report = assembled.report
+    assert report["total"] <= 1000
+    assert report["retrieved"] > report["history"] > 0
+
+    # Best chunks first, the last kept one cut short but still valid JSON
+    context = json.loads(assembled.system_prompt.split("Answer from context:\n", 1)[1])
+    assert [c["id"] for c in context] == [0, 1] and report["dropped"]["retrieved"] == 3
+    assert context[-1]["content"].endswith("…")
+
+    # Newest history kept, in chronological order
+    assert assembled.history == history[-len(assembled.history):]
+    assert report["dropped"]["history"] > 0
+
+
+def test_small_prompts_are_sent_unchanged():
+    assembler = _assembler()
+    history = [{"role": "user", "content": "你好"}, {"role": "assistant", "content": "你好！"}]
+    memory = [{"role": "assistant", "content": "上次我们聊了音乐"}]
+    assembled = assembler.assemble("gpt-4o", lambda context: "You are helpful.", "推荐首歌", history, memory)
+
+    assert assembled.history == history
+    assert assembled.system_prompt == (
+        "Relevant Past Conversation:\n[Assistant]: 上次我们聊了音乐\n\nEnd of Relevant Past Conversation.\n\nYou are helpful."
+    )
+    assert assembled.report["dropped"] == {"retrieved": 0, "history": 0, "memory": 0}
+    assert assembled.report["memory"] > 0 and assembled.report["retrieved"] == 0
+
+
+def test_warm_up_loads_configured_model_encodings(monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_LLM_MODEL", "qwen-max")
+    assembler = _assembler()
+    assembler.warm_up()
+    # Models are resolved ahead of traffic, so requests never load an encoding themselves
+    assert {settings.DEFAULT_LLM_MODEL, "qwen-max"} <= set(assembler._tokenizers)
+    assert assembler.tokenizer("qwen-max").encoding is assembler._encodings["cl100k_base"]
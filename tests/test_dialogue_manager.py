@@ -0,0 +1,193 @@
+import asyncio
+import uuid
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from app.services.dialogue_manager import DialogueManager
+from app.services.intent_cache import intent_cache
+from app.services.session_cache import session_cache
+
+
+@pytest.mark.asyncio
+async def test_instruction_fastpath_skips_router_llm():
+    dm = DialogueManager()
+    repo_id = uuid.uuid4()
+    save_started = asyncio.Event()
+    release_save = asyncio.Event()
+
+    async def slow_save(*args, **kwargs):
+        save_started.set()
+        await release_save.wait()
+        return "user-msg-id"
+
+    mock_memory = AsyncMock()
+    mock_memory.get_short_term_memory.return_value = []
+    mock_memory.save_message.side_effect = slow_save
+
+    matched = {
+        "template_pattern": "^把音量调到(?P<p_0>\\d{1,9}(?:\\.\\d{1,4})?)$",
+        "result": {"name": "volume_set", "parameters": {"value": 30}},
+        "original_query": "把音量调到50"
+    }
+
+    with patch("app.services.dialogue_manager.MemoryManager", return_value=mock_memory), \
+         patch("app.services.dialogue_manager.RAGEngine"), \
+         patch("app.services.dialogue_manager.LLMFactory") as MockLLMFactory, \
+         patch("app.services.dialogue_manager.matcher_service") as mock_matcher, \
+         patch("app.services.dialogue_manager.FeedbackService") as MockFeedback, \
+         patch.object(dm, "_load_session", AsyncMock(return_value=({"INSTRUCTION_REPO_ID": str(repo_id)}, "zh"))), \
+         patch.object(dm, "_route_intent", AsyncMock()) as route_intent:
+        mock_matcher.match.return_value = matched
+        MockFeedback.return_value.increment_hit_count = AsyncMock()
+
+        chunks = []
+        generator = dm.stream_process_request(str(uuid.uuid4()), "把音量调到30", "user_1", AsyncMock())
+        chunks.append(await generator.__anext__())
+        # Answered without waiting for the user message save, which is still in flight
+        assert chunks[0] == '{"name": "volume_set", "parameters": {"value": 30}}'
+        await asyncio.wait_for(save_started.wait(), timeout=1)
+
+        release_save.set()
+        async for chunk in generator:
+            chunks.append(chunk)
+
+    metadata = chunks[-1]["metadata"]
+    assert metadata["route"] == "instruction_fastpath"
+    assert metadata["hit_source"] == "memory"
+    assert metadata["reply_to"] == "user-msg-id"
+    assert chunks[-1]["actions"][0]["payload"] == matched["result"]
+    MockLLMFactory.create_llm.return_value.ainvoke.assert_not_called()
+    # Not even started and cancelled: routing only begins after the fast path misses
+    route_intent.assert_not_called()
+    mock_memory.get_relevant_mid_term_memory.assert_not_called()
+    mock_matcher.match.assert_called_once_with("把音量调到30", repository_id=repo_id)
+
+
+@pytest.mark.asyncio
+async def test_route_intent_cached_across_requests():
+    dm = DialogueManager()
+    redis = AsyncMock()
+    redis.get.return_value = None
+    router_llm = MagicMock()
+    router_llm.ainvoke = AsyncMock(return_value=MagicMock(content="instruction"))
+
+    with patch("app.services.dialogue_manager.LLMFactory") as MockLLMFactory, \
+         patch("app.services.intent_cache.RedisClient.get_instance", return_value=redis):
+        MockLLMFactory.create_llm.return_value = router_llm
+        intent_cache.clear()
+
+        first = await dm._route_intent(None, "打开空调", [], language="zh")
+        # Same utterance after normalization: answered from the in-process tier
+        second = await dm._route_intent(None, "打开空调！", [], language="zh")
+        # RAG-enabled sessions route over a different intent list, so they don't share the entry
+        await dm._route_intent(None, "打开空调", [], session_config={"RAG_ENABLE": True}, language="zh")
+
+    assert first[0] == second[0] == "instruction"
+    assert first[3] is None
+    assert second[3]["tier"] == "memory"
+    assert router_llm.ainvoke.await_count == 2
+    redis.set.assert_awaited()
+
+
+def _session_redis():
+    """Dict-backed Redis with the session cache's two scripts."""
+    from app.services import session_cache as module
+    store = {}
+
+    async def run_script(script, numkeys, state_key, generation_key, *args):
+        if script == module._SET_SCRIPT:
+            if str(store.get(generation_key, "0")) != args[0]:
+                return 0
+            store[state_key] = args[1]
+        else:
+            store.pop(state_key, None)
+            store[generation_key] = int(store.get(generation_key, 0)) + 1
+        return 1
+
+    redis = AsyncMock()
+    redis.get.side_effect = lambda key: store.get(key)
+    redis.eval.side_effect = run_script
+    return redis
+
+
+@pytest.mark.asyncio
+async def test_session_state_served_from_cache_until_invalidated():
+    dm = DialogueManager()
+    session_id = str(uuid.uuid4())
+    redis = _session_redis()
+    session_row = MagicMock(language="en", context={"llm_config": {"INSTRUCTION_REPO_ID": "r1"}})
+    session_row.name = "Thermostat"
+    db = AsyncMock()
+    db.execute.return_value = MagicMock(scalar_one_or_none=MagicMock(return_value=session_row))
+
+    with patch("app.services.session_cache.RedisClient.get_instance", return_value=redis), \
+         patch("app.services.session_cache.invalidation_bus.publish", AsyncMock()) as publish:
+        first = await dm._load_session(db, session_id, "hi", "user_1", False, "t")
+        second = await dm._load_session(db, session_id, "hi", "user_1", False, "t")
+        assert first == second == ({"INSTRUCTION_REPO_ID": "r1"}, "en")
+        assert db.execute.await_count == 1
+
+        await session_cache.invalidate(session_id)
+        publish.assert_awaited_once_with("session_state", None, {"session_id": session_id})
+        await dm._load_session(db, session_id, "hi", "user_1", False, "t")
+        assert db.execute.await_count == 2
+
+        # A config update landing while a load reads the old row: the load's set() is dropped
+        await session_cache.invalidate(session_id)
+
+        async def execute_racing_update(*args, **kwargs):
+            await session_cache.invalidate(session_id)
+            return MagicMock(scalar_one_or_none=MagicMock(return_value=session_row))
+
+        db.execute.side_effect = execute_racing_update
+        await dm._load_session(db, session_id, "hi", "user_1", False, "t")
+        assert await session_cache.get(session_id) is None
+
+
+@pytest.mark.asyncio
+async def test_chat_answer_replayed_from_semantic_response_cache(monkeypatch):
+    from app.core.config import settings
+    from app.services.response_cache import ResponseCache
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_ENABLE", True)
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_REPLAY_CHUNK_CHARS", 4)
+    dm = DialogueManager()
+    cache = ResponseCache()
+    embeddings = {"什么是量子计算？": [1.0, 0.0, 0.0], "量子计算是什么": [0.99, 0.1, 0.0], "讲讲2024年的量子计算": [0.99, 0.1, 0.0]}
+
+    async def astream(messages):
+        for piece in ["量子计算", "利用量子比特", "进行计算。"]:
+            yield MagicMock(content=piece)
+
+    llm = MagicMock()
+    llm.astream = MagicMock(side_effect=astream)
+    mock_memory = AsyncMock()
+    mock_memory.get_short_term_memory.return_value = []
+    mock_memory.save_message.return_value = "msg-id"
+
+    async def run(query):
+        chunks = [chunk async for chunk in dm.stream_process_request(str(uuid.uuid4()), query, "user_1", AsyncMock())]
+        return "".join(c for c in chunks if isinstance(c, str)), chunks[-1]["metadata"], len(chunks) - 1
+
+    with patch("app.services.dialogue_manager.response_cache", cache), \
+         patch("app.services.dialogue_manager.MemoryManager", return_value=mock_memory), \
+         patch("app.services.dialogue_manager.RAGEngine"), \
+         patch("app.services.dialogue_manager.LLMFactory") as MockLLMFactory, \
+         patch("app.services.response_cache.vector_service.embed_query", AsyncMock(side_effect=lambda q: embeddings[q])), \
+         patch("app.services.response_cache.RedisClient.get_instance", return_value=AsyncMock()), \
+         patch("app.services.response_cache.invalidation_bus.publish", AsyncMock()), \
+         patch.object(dm, "_load_session", AsyncMock(return_value=({}, "zh"))), \
+         patch.object(dm, "_load_mid_term_memory", AsyncMock(return_value=[])), \
+         patch.object(dm, "_route_intent", AsyncMock(return_value=("chat", 120, "router", None))):
+        MockLLMFactory.get_llm_for_scenario.return_value = llm
+
+        answer, metadata, _ = await run("什么是量子计算？")
+        assert metadata.get("hit_source") is None
+
+        cached_answer, metadata, pieces = await run("量子计算是什么")
+        assert cached_answer == answer and pieces == 4
+        assert metadata["hit_source"] == "semantic_cache"
+        assert metadata["response_cache"]["cached_query"] == "什么是量子计算？"
+        assert llm.astream.call_count == 1
+
+        # Same meaning but a number the cached question does not have: regenerated
+        _, metadata, _ = await run("讲讲2024年的量子计算")
+        assert metadata.get("hit_source") is None and llm.astream.call_count == 2
@@ -0,0 +1,90 @@
+import json
+import uuid
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from app.services.instruction_catalog import InstructionCatalog
+
+
+@pytest.mark.asyncio
+async def test_catalog_cached_per_repository_version():
+    catalog = InstructionCatalog()
+    user_id, repo_a, repo_b = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    rows = [SimpleNamespace(name="volume_set", description="设置音量", parameters={"value": {"type": "integer"}})]
+    load = AsyncMock(return_value=rows)
+
+    with patch("app.services.instruction_catalog.InstructionService.get_all_instructions", load), \
+         patch("app.services.instruction_catalog.invalidation_bus.publish", AsyncMock()) as publish:
+        first = await catalog.get(None, user_id, repo_a)
+        assert await catalog.get(None, user_id, repo_a) is first
+        await catalog.get(None, user_id, repo_b)
+        assert load.await_count == 2
+
+        # Compact: no indentation or separator padding
+        assert "\n" not in first and ", " not in first
+        assert json.loads(first) == [{"name": "volume_set", "description": "设置音量", "parameters": {"value": {"type": "integer"}}}]
+
+        await catalog.invalidate(repo_a)
+        publish.assert_awaited_once()
+        await catalog.get(None, user_id, repo_a)
+        await catalog.get(None, user_id, repo_b)
+        assert load.await_count == 3
+
+        # Another worker imported into repo_b
+        await catalog.apply_remote({"repository_id": str(repo_b)})
+        await catalog.get(None, user_id, repo_b)
+        assert load.await_count == 4
+
+
+@pytest.mark.asyncio
+async def test_preselects_relevant_instructions_for_large_repositories(monkeypatch):
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "INSTRUCTION_PRESELECT_EMBEDDINGS", False)
+    catalog = InstructionCatalog()
+    devices = ["空调", "电视", "窗帘", "冰箱", "风扇", "灯光", "音箱", "热水器", "洗衣机", "烤箱"]
+    rows = [SimpleNamespace(name=f"{action}_{i}", description=f"{verb}{device}", parameters={})
+            for i, device in enumerate(devices)
+            for action, verb in (("open", "打开"), ("close", "关闭"), ("status", "查询状态"), ("timer", "定时"))]
+    rows.append(SimpleNamespace(name="ac_mode", description="设置空调模式", parameters={
+        "type": "object", "properties": {"mode": {"type": "string", "enum": ["制冷", "制热", "除湿"]}}
+    }))
+
+    with patch("app.services.instruction_catalog.InstructionService.get_all_instructions", AsyncMock(return_value=rows)):
+        selected, info = await catalog.select(None, uuid.uuid4(), uuid.uuid4(), "把空调调成制冷")
+        names = [item["name"] for item in json.loads(selected)]
+        assert info["mode"] == "keyword" and info["total"] == 41 and len(names) == 15
+        assert "ac_mode" in names and "open_0" in names
+
+        # Nothing in the catalogue resembles the query: the executor sees everything
+        everything, info = await catalog.select(None, uuid.uuid4(), uuid.uuid4(), "讲个笑话")
+        assert info["mode"] == "full_low_confidence"
+        assert len(json.loads(everything)) == 41
+
+
+@pytest.mark.asyncio
+async def test_failed_catalogue_embedding_is_retried(monkeypatch):
+    import asyncio
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "INSTRUCTION_PRESELECT_EMBEDDINGS", True)
+    monkeypatch.setattr(settings, "INSTRUCTION_PRESELECT_TOP_K", 2)
+    monkeypatch.setattr(InstructionCatalog, "EMBED_RETRY_SECONDS", 0.0)
+    catalog = InstructionCatalog()
+    rows = [SimpleNamespace(name=name, description=desc, parameters={})
+            for name, desc in (("ac_on", "打开空调"), ("tv_on", "打开电视"), ("light_on", "打开灯光"))]
+    embed_documents = AsyncMock(side_effect=[RuntimeError("embedding provider down"), [[1.0, 0.0], [0.0, 1.0], [0.6, 0.8]]])
+    user_id, repo_id = uuid.uuid4(), uuid.uuid4()
+
+    with patch("app.services.instruction_catalog.InstructionService.get_all_instructions", AsyncMock(return_value=rows)), \
+         patch("app.services.instruction_catalog.vector_service.embed_documents", embed_documents), \
+         patch("app.services.instruction_catalog.vector_service.embed_query", AsyncMock(return_value=[1.0, 0.0])):
+        _, info = await catalog.select(None, user_id, repo_id, "打开空调")
+        assert info["mode"] == "keyword"
+        await asyncio.sleep(0)  # The first embedding attempt fails in the background
+
+        # The next selection tries again instead of staying keyword-only for this version
+        await catalog.select(None, user_id, repo_id, "打开空调")
+        await asyncio.sleep(0)
+        _, info = await catalog.select(None, user_id, repo_id, "打开空调")
+        assert info["mode"] == "hybrid"
+        assert embed_documents.await_count == 2
@@ -0,0 +1,481 @@
+import asyncio
+import json
+import uuid
+from datetime import datetime
+import pytest
+from unittest.mock import MagicMock
+from app.core.config import settings
+from app.core.invalidation import InvalidationBus
+from app.services.instruction_matcher import InstructionMatcher, InstructionMatcherService, build_slot_enums
+
+
+def test_generalized_number_slot():
+    matcher = InstructionMatcher()
+    matcher.add_instruction("把音量调到50", {"name": "volume_set", "parameters": {"value": 50}})
+
+    result = matcher.match("把音量调到37")
+    assert result is not None
+    assert result["result"] == {"name": "volume_set", "parameters": {"value": 37}}
+    assert matcher.match("把亮度调到37") is None
+
+
+def test_repository_isolation_and_globals():
+    matcher = InstructionMatcher()
+    repo_a = uuid.uuid4()
+    repo_b = uuid.uuid4()
+    matcher.add_instruction("open the door", {"name": "door_open"}, repository_id=repo_a)
+    matcher.add_instruction("Navigate to Paris", {"name": "nav", "parameters": {"destination": "Paris"}})
+
+    assert matcher.match("OPEN THE DOOR", repository_id=repo_a)["result"] == {"name": "door_open"}
+    assert matcher.match("open the door", repository_id=repo_b) is None
+    assert matcher.match("open the door") is None
+
+    # Global templates apply to every repository
+    result = matcher.match("navigate to Berlin", repository_id=repo_b)
+    assert result["result"]["parameters"]["destination"] == "Berlin"
+
+
+def test_prefilter_handles_leading_and_unanchored_slots():
+    matcher = InstructionMatcher()
+    matcher.add_instruction("50分音量", {"name": "volume_set", "parameters": {"value": 50}})
+    matcher.add_instruction("Paris", {"name": "nav", "parameters": {"destination": "Paris"}})
+
+    assert matcher.match("80分音量")["result"]["parameters"]["value"] == 80
+    # Template made only of a slot still matches through the unanchored bucket
+    assert matcher.match("London")["result"]["parameters"]["destination"] == "London"
+
+
+def test_priority_follows_insertion_order():
+    matcher = InstructionMatcher()
+    repo_id = uuid.uuid4()
+    matcher.add_instruction("play jazz", {"name": "play", "parameters": {"genre": "jazz"}})
+    matcher.add_instruction("play jazz", {"name": "play_exact"}, repository_id=repo_id)
+
+    # The global template was added first, so it wins even for the repository
+    assert matcher.match("play jazz", repository_id=repo_id)["result"]["name"] == "play"
+
+
+def test_duplicate_patterns_are_skipped():
+    matcher = InstructionMatcher()
+    matcher.add_instruction("音量设为30", {"name": "volume_set", "parameters": {"value": 30}})
+    matcher.add_instruction("音量设为70", {"name": "volume_set", "parameters": {"value": 70}})
+    assert len(matcher.templates) == 1
+
+
+class _FakeResult:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def scalar(self):
+        return True
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self._rows
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for row in self._rows:
+            yield row
+
+
+class _FakeDB:
+    """
+    Async session stand-in over a list of live cases: execute() serves the defaults check and
+    id lookups, stream() serves full rows or (id, updated_at) listings.
+    """
+    def __init__(self, cases, gate=None):
+        self.cases = cases
+        self.gate = gate
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, stmt):
+        if stmt.whereclause is not None and hasattr(stmt.whereclause.right, "value"):
+            wanted = set(stmt.whereclause.right.value)
+            return _FakeResult([c for c in self.cases if c.id in wanted])
+        return _FakeResult([])
+
+    async def stream(self, stmt):
+        if self.gate is not None:
+            await self.gate.wait()
+        if stmt.column_descriptions[0]["name"] == "id":
+            return _FakeResult([(c.id, c.updated_at) for c in self.cases])
+        return _FakeResult(list(self.cases))
+
+
+def _case(question, answer, repository_id=None):
+    case = MagicMock()
+    case.id = uuid.uuid4()
+    case.question = question
+    case.answer = json.dumps(answer, ensure_ascii=False)
+    case.repository_id = repository_id
+    case.updated_at = datetime(2024, 1, 1)
+    return case
+
+
+@pytest.mark.asyncio
+async def test_reload_swaps_atomically_and_collapses_requests(tmp_path):
+    service = InstructionMatcherService()
+    original_factory = service.session_factory
+    original_matcher = service.matcher
+    original_snapshot = service.snapshot_path
+    service.snapshot_path = str(tmp_path / "matcher.snapshot")
+    try:
+        rows = [_case("音量设为30", {"name": "volume_set", "parameters": {"value": 30}})]
+        gate = asyncio.Event()
+        builds = []
+
+        def factory():
+            builds.append(1)
+            return _FakeDB(rows, gate)
+
+        service.session_factory = factory
+        service.matcher = InstructionMatcher()
+        service.matcher.add_instruction("打开空调", {"name": "ac_on"})
+
+        first = asyncio.create_task(service.reload())
+        for _ in range(3):
+            await asyncio.sleep(0)
+        # While the rebuild waits on the DB, live traffic still sees the old templates
+        assert service.match("打开空调") is not None
+
+        # Requests arriving mid-rebuild collapse into a single follow-up rebuild
+        followers = [asyncio.create_task(service.reload()) for _ in range(4)]
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(first, *followers)
+
+        assert service.match("打开空调") is None
+        assert service.match("音量设为55")["result"]["parameters"]["value"] == 55
+        assert len(builds) == 2
+    finally:
+        service.session_factory = original_factory
+        service.matcher = original_matcher
+        service.snapshot_path = original_snapshot
+
+
+@pytest.mark.asyncio
+async def test_warm_start_replays_changes_since_snapshot(tmp_path, monkeypatch):
+    service = InstructionMatcherService()
+    original_factory = service.session_factory
+    original_matcher = service.matcher
+    original_snapshot = service.snapshot_path
+    service.snapshot_path = str(tmp_path / "matcher.snapshot")
+    try:
+        kept = _case("打开空调", {"name": "ac_on"})
+        edited = _case("关闭空调", {"name": "ac_off"})
+        dropped = _case("播放音乐", {"name": "music_play"})
+        cases = [kept, edited, dropped]
+        service.session_factory = lambda: _FakeDB(cases)
+        await service.reload()
+
+        # Changes made while this worker was down
+        edited.question = "关掉空调"
+        edited.updated_at = datetime(2024, 2, 1)
+        added = _case("打开窗帘", {"name": "curtain_open"})
+        added.updated_at = datetime(2023, 1, 1)  # Newly live (e.g. version switch) despite an old timestamp
+        cases[:] = [kept, edited, added]
+
+        service.matcher = InstructionMatcher()
+
+        async def no_rebuild():
+            raise AssertionError("warm start fell back to a full rebuild")
+
+        monkeypatch.setattr(service, "_rebuild", no_rebuild)
+        await service.reload(warm=True)
+
+        assert service.match("打开空调")["result"] == {"name": "ac_on"}
+        assert service.match("关掉空调")["result"] == {"name": "ac_off"}
+        assert service.match("关闭空调") is None
+        assert service.match("播放音乐") is None
+        assert service.match("打开窗帘")["result"] == {"name": "curtain_open"}
+    finally:
+        service.session_factory = original_factory
+        service.matcher = original_matcher
+        service.snapshot_path = original_snapshot
+
+
+@pytest.mark.asyncio
+async def test_warm_start_rejects_unsigned_or_tampered_snapshot(tmp_path, monkeypatch):
+    import pickle
+    service = InstructionMatcherService()
+    original_factory = service.session_factory
+    original_matcher = service.matcher
+    original_snapshot = service.snapshot_path
+    service.snapshot_path = str(tmp_path / "matcher.snapshot")
+    try:
+        cases = [_case("打开空调", {"name": "ac_on"})]
+        service.session_factory = lambda: _FakeDB(cases)
+        await service.reload()
+        signed = (tmp_path / "matcher.snapshot").read_bytes()
+        assert (await service._read_snapshot())["state"]["templates"]
+
+        rebuilds = []
+
+        async def rebuild():
+            rebuilds.append(1)
+
+        monkeypatch.setattr(service, "_rebuild", rebuild)
+        tampered = signed.replace("ac_on".encode(), "ac_xx".encode())
+        for content in (tampered, pickle.dumps({"format": service.SNAPSHOT_FORMAT})):
+            (tmp_path / "matcher.snapshot").write_bytes(content)
+            assert await service._read_snapshot() is None
+            await service.reload(warm=True)
+        assert len(rebuilds) == 2
+    finally:
+        service.session_factory = original_factory
+        service.matcher = original_matcher
+        service.snapshot_path = original_snapshot
+
+
+def test_case_deltas_add_replace_remove():
+    matcher = InstructionMatcher()
+    repo_id = uuid.uuid4()
+    case_a, case_b = uuid.uuid4(), uuid.uuid4()
+
+    matcher.add_instruction("打开空调", {"name": "ac_on"}, repository_id=repo_id, case_id=case_a)
+    # Same pattern from another case is deduplicated but still tracked
+    matcher.add_instruction("打开空调", {"name": "ac_power_on"}, repository_id=repo_id, case_id=case_b)
+    assert len(matcher.templates) == 1
+    assert matcher.match("打开空调", repository_id=repo_id)["result"] == {"name": "ac_on"}
+
+    # Removing the first owner hands the template over to the remaining one
+    assert matcher.remove_case(case_a)
+    assert matcher.match("打开空调", repository_id=repo_id)["result"] == {"name": "ac_power_on"}
+
+    # Re-adding a known case id replaces its template
+    matcher.add_instruction("关闭空调", {"name": "ac_off"}, repository_id=repo_id, case_id=case_b)
+    assert matcher.match("打开空调", repository_id=repo_id) is None
+    assert matcher.match("关闭空调", repository_id=repo_id)["result"] == {"name": "ac_off"}
+
+    assert matcher.remove_case(case_b)
+    assert not matcher.remove_case(case_b)
+    assert matcher.templates == []
+    assert matcher.match("关闭空调", repository_id=repo_id) is None
+
+
+@pytest.mark.asyncio
+async def test_service_replace_case_respects_active_version(monkeypatch):
+    monkeypatch.setattr(settings, "INVALIDATION_BUS_ENABLE", False)
+    service = InstructionMatcherService()
+    original_matcher = service.matcher
+    try:
+        service.matcher = InstructionMatcher()
+        case = _case("播放音乐", {"name": "music_play"}, repository_id=uuid.uuid4())
+        case.source = "system"
+        case.version = 2
+
+        await service.replace_case(case, active_version=2)
+        assert service.match("播放音乐", repository_id=case.repository_id) is not None
+
+        await service.replace_case(case, active_version=3)
+        assert service.match("播放音乐", repository_id=case.repository_id) is None
+    finally:
+        service.matcher = original_matcher
+
+
+@pytest.mark.asyncio
+async def test_invalidation_bus_dispatch_and_gap_resync():
+    bus = InvalidationBus()
+    applied, resyncs = [], []
+
+    async def handler(payload):
+        applied.append(payload)
+
+    async def resync():
+        resyncs.append(1)
+
+    bus.register("matcher", handler, resync=resync)
+
+    def message(version, origin, payload):
+        return f"{version}|" + json.dumps({"topic": "matcher", "scope": "global", "origin": origin, "payload": payload})
+
+    await bus._dispatch(message(1, "other", {"op": "cases"}))
+    # Own events were already applied locally; duplicates are ignored
+    await bus._dispatch(message(2, bus.worker_id, {"op": "own"}))
+    await bus._dispatch(message(2, "other", {"op": "dup"}))
+    assert applied == [{"op": "cases"}]
+    assert resyncs == []
+
+    # A missed version triggers a full resync instead of applying the event
+    await bus._dispatch(message(5, "other", {"op": "cases"}))
+    assert applied == [{"op": "cases"}]
+    assert resyncs == [1]
+
+
+def test_fill_plan_converts_slots_and_returns_fresh_results():
+    matcher = InstructionMatcher()
+    matcher.add_instruction(
+        "set kitchen light to 40 for 2.5 hours",
+        {"name": "light", "parameters": {"room": "kitchen", "level": 40, "duration": 2.5, "tags": ["kitchen", True]}}
+    )
+
+    result = matcher.match("set 12 light to 75 for 3 hours")["result"]
+    # String slots still infer numbers, number slots keep int/float; only the first matching leaf is a slot
+    assert result == {"name": "light", "parameters": {"room": 12, "level": 75, "duration": 3, "tags": ["kitchen", True]}}
+
+    result["parameters"]["tags"].append("mutated")
+    again = matcher.match("set hall light to 10 for 1.5 hours")["result"]
+    assert again["parameters"] == {"room": "hall", "level": 10, "duration": 1.5, "tags": ["kitchen", True]}
+
+
+def test_normalized_queries_hit_templates():
+    matcher = InstructionMatcher()
+    matcher.add_instruction("把音量调到50", {"name": "volume_set", "parameters": {"value": 50}})
+    matcher.add_instruction("Navigate to Paris", {"name": "nav", "parameters": {"destination": "Paris"}})
+    matcher.add_instruction("导航去三里屯", {"name": "nav", "parameters": {"destination": "三里屯"}})
+
+    for query in ("把音量调到三十七。", "请把音量调到３７", "帮我把音量 调到37吧"):
+        assert matcher.match(query)["result"]["parameters"]["value"] == 37
+
+    # String slots keep the user's wording (width-folded), not the normalized digits
+    assert matcher.match("please navigate to Ｂｅｒｌｉｎ！")["result"]["parameters"]["destination"] == "Berlin"
+    assert matcher.match("导航去五道口")["result"]["parameters"]["destination"] == "五道口"
+
+
+def test_prune_drops_subsumed_templates_and_revives_them():
+    matcher = InstructionMatcher()
+    repo_id = uuid.uuid4()
+    general, literal, earlier = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    matcher.add_instruction("打开卧室灯", {"name": "light_on"}, repository_id=repo_id, case_id=earlier)
+    matcher.add_instruction("打开客厅", {"name": "open", "parameters": {"target": "客厅"}}, repository_id=repo_id, case_id=general)
+    # Never the first match: "打开(?P<p_0>.{1,32}?)" already accepts it
+    matcher.add_instruction("打开窗帘", {"name": "curtain_open"}, repository_id=repo_id, case_id=literal)
+
+    report = matcher.prune()
+    assert report["subsumed"] == 1
+    assert report["templates_before"] == 3 and report["templates_after"] == 2
+    # Higher-priority specific templates stay; results are unchanged
+    assert matcher.match("打开卧室灯", repository_id=repo_id)["result"] == {"name": "light_on"}
+    assert matcher.match("打开窗帘", repository_id=repo_id)["result"]["parameters"]["target"] == "窗帘"
+
+    # Removing the covering template brings the pruned one back
+    matcher.remove_case(general)
+    assert matcher.match("打开窗帘", repository_id=repo_id)["result"] == {"name": "curtain_open"}
+
+    # Pruned state survives a snapshot round trip
+    matcher.add_instruction("打开客厅", {"name": "open", "parameters": {"target": "客厅"}}, repository_id=repo_id, case_id=general)
+    matcher.add_instruction("打开电视", {"name": "tv_on"}, repository_id=repo_id, case_id=uuid.uuid4())
+    matcher.prune()
+    restored = InstructionMatcher.from_state(matcher.export_state())
+    assert len(restored.templates) == len(matcher.templates)
+    restored.remove_case(general)
+    assert restored.match("打开电视", repository_id=repo_id)["result"] == {"name": "tv_on"}
+
+
+def test_readding_a_pruned_pattern_merges_into_it():
+    matcher = InstructionMatcher()
+    repo_id = uuid.uuid4()
+    general, first, second = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    matcher.add_instruction("打开客厅", {"name": "open", "parameters": {"target": "客厅"}}, repository_id=repo_id, case_id=general)
+    matcher.add_instruction("打开窗帘", {"name": "curtain_open"}, repository_id=repo_id, case_id=first)
+    assert matcher.prune()["subsumed"] == 1
+
+    # Same pattern again while pruned: merged into the pruned template, not indexed twice
+    matcher.add_instruction("打开窗帘", {"name": "curtain_open"}, repository_id=repo_id, case_id=second)
+    assert len(matcher.templates) == 1
+
+    matcher.remove_case(general)
+    index = matcher._indexes[repo_id]
+    assert len(index.literals["打开窗帘"]) == 1
+    assert matcher.match("打开窗帘", repository_id=repo_id)["result"] == {"name": "curtain_open"}
+
+    # Both cases own it: it goes with the last one
+    matcher.remove_case(first)
+    assert matcher.match("打开窗帘", repository_id=repo_id)["result"] == {"name": "curtain_open"}
+    matcher.remove_case(second)
+    assert matcher.match("打开窗帘", repository_id=repo_id) is None
+    assert repo_id not in matcher._indexes
+
+
+def test_bounded_and_enum_slots():
+    matcher = InstructionMatcher()
+    matcher.slot_enums = build_slot_enums([
+        (None, "cook", {"type": "object", "properties": {
+            "firepower": {"type": "string", "enum": ["小火", "中火", "大火"]},
+            "timeout": {"type": "string", "enum": ["15 秒", "30 秒"]}
+        }})
+    ])
+    matcher.add_instruction("大火定时15秒", {"name": "cook", "parameters": {"firepower": "大火", "timeout": "15 秒"}})
+    matcher.add_instruction("导航去五道口", {"name": "nav", "parameters": {"destination": "五道口"}})
+
+    # Enum slots only accept declared values and return them as declared
+    assert matcher.match("小火定时30秒")["result"]["parameters"] == {"firepower": "小火", "timeout": "30 秒"}
+    assert matcher.match("猛火定时30秒") is None
+
+    # Text slots are length bounded, so overlong near-misses never reach the regex
+    assert matcher.match("导航去" + "远" * 32)["result"]["parameters"]["destination"] == "远" * 32
+    assert matcher.match("导航去" + "远" * 33) is None
+    assert all(t["cost"] <= settings.INSTRUCTION_TEMPLATE_MAX_COST for t in matcher.templates)
+
+
+def test_enum_slots_follow_catalogue_changes():
+    matcher = InstructionMatcher()
+    repo_id = uuid.uuid4()
+    case_id = uuid.uuid4()
+    # Learned before the instruction declared its enum: "大火" is plain text
+    matcher.add_instruction("大火炒菜", {"name": "cook", "parameters": {"firepower": "大火"}}, repository_id=repo_id, case_id=case_id)
+    assert matcher.match("烤箱炒菜", repository_id=repo_id) is not None
+
+    catalogue = build_slot_enums([
+        (repo_id, "cook", {"type": "object", "properties": {"firepower": {"type": "string", "enum": ["小火", "大火"]}}})
+    ])
+    assert matcher.update_slot_enums(repo_id, catalogue) == 1
+    assert matcher.update_slot_enums(repo_id, catalogue) == 0
+    assert matcher.match("小火炒菜", repository_id=repo_id)["result"]["parameters"] == {"firepower": "小火"}
+    assert matcher.match("烤箱炒菜", repository_id=repo_id) is None
+
+    # The snapshot keeps the enums its templates were built with
+    restored = InstructionMatcher.from_state(json.loads(json.dumps(matcher.export_state())))
+    assert restored.slot_enums == matcher.slot_enums
+    assert restored.match("小火炒菜", repository_id=repo_id)["result"]["parameters"] == {"firepower": "小火"}
+
+
+def test_costly_text_slots_stay_literal():
+    matcher = InstructionMatcher()
+    answer = {"name": "route", "parameters": {"a": "甲地", "b": "乙地", "c": "丙地", "d": "丁地"}}
+    template = matcher.generalize_instruction("从甲地经乙地和丙地到丁地", answer)
+    assert template["cost"] <= settings.INSTRUCTION_TEMPLATE_MAX_COST
+    assert len(template["slots"]) < 4
+    # Demoted values are kept as constants of the template
+    assert template["json_template"] == answer
+
+
+@pytest.mark.asyncio
+async def test_match_many_uses_matcher_then_one_mget(monkeypatch):
+    from app.services import feedback_service as feedback_module
+
+    class _FakeRedis:
+        def __init__(self):
+            self.mget_calls = []
+
+        async def mget(self, keys):
+            self.mget_calls.append(list(keys))
+            return [json.dumps({"response": '{"name": "tv_on"}'}) if i == 0 else None for i in range(len(keys))]
+
+    redis = _FakeRedis()
+    monkeypatch.setattr(feedback_module.RedisClient, "get_instance", staticmethod(lambda: redis))
+
+    service = InstructionMatcherService()
+    original_matcher = service.matcher
+    try:
+        service.matcher = InstructionMatcher()
+        service.matcher.add_instruction("把音量调到50", {"name": "volume_set", "parameters": {"value": 50}})
+
+        results = await service.match_many(["打开电视", "把音量调到20", "随便说说", "把音量调到20"])
+        assert [r["hit_source"] for r in results] == ["redis", "memory", None, "memory"]
+        assert results[0]["result"] == {"name": "tv_on"}
+        assert results[1]["result"]["parameters"]["value"] == 20
+        # Misses share one MGET; duplicates are matched once
+        assert len(redis.mget_calls) == 1 and len(redis.mget_calls[0]) == 2
+    finally:
+        service.matcher = original_matcher
@@ -0,0 +1,70 @@
+import random
+
+import pytest
+
+from app.services.intent_classifier import IntentClassifier, train_model
+
+
+def _samples(seed=0):
+    rng = random.Random(seed)
+    devices = ["空调", "音量", "灯光", "窗帘", "电视", "风扇"]
+    topics = ["天气", "新闻", "股票", "比分", "航班"]
+    samples = []
+    for _ in range(150):
+        samples.append((f"把{rng.choice(devices)}调到{rng.randint(1, 100)}", "instruction"))
+        samples.append((f"今天{rng.choice(topics)}怎么样{rng.randint(1, 1000)}", "search"))
+        samples.append((f"给我讲个笑话吧{rng.randint(1, 1000)}", "chat"))
+    return samples
+
+
+def test_confident_queries_skip_llm_and_others_defer(tmp_path):
+    classifier = IntentClassifier()
+    classifier.path = str(tmp_path / "intent.npz")
+    classifier._model = train_model(_samples(), dim=1 << 14, target_precision=0.97)
+
+    stats = classifier._model.stats
+    assert stats["holdout_accuracy"] >= 0.97
+    assert stats["threshold"] <= 1.0 and stats["coverage_at_threshold"] > 0.5
+    assert set(stats["label_counts"]) == {"instruction", "search", "chat"}
+
+    assert classifier.predict("把空调调到26")[0] == "instruction"
+    # Restricting the labels renormalizes over what the session allows
+    assert classifier.predict("把空调调到26", ["search", "chat"])[0] is None
+    label, confidence = classifier.predict("量子力学的哥本哈根诠释")
+    assert label is None or confidence >= classifier._model.threshold
+
+    runtime = classifier.stats()["runtime"]
+    assert runtime["confident"] + runtime["deferred_to_llm"] == 3
+
+    # Round-trips through the saved file
+    classifier._save(classifier._model)
+    reloaded = IntentClassifier()
+    reloaded.path = classifier.path
+    model = reloaded._read()
+    assert model.labels == classifier._model.labels
+    assert model.threshold == classifier._model.threshold
+
+
+@pytest.mark.asyncio
+async def test_remote_retrain_loads_published_model_without_retraining(tmp_path, monkeypatch):
+    published = train_model(_samples(), dim=1 << 12, target_precision=0.97)
+    previous = train_model(_samples(seed=1), dim=1 << 12, target_precision=0.97)
+    classifier = IntentClassifier()
+    classifier.path = str(tmp_path / "intent.npz")
+    classifier._model = previous
+
+    async def no_retrain(*args, **kwargs):
+        raise AssertionError("only the publishing worker trains")
+
+    monkeypatch.setattr(classifier, "retrain", no_retrain)
+    event = {"op": "retrained", "trained_at": published.stats["trained_at"]}
+
+    # The shared file is not there (yet): keep serving the previous model, flagged as stale
+    await classifier.apply_remote(event)
+    assert classifier._model is previous
+    assert classifier.stats()["stale_behind"] == published.stats["trained_at"]
+
+    classifier._save(published)
+    await classifier.apply_remote(event)
+    assert classifier._model.stats == published.stats
+    assert classifier.stats()["stale_behind"] is None
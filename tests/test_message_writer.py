@@ -0,0 +1,59 @@
+import uuid
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from app.services.message_writer import MessageWriter
+
+
+class _FakeDB:
+    """Records executemany calls; rows with content "bad" make an INSERT fail."""
+    def __init__(self, calls):
+        self.calls = calls
+
+    async def execute(self, stmt, params):
+        if stmt.is_insert and any(row["content"] == "bad" for row in params):
+            raise RuntimeError("constraint violation")
+        self.calls.append(("insert" if stmt.is_insert else "update", list(params)))
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+@pytest.mark.asyncio
+async def test_batches_inserts_and_embeddings_and_flushes_on_stop():
+    calls = []
+    writer = MessageWriter()
+    writer.session_factory = lambda: _FakeDB(calls)
+    session_id = str(uuid.uuid4())
+    metadata = {"hit_source": "llm"}
+
+    with patch("app.services.message_writer.vector_service.embed_documents",
+               AsyncMock(side_effect=lambda texts: [[0.1, 0.2] for _ in texts])):
+        await writer.start()
+        ids = [await writer.submit(session_id, "user", f"message {i}", metadata) for i in range(5)]
+        ids.append(await writer.submit(session_id, "assistant", "bad"))
+        metadata["message_id"] = ids[0]  # Later caller mutations don't leak into the queued row
+        assert writer.is_pending(ids[0])
+        await writer.stop()
+
+    inserts = [rows for kind, rows in calls if kind == "insert"]
+    updates = [rows for kind, rows in calls if kind == "update"]
+    # One multi-row INSERT failed on the bad row and was retried row by row
+    assert sum(len(rows) for rows in inserts) == 5
+    assert [str(row["id"]) for rows in inserts for row in rows] == ids[:5]
+    assert all("message_id" not in row["metadata_"] for rows in inserts for row in rows)
+    assert sum(len(rows) for rows in updates) == 5
+
+    stats = writer.stats()
+    assert stats["written"] == 5 and stats["failed"] == 1 and stats["embedded"] == 5
+    assert stats["queue_depth"] == 0 and not stats["running"]
+    assert not writer.is_pending(ids[0])
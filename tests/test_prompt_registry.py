@@ -0,0 +1,63 @@
+import json
+import os
+
+from app.services.prompt_registry import PromptRegistry
+
+
+def _write(path, config, mtime_ns):
+    path.write_text(json.dumps(config, ensure_ascii=False), encoding="utf-8")
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+CONFIG = {
+    "settings": {"provider_language_defaults": {"qwen": "zh"}},
+    "templates": {
+        "chat": {"en": "You are helpful.", "zh": "你是助手。"},
+        "search": {"en": "Answer from:\n{context_str}", "zh": "根据以下内容回答：\n{context_str}"}
+    },
+    "overrides": [
+        {"provider": "qwen", "model": "qwen-flash", "intent": "search", "templates": {"zh": "简短回答：{context_str}"}}
+    ]
+}
+
+
+def test_resolution_order_and_missing_config(tmp_path):
+    path = tmp_path / "prompts.json"
+    _write(path, CONFIG, 1_000_000_000)
+    registry = PromptRegistry(str(path))
+
+    assert registry.render("Qwen", "qwen-flash", "search", context_str="x") == "简短回答：x"
+    assert registry.render("qwen", "qwen-max", "search", context_str="x") == "根据以下内容回答：\nx"
+    assert registry.render("openai", None, "chat") == "You are helpful."
+    # Unknown language falls back to English; unknown intent to the caller's fallback
+    assert registry.render("openai", None, "chat", language="fr") == "You are helpful."
+    assert registry.render("openai", None, "rag") is None
+    # Missing keys leave the template unformatted instead of raising
+    assert registry.render("openai", None, "search") == "Answer from:\n{context_str}"
+
+    assert PromptRegistry(str(tmp_path / "missing.json")).render("openai", None, "chat") is None
+
+
+def test_reloads_only_when_content_changes(tmp_path):
+    path = tmp_path / "prompts.json"
+    _write(path, CONFIG, 1_000_000_000)
+    registry = PromptRegistry(str(path))
+    registry.ensure_loaded()
+    version = registry.version
+
+    assert registry.refresh() is False  # Unchanged stat: no read at all
+    _write(path, CONFIG, 2_000_000_000)
+    assert registry.refresh() is False  # Touched, same hash: not re-parsed
+    assert registry.version == version
+
+    edited = json.loads(json.dumps(CONFIG))
+    edited["templates"]["chat"]["en"] = "You are terse."
+    _write(path, edited, 3_000_000_000)
+    assert registry.refresh() is True
+    assert registry.render("openai", None, "chat") == "You are terse."
+
+    # A broken edit keeps the previous version
+    path.write_text("{not json", encoding="utf-8")
+    os.utime(path, ns=(4_000_000_000, 4_000_000_000))
+    assert registry.refresh() is False
+    assert registry.render("openai", None, "chat") == "You are terse."
@@ -0,0 +1,46 @@
+from app.services.query_normalizer import normalize_query, normalize_query_spans, normalize_value, query_numbers
+
+
+def test_numerals_width_and_punctuation():
+    assert normalize_query("音量调到三十七") == "音量调到37"
+    assert normalize_query("音量调到37。") == "音量调到37"
+    assert normalize_query("音量调到３７") == "音量调到37"
+    assert normalize_query("温度二十五点五度") == "温度25.5度"
+    assert normalize_query("音量一百五") == "音量150"
+    assert normalize_query("二零二四年") == "2024年"
+    # Two adjacent digits are an approximate count, not a number
+    assert normalize_query("三四个") == "三四个"
+    assert normalize_query("三五天") == "三五天"
+    # Times of day are read alike
+    assert normalize_query("一点半") == "1点半"
+    assert normalize_query("两点半") == "2点半"
+    assert query_numbers("音量调到三十七，温度２５度") == query_numbers("温度25度 音量调到37") == ["25", "37"]
+
+
+def test_fillers_and_whitespace():
+    assert normalize_query("请帮我把音量调到五十吧！") == "把音量调到50"
+    assert normalize_query("音量 调到 50") == "音量调到50"
+    assert normalize_query("  open   the door , please ") == "open the door"
+    # Filler-only input is kept as is rather than collapsing to ""
+    assert normalize_query("吧") == "吧"
+    # Only stand-alone fillers go: 请 before a request verb, particles not ending a word
+    assert normalize_query("请假") == "请假"
+    assert normalize_query("请问天气怎么样") == "请问天气怎么样"
+    assert normalize_query("麻烦你打开空调啊") == "打开空调"
+    assert normalize_query("导航去酒吧") == "导航去酒吧"
+
+
+def test_idioms_are_not_numbers():
+    assert normalize_query("声音调大一点") == "声音调大一点"
+    assert normalize_query("十分安静") == "十分安静"
+    # Numerals are only converted as quantities (before a measure word or unit), not in names
+    assert normalize_value("三里屯 北") == "三里屯北"
+    assert normalize_query("导航到五道口") == "导航到五道口"
+    assert normalize_query("打开三号灯") == "打开3号灯"
+
+
+def test_spans_map_back_to_original():
+    normalized, source, starts, ends = normalize_query_spans("请把温度调到二十六度")
+    assert normalized == "把温度调到26度"
+    i = normalized.index("2")
+    assert source[starts[i]:ends[len(normalized) - 1]] == "二十六度"
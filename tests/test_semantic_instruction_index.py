@@ -0,0 +1,89 @@
+import uuid
+import numpy as np
+import pytest
+from app.core.config import settings
+from app.services import semantic_instruction_index as sii
+from app.services.semantic_instruction_index import SemanticInstructionIndex
+
+VOCAB = ["open", "close", "door", "window", "volume", "set", "to", "please", "the", "music"]
+
+
+def _embed(text):
+    """Toy bag-of-words embedding over a fixed vocabulary."""
+    words = text.lower().split()
+    return np.array([float(words.count(w)) for w in VOCAB], dtype=np.float32)
+
+
+@pytest.fixture
+def index(monkeypatch):
+    monkeypatch.setattr(settings, "SEMANTIC_INSTRUCTION_ENABLE", True)
+    monkeypatch.setattr(settings, "SEMANTIC_INSTRUCTION_THRESHOLD", 0.85)
+
+    async def embed_questions(self, questions):
+        return [sii._normalize(_embed(q)) for q in questions]
+
+    async def embed_query(text, provider=None, model=None):
+        return _embed(text).tolist()
+
+    monkeypatch.setattr(SemanticInstructionIndex, "_embed_questions", embed_questions)
+    monkeypatch.setattr(sii.vector_service, "embed_query", embed_query)
+    return SemanticInstructionIndex()
+
+
+@pytest.mark.asyncio
+async def test_semantic_hit_threshold_and_number_guard(index):
+    repo_id = uuid.uuid4()
+    index.upsert("case:1", repo_id, "open the door", '{"name": "door_open"}')
+    index.upsert("case:2", None, "set volume to 30", '{"name": "volume_set", "parameters": {"value": 30}}')
+    await index._drain_task
+
+    hit = await index.search("please open the door", repository_id=repo_id)
+    assert hit["source"] == "semantic"
+    assert hit["response"] == '{"name": "door_open"}'
+
+    # Other repositories only see global pairs
+    assert await index.search("please open the door", repository_id=uuid.uuid4()) is None
+    assert await index.search("close the window", repository_id=repo_id) is None
+    # Same wording but different numbers would replay wrong parameters
+    assert await index.search("set volume to 70", repository_id=repo_id) is None
+    assert (await index.search("set volume to 30", repository_id=repo_id))["repository_id"] is None
+    # Numbers are compared after normalization: 三十 is 30
+    assert await index.search("set volume to 三十", repository_id=repo_id) is not None
+
+    stats = index.stats()
+    assert stats["lookups"] == 6
+    assert stats["hits"] == 3
+    assert stats["rejected_numbers"] == 1
+    assert sum(stats["score_histogram"]) == 6
+
+
+@pytest.mark.asyncio
+async def test_remove_and_sync_cases(index):
+    repo_id = uuid.uuid4()
+    case_a, case_b, case_c = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    index.sync_cases([
+        (case_a, repo_id, "open the door", {"name": "door_open"}),
+        (case_b, repo_id, "close the window", {"name": "window_close"}),
+        (case_c, repo_id, "play the music", {"name": "music_play"}),
+    ])
+    await index._drain_task
+
+    # Removing a middle row moves the last one into its slot
+    index.remove(index.case_key(case_a))
+    assert await index.search("open the door", repository_id=repo_id) is None
+    assert (await index.search("play the music", repository_id=repo_id))["response"] == '{"name": "music_play"}'
+
+    # A resync drops cases that are no longer live
+    index.sync_cases([(case_c, repo_id, "play the music", {"name": "music_play"})])
+    assert await index.search("close the window", repository_id=repo_id) is None
+    assert index.stats()["entries"] == 1
+    assert index.stats()["pending"] == 0
+
+
+@pytest.mark.asyncio
+async def test_disabled_index_is_inert(monkeypatch):
+    monkeypatch.setattr(settings, "SEMANTIC_INSTRUCTION_ENABLE", False)
+    index = SemanticInstructionIndex()
+    index.upsert("case:1", None, "open the door", "{}")
+    assert index.stats()["pending"] == 0
+    assert await index.search("open the door") is None
@@ -0,0 +1,88 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from app.core.single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_calls_share_one_upstream_call():
+    flights = SingleFlight()
+    release = asyncio.Event()
+    calls = []
+
+    async def upstream(value):
+        calls.append(value)
+        await release.wait()
+        return {"intent": value}
+
+    key = flights.key("gpt-4o", "打开空调")
+    waiters = [asyncio.create_task(flights.run("router", key, lambda: upstream("instruction"))) for _ in range(5)]
+    other = asyncio.create_task(flights.run("router", flights.key("gpt-4o", "讲个笑话"), lambda: upstream("chat")))
+    await asyncio.sleep(0)
+
+    # The first caller gives up (client disconnect): the others still get the result
+    waiters[0].cancel()
+    release.set()
+    results = await asyncio.gather(*waiters[1:], other)
+    assert calls == ["instruction", "chat"]
+    assert all(r is results[0] for r in results[1:4]) and results[4] == {"intent": "chat"}
+    assert flights.stats()["kinds"]["router"] == {"calls": 6, "coalesced": 4}
+    assert flights.stats()["in_flight"] == 0
+
+    # Failures reach every waiter; the next call after completion runs again
+    async def failing():
+        await asyncio.sleep(0)
+        raise RuntimeError("provider down")
+
+    outcomes = await asyncio.gather(*(flights.run("search", "q", failing) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(o, RuntimeError) for o in outcomes)
+    assert await flights.run("search", "q", AsyncMock(return_value=[])) == []
+
+
+@pytest.mark.asyncio
+async def test_search_coalesced_by_normalized_query():
+    from app.services.search_service import search_service
+    provider = AsyncMock(return_value=[{"title": "t", "href": "h", "body": "b"}])
+    with patch.object(search_service, "_search", provider):
+        first, second = await asyncio.gather(search_service.search("今天天气怎么样"), search_service.search("今天天气怎么样？"))
+    assert first is second
+    provider.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_caller_after_abandoned_flight_starts_a_new_call():
+    flights = SingleFlight()
+    release = asyncio.Event()
+    calls = 0
+
+    async def upstream():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return calls
+
+    abandoned = asyncio.create_task(flights.run("embedding", "k", upstream))
+    await asyncio.sleep(0)
+    abandoned.cancel()
+    # Same key right away: runs after the abandoned caller gave up, before the cancelled call has unwound
+    fresh = asyncio.create_task(flights.run("embedding", "k", upstream))
+    with pytest.raises(asyncio.CancelledError):
+        await abandoned
+    await asyncio.sleep(0)
+    release.set()
+    assert await fresh == 2
+    assert flights.stats()["kinds"]["embedding"] == {"calls": 2, "coalesced": 0}
+
+
+def test_llm_fingerprint_separates_endpoints_and_temperatures():
+    from langchain_openai import ChatOpenAI
+    from app.core.llm_factory import LLMFactory
+
+    def llm(base_url, temperature=0.1):
+        return ChatOpenAI(api_key="sk-test", base_url=base_url, model="deepseek-chat", temperature=temperature)
+
+    same = LLMFactory.fingerprint(llm("https://api.deepseek.com/v1"))
+    assert same == LLMFactory.fingerprint(llm("https://api.deepseek.com/v1"))
+    assert same != LLMFactory.fingerprint(llm("https://proxy.example.com/v1"))
+    assert same != LLMFactory.fingerprint(llm("https://api.deepseek.com/v1", temperature=0.7))
@@ -0,0 +1,79 @@
+import asyncio
+import uuid
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.services.dialogue_manager import DialogueManager
+
+
+@pytest.mark.asyncio
+async def test_cancelled_stream_closes_llm_and_persists_partial_response():
+    dm = DialogueManager()
+    upstream_closed = asyncio.Event()
+    first_chunk_sent = asyncio.Event()
+
+    async def astream(messages):
+        try:
+            yield MagicMock(content="Partial ")
+            first_chunk_sent.set()
+            await asyncio.sleep(3600)  # The provider is still generating
+            yield MagicMock(content="never sent")
+        finally:
+            upstream_closed.set()
+
+    llm = MagicMock()
+    llm.astream = MagicMock(side_effect=astream)
+    request_memory = AsyncMock()
+    request_memory.get_short_term_memory.return_value = []
+    request_memory.save_message.return_value = "user-msg-id"
+    detached_memory = AsyncMock()
+
+    received = []
+
+    async def consume():
+        async for chunk in dm.stream_process_request(str(uuid.uuid4()), "讲个故事", "user_1", AsyncMock()):
+            received.append(chunk)
+
+    with patch("app.services.dialogue_manager.MemoryManager", side_effect=[request_memory, detached_memory]), \
+         patch("app.services.dialogue_manager.AsyncSessionLocal", MagicMock()), \
+         patch("app.services.dialogue_manager.RAGEngine"), \
+         patch("app.services.dialogue_manager.LLMFactory") as MockLLMFactory, \
+         patch.object(dm, "_load_session", AsyncMock(return_value=({}, "zh"))), \
+         patch.object(dm, "_save_user_message", AsyncMock(return_value="user-msg-id")), \
+         patch.object(dm, "_load_mid_term_memory", AsyncMock(return_value=[])), \
+         patch.object(dm, "_route_intent", AsyncMock(return_value=("chat", 80, "router", None))):
+        MockLLMFactory.get_llm_for_scenario.return_value = llm
+
+        task = asyncio.create_task(consume())
+        await asyncio.wait_for(first_chunk_sent.wait(), timeout=1)
+        # What the endpoint's disconnect watcher does
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.wait_for(upstream_closed.wait(), timeout=1)
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+    assert received == ["Partial "]
+    detached_memory.save_message.assert_awaited_once()
+    args, kwargs = detached_memory.save_message.await_args
+    assert args[1:4] == ("assistant", "Partial ", "user_1")
+    assert kwargs["metadata"]["cancelled"] is True
+    assert kwargs["metadata"]["reply_to"] == "user-msg-id"
+    # Not treated as a failure: no fallback chat
+    assert llm.astream.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_disconnect_watcher_cancels_pipeline(monkeypatch):
+    from app.api.endpoints import _cancel_on_disconnect
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "STREAM_DISCONNECT_POLL_SECONDS", 0.01)
+    raw_request = MagicMock()
+    raw_request.is_disconnected = AsyncMock(side_effect=[False, False, True])
+    pipeline = asyncio.create_task(asyncio.sleep(3600))
+
+    await asyncio.wait_for(_cancel_on_disconnect(raw_request, pipeline), timeout=1)
+    with pytest.raises(asyncio.CancelledError):
+        await pipeline
+    assert raw_request.is_disconnected.await_count == 3
@@ -0,0 +1,61 @@
+import asyncio
+import json
+import uuid
+import pytest
+
+from app.core import tracing
+from app.core.config import settings
+from app.core.tracing import span, start_trace, traced
+
+
+@traced("stage.child")
+async def _child():
+    with span("stage.grandchild", rows=3):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_nested_spans_across_tasks_and_otlp_export(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "TRACING_EXPORT_PATH", str(tmp_path / "traces.jsonl"))
+    monkeypatch.setattr(settings, "TRACING_OTLP_ENDPOINT", None)
+    # Outside a trace spans are free no-ops
+    assert span("ignored") is tracing._NOOP
+
+    async def request():
+        trace = start_trace("dialogue.request", str(uuid.uuid4()))
+        with span("stage.parent"):
+            await asyncio.gather(_child(), asyncio.create_task(_child()))
+        with pytest.raises(ValueError):
+            with span("stage.failing"):
+                raise ValueError("boom")
+        return trace, trace.finish()
+
+    trace, tree = await asyncio.create_task(request())
+    assert tree["name"] == "dialogue.request"
+    parent, failing = tree["children"]
+    assert [c["name"] for c in parent["children"]] == ["stage.child", "stage.child"]
+    assert parent["children"][0]["children"][0]["attributes"] == {"rows": 3}
+    assert failing["error"] == "ValueError: boom"
+
+    await tracing.span_exporter.flush()
+    document = json.loads((tmp_path / "traces.jsonl").read_text().splitlines()[-1])
+    # Earlier tests' traces may share the batch
+    spans = [s for s in document["resourceSpans"][0]["scopeSpans"][0]["spans"] if s["traceId"] == trace.trace_id]
+    assert len(spans) == 7
+    by_id = {s["spanId"]: s for s in spans}
+    grandchild = next(s for s in spans if s["name"] == "stage.grandchild")
+    assert by_id[grandchild["parentSpanId"]]["name"] == "stage.child"
+    assert grandchild["attributes"] == [{"key": "rows", "value": {"intValue": "3"}}]
+    assert int(grandchild["endTimeUnixNano"]) >= int(grandchild["startTimeUnixNano"])
+
+
+def test_export_file_rotates_past_max_bytes(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(settings, "TRACING_EXPORT_PATH", str(path))
+    monkeypatch.setattr(settings, "TRACING_EXPORT_MAX_BYTES", 10)
+    exporter = tracing.SpanExporter()
+    for line in ("first-batch", "second-batch", "third-batch"):
+        exporter._append(line)
+    # Only the current file and one previous file are kept
+    assert path.read_text() == "third-batch\n"
+    assert (tmp_path / "traces.jsonl.1").read_text() == "second-batch\n"